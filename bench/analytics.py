@@ -0,0 +1,163 @@
+# Analytics benchmark: ingest rate of completed deals and reviews into the running totals, and how
+# fast /sales answers as the history grows.
+#
+#   python bench/analytics.py
+#   python bench/analytics.py --checkpoints 10000,100000,1000000 --max-report-ms 5
+#
+# Synthetic deals go through record_sale as deal_completed records them, --concurrency at a time,
+# and about --review-rate of them get a review through record_review. Buyers come back often
+# enough for the repeat-buyer count to matter. At every checkpoint, a cumulative number of deals, the report has
+# the ingest rate since the last one, how long sales_report takes for a guild, the store's size
+# and, up to --export-up-to deals, how long a guild's CSV export takes. At the end the totals of
+# one guild are checked against the deals the benchmark made for it. The largest checkpoint is
+# the 10M deals of the request, which takes a while: the smaller ones are printed as they go.
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+from harness import import_rev
+
+ITEMS = [f"Item {number}" for number in range(50)]
+
+class Deals:
+    # The deals made so far for one guild, to check the totals against
+    def __init__(self):
+        self.count = 0
+        self.cents = 0
+        self.buyers = {}  # buyer_id -> deals
+        self.stars = [0] * 6
+
+def synthetic_deal(rev, channel_id, options):
+    guild_id = random.randrange(options.guilds) + 1
+    buyer_id = random.randrange(options.buyers) + 1
+    lines = {}
+    for item in random.sample(ITEMS, random.randint(1, 3)):
+        quantity = random.randint(1, 5)
+        price = 500 + 250 * ITEMS.index(item)
+        lines[item] = rev.CartLine(quantity, price, quantity * price)
+    cart = rev.Cart(lines, sum(line.subtotal_cents for line in lines.values()))
+    method = random.choice(options.methods)
+    return {"channel_id": channel_id, "guild_id": guild_id, "buyer_id": buyer_id, "payment_method": method}, cart
+
+async def complete(rev, channel_id, options, checked):
+    store = rev.ticket_store
+    ticket, cart = synthetic_deal(rev, channel_id, options)
+    stars = random.choices(range(1, 6), (1, 1, 2, 5, 11))[0] if random.random() < options.review_rate else None
+    if ticket["guild_id"] == 1:
+        checked.count += 1
+        checked.cents += cart.total_cents
+        checked.buyers[ticket["buyer_id"]] = checked.buyers.get(ticket["buyer_id"], 0) + 1
+        if stars:
+            checked.stars[stars] += 1
+    await store.record_sale(ticket, cart)
+    if stars:
+        await store.record_review(channel_id, ticket["guild_id"], ticket["buyer_id"], stars)
+    return stars is not None
+
+async def ingest(rev, start, end, options, checked):
+    # --concurrency deals at a time, completed in different tickets at once
+    reviews = 0
+    for window in range(start, end, options.concurrency):
+        reviews += sum(await asyncio.gather(*(
+            complete(rev, channel_id, options, checked) for channel_id in range(window, min(end, window + options.concurrency))
+        )))
+    return reviews
+
+async def timed(call, repeat=20):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = await call()
+    return result, (time.perf_counter() - started) / repeat
+
+async def run(options):
+    rev = import_rev(options.data_dir)
+    store = rev.ticket_store
+    checked = Deals()
+    checkpoints = []
+    done = 0
+    for checkpoint in options.checkpoints:
+        started = time.perf_counter()
+        reviews = await ingest(rev, done + 1, checkpoint + 1, options, checked)
+        seconds = time.perf_counter() - started
+        report, report_seconds = await timed(lambda: store.sales_report(1))
+        result = {
+            "deals": checkpoint,
+            "deals_per_second": round((checkpoint - done) / seconds),
+            "reviews": reviews,
+            "report_ms": round(report_seconds * 1000, 3),
+            "store_mb": round(sum(os.path.getsize(path) for path in (rev.STORE_FILE, rev.STORE_FILE + "-wal") if os.path.exists(path)) / 2**20, 1),
+            "export_ms": None
+        }
+        if checkpoint <= options.export_up_to:
+            started = time.perf_counter()
+            file = await store.export_csv("sales", 1)
+            result["export_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            result["export_kb"] = round(os.fstat(file.fileno()).st_size / 1024, 1)
+            file.close()
+        checkpoints.append(result)
+        print_checkpoint(result)
+        done = checkpoint
+
+    totals = report["summary"]
+    expected = {
+        "deals": (checked.count, checked.cents),
+        "buyers": (len(checked.buyers), 0),
+        "repeat_buyers": (sum(deals > 1 for deals in checked.buyers.values()), 0),
+        "reviews": (sum(checked.stars), 0),
+        "stars": (sum(stars * count for stars, count in enumerate(checked.stars)), 0)
+    }
+    mismatched = [name for name, value in expected.items() if tuple(totals.get(name, (0, 0))) != value]
+    return {"guilds": options.guilds, "checkpoints": checkpoints, "mismatched_totals": mismatched}
+
+def print_checkpoint(result):
+    export = f"{result['export_ms']} ms for {result['export_kb']} KiB" if result["export_ms"] is not None else "-"
+    print(
+        f"{result['deals']:>10} deals  {result['deals_per_second']:>7} deals/s  report {result['report_ms']:>7} ms  "
+        f"store {result['store_mb']:>8} MiB  export {export}"
+    )
+
+def print_report(report):
+    if report["mismatched_totals"]:
+        print(f"Totals that don't match the deals made: {', '.join(report['mismatched_totals'])}")
+    else:
+        print("Every total for guild 1 matches the deals made for it")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure ingesting deals into the sales analytics and reading them back.")
+    parser.add_argument("--checkpoints", default="10000,100000,1000000,10000000", help="cumulative deal counts to report at")
+    parser.add_argument("--concurrency", type=int, default=32, help="deals being recorded at once")
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--buyers", type=int, default=2000000, help="distinct buyers the deals are spread over")
+    parser.add_argument("--review-rate", type=float, default=0.3, help="fraction of deals that get a review")
+    parser.add_argument("--export-up-to", type=int, default=1000000, help="largest checkpoint to time a CSV export at")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where the store is kept, a new temporary directory by default")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-report-ms", type=float, help="fail if sales_report takes longer at any checkpoint")
+    options = parser.parse_args(argv)
+    options.checkpoints = sorted(int(checkpoint) for checkpoint in options.checkpoints.split(","))
+    return options
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    options.methods = list(import_rev(options.data_dir).PAYMENT_DETAILS) + ["PayPal"]
+    report = asyncio.run(run(options))
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    failures = [f"totals don't match: {', '.join(report['mismatched_totals'])}"] if report["mismatched_totals"] else []
+    for result in report["checkpoints"]:
+        if options.max_report_ms is not None and result["report_ms"] > options.max_report_ms:
+            failures.append(f"sales_report took {result['report_ms']} ms at {result['deals']} deals, over {options.max_report_ms} ms")
+    for failure in failures:
+        print(f"LIMIT EXCEEDED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# Catalog benchmark: what rendering a page of the item menu and searching the catalog cost as the
+# stock grows from a thousand items to a hundred thousand.
+#
+#   python bench/catalog.py
+#   python bench/catalog.py --sizes 1000,10000,100000,1000000 --max-growth 2
+#
+# For each of --sizes a Catalog is built over that many items spread over --categories. The item
+# menu is then rendered as ItemSelectionView does for a shopper, down to the components that go out
+# in the request, on the first, middle and last page of the whole catalog and of one category. Each
+# page is timed cold, with its cached options dropped first as add_item/remove_item would, and warm.
+# The old menu, one option per item in stock, is timed alongside for comparison. Prefix searches
+# as the /purchase and /remove_item autocomplete makes them, and adding and removing an item, are
+# timed too. Last, every add and remove is checked to show up on the next page rendered.
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from harness import import_rev
+
+ADJECTIVES = ["Ancient", "Blue", "Cursed", "Deluxe", "Epic", "Frozen", "Golden", "Heavy", "Iron", "Jade", "Lucky", "Mystic"]
+NOUNS = ["Amulet", "Blade", "Crate", "Dagger", "Elixir", "Gem", "Helmet", "Key", "Lantern", "Map", "Potion", "Ring", "Shield"]
+
+def build_stock(size, categories):
+    return {
+        f"{random.choice(ADJECTIVES)} {random.choice(NOUNS)} {number}": {
+            "price_cents": random.randrange(100, 100000),
+            "description": f"Item number {number}",
+            "category": f"Category {number % categories}"
+        }
+        for number in range(size)
+    }
+
+def per_call_us(call, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        call()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+def measure(rev, size, options):
+    stock = build_stock(size, options.categories)
+    started = time.perf_counter()
+    catalog = rev.Catalog(dict(stock))
+    build_ms = (time.perf_counter() - started) * 1000
+
+    def render(page, category):
+        return rev.ItemSelectionView(catalog, 1, 2, page, category).to_components()
+
+    def cold(page, category):
+        catalog.invalidate(category)
+        return render(page, category)
+
+    views = {}
+    for category in (None, "Category 0"):
+        last = catalog.page_count(category) - 1
+        for where, page in (("first", 0), ("middle", last // 2), ("last", last)):
+            name = f"{'all' if category is None else 'category'}_{where}"
+            views[name] = {
+                "cold_us": round(per_call_us(lambda: cold(page, category), options.repeat), 1),
+                "warm_us": round(per_call_us(lambda: render(page, category), options.repeat), 1)
+            }
+
+    def old_menu():
+        # What ItemSelectionView built before, which Discord rejects past 25 options anyway
+        return [rev.discord.SelectOption(label=name, value=name, description=item["description"]) for name, item in stock.items()]
+
+    old_repeat = max(1, options.repeat * 1000 // size)
+    names = list(stock)
+    prefixes = [random.choice(names)[:random.randint(1, 8)].lower() for _ in range(options.repeat)]
+    search_matches = sum(len(catalog.search(prefix)) for prefix in prefixes)
+    prefix_iter = iter(prefixes * 2)
+
+    item = {"price_cents": 100, "description": "New", "category": "Category 0"}
+    stale = 0
+    for number in range(options.changes):
+        name = f"Aaa New Item {number}"
+        catalog.add(name, dict(item))
+        stale += name not in [option.value for option in catalog.page_options(None, 0)]
+        catalog.remove(name)
+        stale += name in [option.value for option in catalog.page_options(None, 0)]
+
+    def add_remove():
+        catalog.add("Aaa Timed Item", dict(item))
+        catalog.remove("Aaa Timed Item")
+
+    return {
+        "items": size,
+        "build_ms": round(build_ms, 1),
+        "pages": catalog.page_count(),
+        "views": views,
+        "old_menu_us": round(per_call_us(old_menu, old_repeat), 1),
+        "search_us": round(per_call_us(lambda: catalog.search(next(prefix_iter)), options.repeat), 1),
+        "search_matches": round(search_matches / len(prefixes), 1),
+        "add_remove_us": round(per_call_us(add_remove, options.repeat), 1),
+        "stale_pages": stale
+    }
+
+async def run(options):
+    rev = import_rev(options.data_dir)  # The views need a running loop
+    return {"sizes": [measure(rev, size, options) for size in options.sizes]}
+
+def slowest_view(result):
+    return max(view["cold_us"] for view in result["views"].values())
+
+def print_report(report):
+    print(
+        f"{'items':>8}{'pages':>7}{'build ms':>10}{'page cold us':>14}{'page warm us':>14}"
+        f"{'old menu us':>13}{'search us':>11}{'add+remove us':>15}"
+    )
+    for result in report["sizes"]:
+        warm = max(view["warm_us"] for view in result["views"].values())
+        print(
+            f"{result['items']:>8}{result['pages']:>7}{result['build_ms']:>10}{slowest_view(result):>14}{warm:>14}"
+            f"{result['old_menu_us']:>13}{result['search_us']:>11}{result['add_remove_us']:>15}"
+        )
+    print(f"Slowest of first, middle and last page, whole catalog and one category; page rendering grew {report['growth']}x")
+    stale = sum(result["stale_pages"] for result in report["sizes"])
+    print(f"{stale} pages rendered stale after an add or remove")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure rendering catalog pages and searching the catalog as it grows.")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="items in the catalog, comma separated")
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=200, help="times each page, search and change is timed")
+    parser.add_argument("--changes", type=int, default=50, help="items added and removed to check the cached pages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where the bot keeps its files, a new temporary directory by default")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-growth", type=float, help="fail if a page at the largest size takes this many times longer than at the smallest")
+    parser.add_argument("--max-page-us", type=float, help="fail if rendering a page cold takes longer at any size")
+    options = parser.parse_args(argv)
+    options.sizes = sorted(int(size) for size in options.sizes.split(","))
+    return options
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    report = asyncio.run(run(options))
+    report["growth"] = round(slowest_view(report["sizes"][-1]) / slowest_view(report["sizes"][0]), 2)
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    failures = [
+        f"{result['stale_pages']} stale pages with {result['items']} items" for result in report["sizes"] if result["stale_pages"]
+    ]
+    if options.max_growth is not None and report["growth"] > options.max_growth:
+        failures.append(f"page rendering grew {report['growth']}x, over {options.max_growth}x")
+    for result in report["sizes"]:
+        if options.max_page_us is not None and slowest_view(result) > options.max_page_us:
+            failures.append(f"a page took {slowest_view(result)} us with {result['items']} items, over {options.max_page_us} us")
+    for failure in failures:
+        print(f"LIMIT EXCEEDED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
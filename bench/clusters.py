@@ -0,0 +1,74 @@
+# Runs rev.py as a multi-process deployment offline and measures total interaction throughput.
+# Starts one harness process per cluster with SHARD_COUNT, CLUSTER_COUNT and CLUSTER_ID set the way
+# run_clusters() sets them. The processes share one DATA_DIR, so tickets, carts, deals and cluster
+# locks go through the same store as in production. Each process runs its share of the shoppers
+# against its own FakeDiscord, on guilds that hash to its shard.
+#
+#   python bench/clusters.py --clusters 4 --users 2000 --ramp 60
+#
+# Any other option is passed on to bench/harness.py.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HARNESS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "harness.py")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the offline harness as N cluster processes sharing one store.")
+    parser.add_argument("--clusters", type=int, default=2)
+    parser.add_argument("--users", type=int, default=400, help="virtual shoppers over all clusters")
+    parser.add_argument("--setup-time", type=float, default=10.0, help="seconds the clusters get to open their storefronts")
+    parser.add_argument("--data-dir", help="shared by every cluster, a new temporary directory by default")
+    options, harness_args = parser.parse_known_args(argv)
+    data_dir = options.data_dir or tempfile.mkdtemp(prefix="rev-clusters-")
+    reports_dir = tempfile.mkdtemp(prefix="rev-cluster-reports-")
+    start_at = time.time() + options.setup_time
+
+    processes = []
+    for cluster_id in range(options.clusters):
+        users = options.users // options.clusters + (cluster_id < options.users % options.clusters)
+        env = dict(
+            os.environ, DATA_DIR=data_dir, SHARD_COUNT=str(options.clusters), CLUSTER_COUNT=str(options.clusters),
+            CLUSTER_ID=str(cluster_id), METRICS_PORT="0"
+        )
+        report = os.path.join(reports_dir, f"cluster-{cluster_id}.json")
+        command = [
+            sys.executable, HARNESS, "--users", str(users), "--data-dir", data_dir, "--json", report,
+            "--start-at", str(start_at), *harness_args
+        ]
+        processes.append((cluster_id, report, subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)))
+
+    reports = []
+    for cluster_id, report, process in processes:
+        process.wait()
+        if not os.path.exists(report):
+            print(f"Cluster {cluster_id} exited with {process.returncode} and no report", file=sys.stderr)
+            return 1
+        with open(report) as file:
+            reports.append((cluster_id, json.load(file)))
+
+    print(f"{'cluster':<10}{'shoppers':>10}{'failed':>8}{'interactions':>14}{'per second':>12}{'ack p99 ms':>12}{'purchase p99 ms':>17}")
+    for cluster_id, report in reports:
+        print(
+            f"{cluster_id:<10}{report['completed']:>10}{report['failed']:>8}{report['interactions']:>14}"
+            f"{report['interactions_per_second']:>12}{report['acknowledgement'].get('p99_ms', '-'):>12}"
+            f"{report['steps'].get('purchase', {}).get('p99_ms', '-'):>17}"
+        )
+    # The clusters start together, so the slowest one is the wall time of the whole run
+    interactions = sum(report["interactions"] for _, report in reports)
+    seconds = max(report["seconds"] for _, report in reports)
+    completed = sum(report["completed"] for _, report in reports)
+    failed = sum(report["failed"] for _, report in reports)
+    print(f"Total: {completed}/{options.users} shoppers completed, {interactions} interactions in {seconds}s, "
+          f"{interactions / seconds if seconds else 0.0:.1f} interactions/s")
+    for cluster_id, report in reports:
+        for error, count in report["errors"].items():
+            print(f"Cluster {cluster_id} FAILED x{count}: {error}")
+    return 1 if failed or any(process.returncode for _, _, process in processes) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
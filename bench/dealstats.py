@@ -0,0 +1,146 @@
+# Deal stats memory benchmark: load time and RSS of the binary deal stats against the old
+# dict-of-dicts loaded from deal_data.json, from thousands of customers to millions.
+#
+#   python bench/dealstats.py
+#   python bench/dealstats.py --sizes 100000,1000000,5000000 --max-load-ms 5 --max-memory 100
+#
+# For each size the same customers are written both ways, deal_stats.bin with write_deal_stats and
+# deal_data.json laid out as save_deal_data wrote it. Every load then runs in a fresh process, so
+# its RSS isn't mixed up with anything loaded before: rev is imported first, then the file is
+# loaded and --lookups random customers are read. RSS is taken after the lookups, by which time
+# the mapped snapshot has the pages those touched paged in. The one-time import of the legacy
+# file into a new snapshot, which DealLedger does when there is no snapshot yet, is timed too.
+import argparse
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from harness import current_rss, import_rev
+from ledger import build_snapshot
+
+MODES = ("legacy", "stats", "import")
+
+def write_legacy(directory, ids, cents, deals):
+    path = os.path.join(directory, "deal_data.json")
+    users = {
+        str(user_id): {"deals_completed": count, "total_spent": total / 100}
+        for user_id, total, count in zip(ids, cents, deals)
+    }
+    with open(path, "w") as file:
+        json.dump(users, file, indent=4)
+    return path
+
+def measure_load(mode, directory, lookups):
+    # Runs in the child process. Returns load seconds, RSS growth and seconds per lookup. rev gets
+    # a data directory of its own, it would otherwise map this snapshot when it's imported.
+    rev = import_rev(tempfile.mkdtemp(dir=directory))
+    stats_path = os.path.join(directory, "deal_stats.bin")
+    legacy_path = os.path.join(directory, "deal_data.json")
+    with open(stats_path, "rb") as file:
+        count = rev.DEAL_STATS_HEADER.unpack(file.read(rev.DEAL_STATS_HEADER.size))[3]
+    keys = [1000 + 2 * random.randrange(count) for _ in range(lookups)]  # Customers build_snapshot wrote
+    gc.collect()
+    rss = current_rss()
+    started = time.perf_counter()
+    if mode == "legacy":
+        with open(legacy_path) as file:
+            users = json.load(file)
+        get = lambda user_id: users.get(str(user_id))
+    elif mode == "stats":
+        stats, _ = rev.DealStats.open(stats_path)
+        get = stats.get
+    else:
+        imported_dir = tempfile.mkdtemp(dir=directory)
+        ledger = rev.DealLedger(
+            os.path.join(imported_dir, "deal_stats.bin"), os.path.join(imported_dir, "deal_ledger.jsonl"), legacy_path
+        )
+        get = ledger.load().get
+    load_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    found = sum(get(user_id) is not None for user_id in keys)
+    lookup_seconds = (time.perf_counter() - started) / max(1, lookups)
+    return {"load_seconds": load_seconds, "rss": current_rss() - rss, "lookup_seconds": lookup_seconds, "found": found}
+
+def run_child(mode, directory, options):
+    result = subprocess.run(
+        [
+            sys.executable, os.path.abspath(__file__), "--child", mode, "--data-dir", directory,
+            "--lookups", str(options.lookups), "--seed", str(options.seed)
+        ],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def measure(rev, size, options):
+    directory = tempfile.mkdtemp(prefix=f"rev-dealstats-{size}-", dir=options.data_dir)
+    _, ids, cents, deals = build_snapshot(rev, directory, size)
+    write_legacy(directory, ids, cents, deals)
+    results = {mode: run_child(mode, directory, options) for mode in MODES}
+    legacy, stats, imported = results["legacy"], results["stats"], results["import"]
+    return {
+        "customers": size,
+        "legacy_load_ms": round(legacy["load_seconds"] * 1000, 2),
+        "legacy_memory_mb": round(legacy["rss"] / 2**20, 1),
+        "legacy_lookup_ns": round(legacy["lookup_seconds"] * 1e9),
+        "load_ms": round(stats["load_seconds"] * 1000, 3),
+        "memory_mb": round(stats["rss"] / 2**20, 1),
+        "lookup_ns": round(stats["lookup_seconds"] * 1e9),
+        "import_ms": round(imported["load_seconds"] * 1000, 2),
+        "missing": sum(options.lookups - result["found"] for result in results.values()),  # Every lookup is of a customer
+        "file_mb": round(os.path.getsize(os.path.join(directory, "deal_stats.bin")) / 2**20, 1),
+        "legacy_file_mb": round(os.path.getsize(os.path.join(directory, "deal_data.json")) / 2**20, 1)
+    }
+
+def print_report(report):
+    print(f"{'customers':>10}{'json load ms':>14}{'json MiB':>10}{'json ns':>9}{'bin load ms':>13}{'bin MiB':>9}{'bin ns':>8}{'import ms':>11}")
+    for result in report["sizes"]:
+        print(
+            f"{result['customers']:>10}{result['legacy_load_ms']:>14}{result['legacy_memory_mb']:>10}{result['legacy_lookup_ns']:>9}"
+            f"{result['load_ms']:>13}{result['memory_mb']:>9}{result['lookup_ns']:>8}{result['import_ms']:>11}"
+        )
+    print(f"RSS after {report['lookups']} lookups of random customers, ns per lookup")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare load time and memory of the deal stats with the legacy JSON.")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma separated customer counts")
+    parser.add_argument("--lookups", type=int, default=10000, help="random customers read after each load")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where the files are written, a new temporary directory by default")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-load-ms", type=float, help="fail if loading the deal stats takes longer at any size")
+    parser.add_argument("--max-memory", type=float, help="fail if the loaded deal stats take more MiB at any size")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+    options.sizes = [int(size) for size in options.sizes.split(",")]
+    return options
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    if options.child:
+        print(json.dumps(measure_load(options.child, options.data_dir, options.lookups)))
+        return 0
+    rev = import_rev(options.data_dir)
+    report = {"lookups": options.lookups, "sizes": [measure(rev, size, options) for size in options.sizes]}
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    failures = [f"{result['missing']} lookups of {result['customers']} customers found nothing" for result in report["sizes"] if result["missing"]]
+    for result in report["sizes"]:
+        if options.max_load_ms is not None and result["load_ms"] > options.max_load_ms:
+            failures.append(f"loading {result['customers']} customers took {result['load_ms']} ms, over {options.max_load_ms} ms")
+        if options.max_memory is not None and result["memory_mb"] > options.max_memory:
+            failures.append(f"{result['customers']} customers took {result['memory_mb']} MiB, over {options.max_memory} MiB")
+    for failure in failures:
+        print(f"LIMIT EXCEEDED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
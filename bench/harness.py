@@ -0,0 +1,760 @@
+# Offline end-to-end harness for rev.py. Discord's gateway and REST API are replaced by FakeDiscord,
+# an in-process stand-in, so the bot's own handlers run unchanged with no network and no token.
+#
+#   python bench/harness.py --users 1000
+#   python bench/harness.py --users 200 --max-p99 1.5 --max-rest-per-ticket 40 --json report.json
+#
+# Each virtual shopper clicks Purchase, picks an item, enters a quantity, clicks Done, picks a
+# payment method and clicks Mark as Paid. A staff member completes the deal and the shopper leaves
+# a review. Before that a staff member sets the reviews channel and posts the storefront with
+# /setup_embed in every guild. The report has latency percentiles per step, REST calls per ticket
+# and memory per open ticket. Any --max-* limit that is exceeded, or any failed shopper, makes the
+# run exit with status 1, so it can gate CI.
+import argparse
+import asyncio
+import bisect
+import gc
+import json
+import math
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import discord
+from discord.http import Route
+from discord.webhook.async_ import AsyncWebhookAdapter, async_context
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ALL_PERMISSIONS = str(discord.Permissions.all().value)
+EPHEMERAL = 64  # Message flag
+CALLBACK_MESSAGE, CALLBACK_DEFERRED_MESSAGE, CALLBACK_UPDATE, CALLBACK_MODAL = 4, 5, 7, 9  # Interaction response types
+
+def import_rev(data_dir=None):
+    # rev.py opens its store and deal files when it's imported, so DATA_DIR has to be set first.
+    # Without one every run gets a fresh temporary directory.
+    if "rev" not in sys.modules:
+        os.environ["DATA_DIR"] = data_dir or os.environ.get("DATA_DIR") or tempfile.mkdtemp(prefix="rev-bench-")
+        os.environ.setdefault("METRICS_PORT", "0")
+        if REPO_DIR not in sys.path:
+            sys.path.insert(0, REPO_DIR)
+    import rev
+    return rev
+
+def iso(timestamp=None):
+    return datetime.fromtimestamp(timestamp or time.time(), timezone.utc).isoformat()
+
+def user_payload(user_id, name, bot=False):
+    return {"id": str(user_id), "username": name, "global_name": None, "discriminator": "0", "avatar": None, "bot": bot, "public_flags": 0}
+
+def member_payload(user, roles=()):
+    return {
+        "user": user,
+        "roles": [str(role_id) for role_id in roles],
+        "nick": None,
+        "avatar": None,
+        "joined_at": iso(),
+        "premium_since": None,
+        "deaf": False,
+        "mute": False,
+        "pending": False,
+        "flags": 0,
+        "permissions": ALL_PERMISSIONS
+    }
+
+def role_payload(role_id, name, position):
+    return {
+        "id": str(role_id), "name": name, "permissions": "0", "position": position, "color": 0,
+        "hoist": False, "managed": False, "mentionable": False, "flags": 0
+    }
+
+def components_of(message):
+    # Buttons and selects of a message payload, in order
+    for row in message.get("components") or ():
+        yield from row.get("components", (row,))
+
+def find_component(messages, action):
+    # Latest component whose custom_id is the bare action or starts with "action:"
+    for message in reversed(messages):
+        for component in components_of(message):
+            custom_id = component.get("custom_id", "")
+            if custom_id == action or custom_id.startswith(action + ":"):
+                return message, component
+    return None
+
+class StepFailed(Exception):
+    pass
+
+class FakeInteraction:
+    # One interaction sent to the bot and everything it was answered with
+    def __init__(self, interaction_id, token, channel_id):
+        self.id = interaction_id
+        self.token = token
+        self.channel_id = channel_id
+        self.sent_at = time.perf_counter()
+        self.acknowledged_at = None
+        self.callback = None  # Type of the initial response
+        self.modal = None
+        self.messages = []  # Message payloads: the response, followups and edits
+        self.changed = asyncio.Event()
+
+    def respond(self, callback=None, message=None, modal=None):
+        if self.acknowledged_at is None:
+            self.acknowledged_at = time.perf_counter()
+        if callback is not None:
+            self.callback = callback
+        if message is not None:
+            self.messages.append(message)
+        if modal is not None:
+            self.modal = modal
+        self.changed.set()
+
+    def answered(self):
+        return self.modal is not None or bool(self.messages)
+
+    async def wait(self, expect, timeout):
+        # expect() returns the step's result, None to keep waiting, or raises StepFailed
+        deadline = time.perf_counter() + timeout
+        while True:
+            result = expect(self) if self.answered() else None
+            if result is not None:
+                return result
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                last = self.messages[-1].get("content") if self.messages else None
+                raise StepFailed(f"no answer within {timeout}s" + (f", last reply: {last!r}" if last else ""))
+            self.changed.clear()
+            try:
+                await asyncio.wait_for(self.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+class FakeWebhookAdapter(AsyncWebhookAdapter):
+    # Interaction responses and followups go through discord.py's webhook adapter, not HTTPClient
+    def __init__(self, discord_api):
+        super().__init__()
+        self.discord_api = discord_api
+
+    async def request(self, route, session=None, *, payload=None, multipart=None, files=None, params=None, **kwargs):
+        if payload is None and multipart:
+            payload = json.loads(multipart[0]["value"])  # payload_json, the files aren't kept
+        return await self.discord_api.request(route, payload, params)
+
+class FakeDiscord:
+    # Answers the bot's REST calls from memory and feeds the matching gateway events back into its
+    # connection state, as Discord would. Gateway events are delivered from the event loop rather
+    # than from inside the REST call, like a real gateway, so the bot never sees them early.
+    # A route the fake doesn't know raises, so a gap shows up as a failed step, not a silent pass.
+    def __init__(self, bot, rest_latency=0.0, worker_id=0):
+        self.bot = bot
+        self.state = bot._connection
+        self.rest_latency = rest_latency
+        self.calls = Counter()  # "METHOD /path/{template}" -> calls
+        self.worker_id = worker_id % 1024
+        self.timestamp = 0  # Milliseconds since the Discord epoch of the last id handed out
+        self.increment = 0
+        self.app_id = self.snowflake()
+        self.bot_user = user_payload(self.snowflake(), "rev-bot", bot=True)
+        self.command_ids = {}  # command name -> id, known after the bot syncs its commands
+        self.channels = {}  # channel id -> channel payload
+        self.history = defaultdict(list)  # channel id -> message payloads, oldest first
+        self.channel_events = {}  # channel id -> Event set when a message arrives, while someone waits
+        self.interactions = {}  # token -> FakeInteraction, until the shopper is done with it
+        self.routes = {}
+        for key, handler in (
+            ("GET /users/@me", self.get_me),
+            ("GET /oauth2/applications/@me", self.get_application),
+            ("PUT /applications/{application_id}/commands", self.put_commands),
+            ("POST /guilds/{guild_id}/channels", self.create_channel),
+            ("PATCH /channels/{channel_id}", self.edit_channel),
+            ("DELETE /channels/{channel_id}", self.delete_channel),
+            ("POST /channels/{channel_id}/messages", self.create_message),
+            ("GET /channels/{channel_id}/messages", self.get_messages),
+            ("PATCH /channels/{channel_id}/messages/{message_id}", self.edit_message),
+            ("POST /interactions/{webhook_id}/{webhook_token}/callback", self.interaction_callback),
+            ("POST /webhooks/{webhook_id}/{webhook_token}", self.create_followup),
+            ("PATCH /webhooks/{webhook_id}/{webhook_token}/messages/@original", self.edit_original)
+        ):
+            method, path = key.split(" ", 1)
+            pattern = re.sub(r"\\{(\w+)\\}", r"(?P<\1>[^/]+)", re.escape(path))
+            self.routes[key] = (re.compile(pattern + "$"), handler)
+
+    def snowflake(self):
+        # Laid out like Discord's ids: the time, which the lifecycle scheduler reads activity from,
+        # then a worker id so fakes in different cluster processes never hand out the same id
+        now = discord.utils.time_snowflake(discord.utils.utcnow()) >> 22
+        if now > self.timestamp:
+            self.timestamp, self.increment = now, 0
+        else:
+            self.increment += 1
+            if self.increment == 4096:
+                self.timestamp, self.increment = self.timestamp + 1, 0
+        return (self.timestamp << 22) | (self.worker_id << 12) | self.increment
+
+    def install(self):
+        # Points the bot's HTTP client and discord.py's webhook adapter at this fake. The adapter is
+        # a context variable, so this has to run in the task that later starts the shoppers.
+        rev = sys.modules["rev"]
+        self.bot.http.request = self.http_request
+        rev.instrument_http(self.bot.http)  # Times the fake's routes the same way as Discord's
+        async_context.set(FakeWebhookAdapter(self))
+
+    async def start(self, guilds):
+        # Logs in, delivers the guilds and runs on_ready, after which interactions can be sent
+        self.install()
+        await self.bot.login("offline")
+        for guild in guilds:
+            self.state.parse_guild_create(guild)
+        await sys.modules["rev"].on_ready()
+
+    async def close(self):
+        await self.bot.http.close()
+
+    async def http_request(self, route, *, files=None, form=None, params=None, **kwargs):
+        body = kwargs.get("json")
+        if body is None and form:
+            body = json.loads(form[0]["value"])  # payload_json, the files aren't kept
+        return await self.request(route, body, params)
+
+    async def request(self, route, body=None, params=None):
+        self.calls[route.key] += 1
+        if self.rest_latency:
+            await asyncio.sleep(self.rest_latency * random.uniform(0.5, 1.5))
+        entry = self.routes.get(route.key)
+        if entry is None:
+            raise NotImplementedError(f"FakeDiscord has no route for {route.key}")
+        pattern, handler = entry
+        args = pattern.match(route.url[len(Route.BASE):]).groupdict()
+        return handler(body or {}, params or {}, **args)
+
+    def gateway(self, event, payload):
+        asyncio.get_running_loop().call_soon(getattr(self.state, f"parse_{event}"), payload)
+
+    # Setup
+
+    def guild(self, guild_id, owner_id, roles=(), channels=()):
+        everyone = role_payload(guild_id, "@everyone", 0)
+        for channel in channels:
+            self.channels[int(channel["id"])] = channel
+        return {
+            "id": str(guild_id), "name": f"store-{guild_id}", "owner_id": str(owner_id), "icon": None, "splash": None,
+            "discovery_splash": None, "banner": None, "description": None, "afk_channel_id": None, "afk_timeout": 300,
+            "verification_level": 0, "default_message_notifications": 0, "explicit_content_filter": 0, "mfa_level": 0,
+            "nsfw_level": 0, "premium_tier": 0, "preferred_locale": "en-US", "system_channel_id": None,
+            "system_channel_flags": 0, "rules_channel_id": None, "public_updates_channel_id": None, "vanity_url_code": None,
+            "features": [], "emojis": [], "stickers": [], "roles": [everyone, *roles], "channels": list(channels),
+            "members": [member_payload(self.bot_user)], "member_count": 1, "large": False, "unavailable": False,
+            "threads": [], "presences": [], "voice_states": [], "stage_instances": [], "guild_scheduled_events": [],
+            "soundboard_sounds": [], "joined_at": iso()
+        }
+
+    def text_channel(self, guild_id, name, parent_id=None, overwrites=(), channel_type=0):
+        return {
+            "id": str(self.snowflake()), "type": channel_type, "guild_id": str(guild_id), "name": name, "position": 0,
+            "parent_id": parent_id, "permission_overwrites": list(overwrites), "nsfw": False, "topic": None,
+            "last_message_id": None, "rate_limit_per_user": 0
+        }
+
+    # REST routes
+
+    def get_me(self, body, params):
+        return self.bot_user
+
+    def get_application(self, body, params):
+        return {
+            "id": str(self.app_id), "name": "rev", "description": "", "icon": None, "bot_public": False,
+            "bot_require_code_grant": False, "owner": self.bot_user, "verify_key": "0" * 64, "flags": 0
+        }
+
+    def put_commands(self, body, params, application_id):
+        commands = []
+        for command in body:
+            command_id = self.command_ids.setdefault(command["name"], self.snowflake())
+            commands.append({
+                **command, "id": str(command_id), "application_id": str(self.app_id), "version": "1",
+                "default_member_permissions": None, "dm_permission": True, "nsfw": False
+            })
+        return commands
+
+    def create_channel(self, body, params, guild_id):
+        channel = self.text_channel(
+            guild_id, body["name"], body.get("parent_id"), body.get("permission_overwrites", ()), body.get("type", 0)
+        )
+        self.channels[int(channel["id"])] = channel
+        self.gateway("channel_create", channel)
+        return channel
+
+    def edit_channel(self, body, params, channel_id):
+        channel = self.channels.get(int(channel_id))
+        if channel is None:
+            raise_not_found()
+        channel.update({key: value for key, value in body.items() if key in channel})
+        self.gateway("channel_update", dict(channel))
+        return channel
+
+    def delete_channel(self, body, params, channel_id):
+        channel = self.channels.pop(int(channel_id), None)
+        if channel is None:
+            raise_not_found()
+        self.history.pop(int(channel_id), None)
+        self.gateway("channel_delete", channel)
+        return channel
+
+    def message(self, channel_id, body):
+        channel = self.channels.get(int(channel_id), {})
+        message = {
+            "id": str(self.snowflake()), "channel_id": str(channel_id), "author": self.bot_user,
+            "content": body.get("content") or "", "timestamp": iso(), "edited_timestamp": None, "tts": False,
+            "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [],
+            "embeds": body.get("embeds") or [], "components": body.get("components") or [], "pinned": False,
+            "type": 0, "flags": body.get("flags") or 0
+        }
+        if "guild_id" in channel:
+            message["guild_id"] = channel["guild_id"]
+        return message
+
+    def post(self, message):
+        # A message everyone in the channel can see: it's kept for history and sent over the gateway
+        channel_id = int(message["channel_id"])
+        self.history[channel_id].append(message)
+        event = self.channel_events.get(channel_id)
+        if event:
+            event.set()
+        self.gateway("message_create", message)
+
+    def create_message(self, body, params, channel_id):
+        if int(channel_id) not in self.channels:
+            raise_not_found()
+        message = self.message(channel_id, body)
+        self.post(message)
+        return message
+
+    def get_messages(self, body, params, channel_id):
+        # Like Discord, newest first whichever way the page is taken. History is in id order, so a
+        # page is found by bisecting rather than by scanning a long ticket's history on every call.
+        messages = self.history.get(int(channel_id), [])
+        limit = int(params.get("limit", 50))
+        if "after" in params:
+            start = bisect.bisect_right(messages, int(params["after"]), key=lambda message: int(message["id"]))
+            page = messages[start:start + limit]
+        else:
+            end = bisect.bisect_left(messages, int(params.get("before", 1 << 63)), key=lambda message: int(message["id"]))
+            page = messages[max(0, end - limit):end]
+        return page[::-1]
+
+    def edit_message(self, body, params, channel_id, message_id):
+        for message in self.history.get(int(channel_id), ()):
+            if message["id"] == message_id:
+                message.update({key: value for key, value in body.items() if key in message})
+                message["edited_timestamp"] = iso()
+                return message
+        raise_not_found()
+
+    def interaction_callback(self, body, params, webhook_id, webhook_token):
+        interaction = self.interactions.get(webhook_token)
+        callback = body["type"]
+        data = body.get("data") or {}
+        result = {"interaction": {"id": webhook_id, "type": 0, "response_message_loading": callback == CALLBACK_DEFERRED_MESSAGE}}
+        if callback == CALLBACK_MODAL:
+            if interaction:
+                interaction.respond(callback, modal=data)
+            return result
+        message = None
+        if callback in (CALLBACK_MESSAGE, CALLBACK_UPDATE):
+            message = self.answer(interaction, data)
+            result["interaction"]["response_message_id"] = message["id"]
+            result["resource"] = {"type": callback, "message": message}
+        if interaction:
+            interaction.respond(callback, message)
+        return result
+
+    def answer(self, interaction, body):
+        message = self.message(interaction.channel_id if interaction else 0, body)
+        if interaction and not message["flags"] & EPHEMERAL:
+            self.post(message)
+        return message
+
+    def create_followup(self, body, params, webhook_id, webhook_token):
+        interaction = self.interactions.get(webhook_token)
+        message = self.answer(interaction, body)
+        if interaction:
+            interaction.respond(message=message)
+        return message
+
+    def edit_original(self, body, params, webhook_id, webhook_token):
+        return self.create_followup(body, params, webhook_id, webhook_token)
+
+    # Gateway: interactions from users
+
+    def send_interaction(self, kind, user, guild_id, channel_id, data, message=None, roles=()):
+        interaction_id = self.snowflake()
+        interaction = FakeInteraction(interaction_id, f"token-{interaction_id}", channel_id)
+        channel = self.channels[channel_id]
+        payload = {
+            "id": str(interaction_id), "application_id": str(self.app_id), "type": kind, "token": interaction.token,
+            "version": 1, "guild_id": str(guild_id), "channel_id": str(channel_id),
+            "channel": {"id": str(channel_id), "type": channel["type"], "name": channel["name"], "guild_id": str(guild_id)},
+            "member": member_payload(user, roles), "app_permissions": ALL_PERMISSIONS, "locale": "en-US",
+            "guild_locale": "en-US", "entitlements": [], "authorizing_integration_owners": {"0": str(guild_id)},
+            "context": 0, "attachment_size_limit": 8 * 1024 * 1024, "data": data
+        }
+        if message is not None:
+            payload["message"] = message
+        self.interactions[interaction.token] = interaction
+        self.gateway("interaction_create", payload)
+        return interaction
+
+    def done_with(self, interaction):
+        self.interactions.pop(interaction.token, None)
+
+    async def wait_for_message(self, channel_id, expect, timeout):
+        # expect(history) returns a result or None, like FakeInteraction.wait
+        deadline = time.perf_counter() + timeout
+        event = self.channel_events.setdefault(channel_id, asyncio.Event())
+        try:
+            while True:
+                result = expect(self.history.get(channel_id, []))
+                if result is not None:
+                    return result
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise StepFailed(f"nothing arrived in channel {channel_id} within {timeout}s")
+                event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.channel_events.pop(channel_id, None)
+
+def raise_not_found():
+    raise discord.NotFound(FakeResponse(404), {"code": 10003, "message": "Unknown Channel"})
+
+class FakeResponse:
+    # Enough of aiohttp's response for discord.HTTPException
+    def __init__(self, status, reason="Fake"):
+        self.status = status
+        self.reason = reason
+        self.headers = {}
+
+def modal_submit(modal, values):
+    # Submission payload for a modal the bot opened, with each text input filled in by its label
+    def fill(component):
+        if component["type"] == 1:
+            return {"type": 1, "components": [fill(child) for child in component["components"]]}
+        if component["type"] == 18:
+            return {"type": 18, "component": fill(component["component"])}
+        label = component.get("label")
+        return {"type": component["type"], "custom_id": component["custom_id"], "value": values.get(label, "")}
+
+    return {"custom_id": modal["custom_id"], "components": [fill(component) for component in modal["components"]]}
+
+def expect_message(check, interim=()):
+    # expect() for FakeInteraction.wait. check(message) is tried on every reply. A reply that fails
+    # it ends the step, unless it starts with one of the interim texts: then the bot has more to send.
+    def expect(interaction):
+        for message in interaction.messages:
+            result = check(message)
+            if result is not None:
+                return result
+        for message in interaction.messages:
+            if not message["content"].startswith(interim):
+                raise StepFailed(f"unexpected reply: {message['content']!r}")
+        if interaction.modal is not None:
+            raise StepFailed("unexpected modal")
+        return None
+    return expect
+
+def expect_component(action, interim=()):
+    def check(message):
+        found = find_component([message], action)
+        return (message, found[1]) if found else None
+    return expect_message(check, interim)
+
+def expect_modal(interaction):
+    if interaction.modal is not None:
+        return interaction.modal
+    raise StepFailed(f"expected a modal, got {interaction.messages[-1]['content']!r}")
+
+class Shop:
+    # One run: the guilds, their staff and shoppers, and what was measured
+    def __init__(self, options):
+        self.options = options
+        self.rev = import_rev(options.data_dir)
+        self.fake = FakeDiscord(self.rev.bot, options.rest_latency, self.rev.CLUSTER_ID)
+        self.latencies = defaultdict(list)  # step -> seconds until the step's answer arrived
+        self.acknowledgements = []  # Seconds until each interaction was first answered or deferred
+        self.errors = Counter()  # "step: reason" -> shoppers who failed there
+        self.completed = 0
+        self.guilds = []  # (guild id, storefront channel, reviews channel, staff role)
+
+    def guild_ids(self, count):
+        # With SHARD_COUNT set, each cluster only hears from the guilds on its own shards, and a
+        # guild's shard comes from the timestamp in its id. Ids are moved ahead to the next
+        # millisecond that lands on one of this process's shards, and the fake's clock with them.
+        shard_count = self.rev.bot.shard_count or 1
+        shard_ids = sorted(getattr(self.rev.bot, "shard_ids", None) or range(shard_count))
+        ids = []
+        for number in range(count):
+            guild_id = self.fake.snowflake()
+            shard_id = shard_ids[number % len(shard_ids)]
+            guild_id += ((shard_id - (guild_id >> 22)) % shard_count) << 22
+            self.fake.timestamp = max(self.fake.timestamp, guild_id >> 22)
+            ids.append(guild_id)
+        return ids
+
+    def setup_guilds(self, guild_ids):
+        payloads = []
+        for guild_id in guild_ids:
+            storefront = self.fake.text_channel(guild_id, "shop")
+            reviews = self.fake.text_channel(guild_id, "reviews")
+            staff_role = self.fake.snowflake()
+            payloads.append(self.fake.guild(guild_id, self.fake.snowflake(), [role_payload(staff_role, "staff", 1)], [storefront, reviews]))
+            self.guilds.append((guild_id, int(storefront["id"]), int(reviews["id"]), staff_role))
+        return payloads
+
+    async def step(self, name, send, expect, timeout=None):
+        interaction = send()
+        try:
+            result = await interaction.wait(expect, timeout or self.options.timeout)
+        except StepFailed as e:
+            raise StepFailed(f"{name}: {e}") from None
+        finally:
+            self.fake.done_with(interaction)
+        self.latencies[name].append(time.perf_counter() - interaction.sent_at)
+        if interaction.acknowledged_at:
+            self.acknowledgements.append(interaction.acknowledged_at - interaction.sent_at)
+        return result
+
+    def command(self, name, user, guild, channel_id, options=(), resolved=None, roles=()):
+        # Commands get their ids when the bot syncs them, which it skips if they haven't changed
+        command_id = self.fake.command_ids.setdefault(name, self.fake.snowflake())
+        data = {"id": str(command_id), "name": name, "type": 1, "options": list(options)}
+        if resolved:
+            data["resolved"] = resolved
+        return lambda: self.fake.send_interaction(2, user, guild, channel_id, data, roles=roles)
+
+    def click(self, user, guild_id, message, component, values=None, roles=()):
+        data = {"custom_id": component["custom_id"], "component_type": component["type"]}
+        if values is not None:
+            data["values"] = values
+        channel_id = int(message["channel_id"])
+        return lambda: self.fake.send_interaction(3, user, guild_id, channel_id, data, message, roles)
+
+    def submit(self, user, guild_id, channel_id, modal, values):
+        data = modal_submit(modal, values)
+        return lambda: self.fake.send_interaction(5, user, guild_id, channel_id, data)
+
+    async def think(self):
+        if self.options.think:
+            await asyncio.sleep(self.options.think * random.uniform(0.5, 1.5))
+
+    async def open_storefront(self, guild_id, storefront_id, reviews_id, staff_role):
+        # The guild's operators have already made a staff role an admin role with /set_admin_role
+        await self.rev.guild_configs.update(guild_id, admin_role_ids=[staff_role])
+        staff = user_payload(self.fake.snowflake(), f"staff-{guild_id}")
+        reviews = self.fake.channels[reviews_id]
+        await self.step("set_reviews_channel", self.command(
+            "set_reviews_channel", staff, guild_id, storefront_id,
+            [{"name": "channel", "type": 7, "value": str(reviews_id)}],
+            {"channels": {str(reviews_id): {**reviews, "permissions": ALL_PERMISSIONS}}},
+            roles=[staff_role]
+        ), expect_message(lambda message: message if message["content"].startswith("Reviews will be posted") else None))
+        await self.step("setup_embed", self.command("setup_embed", staff, guild_id, storefront_id, roles=[staff_role]),
+                        expect_message(lambda message: message if "successfully" in message["content"] else None))
+        return await self.fake.wait_for_message(storefront_id, lambda history: find_component(history, "purchase"), self.options.timeout)
+
+    async def shopper(self, number, guild_id, storefront, staff_role):
+        buyer = user_payload(self.fake.snowflake(), f"shopper{number}")
+        staff = user_payload(self.fake.snowflake(), f"staff{number}")
+        await asyncio.sleep(random.uniform(0, self.options.ramp))
+        try:
+            message, button = storefront
+            started = time.perf_counter()
+            channel_id = await self.step("purchase", self.click(buyer, guild_id, message, button), expect_message(
+                lambda message: (match := re.search(r"Ticket created: <#(\d+)>", message["content"])) and int(match.group(1))
+            ))
+            message, select = await self.fake.wait_for_message(
+                channel_id, lambda history: find_component(history, "item_select"), self.options.timeout
+            )
+            self.latencies["ticket_ready"].append(time.perf_counter() - started)
+
+            await self.think()
+            item = select["options"][0]["value"]
+            modal = await self.step("item_select", self.click(buyer, guild_id, message, select, [item]), expect_modal)
+            await self.think()
+            message, done = await self.step(
+                "quantity", self.submit(buyer, guild_id, channel_id, modal, {"Quantity": str(random.randint(1, 5))}),
+                expect_component("done", interim=("Added",))
+            )
+            await self.think()
+            message, select = await self.step("done", self.click(buyer, guild_id, message, done), expect_component("payment_method"))
+            await self.think()
+            method = select["options"][0]["value"]
+            message, button = await self.step(
+                "payment_method", self.click(buyer, guild_id, message, select, [method]), expect_component("mark_as_paid")
+            )
+            await self.think()
+            message, button = await self.step("mark_as_paid", self.click(buyer, guild_id, message, button), expect_component("deal_completed"))
+            await self.think()
+            message, button = await self.step(
+                "deal_completed", self.click(staff, guild_id, message, button, roles=[staff_role]), expect_component("leave_review")
+            )
+            await self.think()
+            modal = await self.step("leave_review", self.click(buyer, guild_id, message, button), expect_modal)
+            await self.think()
+            await self.step(
+                "review", self.submit(buyer, guild_id, channel_id, modal, {"Your Review": "Fast and friendly.", "Star Rating (1-5)": "5"}),
+                expect_message(lambda message: message if message["content"].startswith("Thank you") else None)
+            )
+            self.completed += 1
+        except StepFailed as e:
+            self.errors[str(e)] += 1
+
+    async def run(self):
+        options = self.options
+        await self.fake.start(self.setup_guilds(self.guild_ids(options.guilds)))
+
+        storefronts = await asyncio.gather(*(self.open_storefront(*guild) for guild in self.guilds))
+        if options.start_at:
+            await asyncio.sleep(max(0.0, options.start_at - time.time()))  # Every cluster starts its shoppers together
+        gc.collect()
+        if options.tracemalloc:
+            tracemalloc.start(25)
+        memory_before = self.memory()
+        setup_calls = Counter(self.fake.calls)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            self.shopper(number, self.guilds[number % len(self.guilds)][0], storefronts[number % len(self.guilds)], self.guilds[number % len(self.guilds)][3])
+            for number in range(options.users)
+        ))
+        elapsed = time.perf_counter() - started
+
+        # Reviewed tickets stay open until the lifecycle scheduler closes them, so every ticket is still held here
+        open_tickets = len(await self.rev.ticket_store.tickets_with_status(self.rev.TICKET_REVIEWED))
+        gc.collect()
+        memory_after = self.memory()
+        if options.tracemalloc:
+            tracemalloc.stop()
+        await self.fake.close()
+        return self.report(elapsed, self.fake.calls - setup_calls, open_tickets, memory_before, memory_after)
+
+    def memory(self):
+        if self.options.tracemalloc:
+            # Only what the bot and discord.py hold: anything allocated with the fake on the stack is left out
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, __file__, all_frames=True)])
+            return sum(stat.size for stat in snapshot.statistics("filename"))
+        return current_rss()
+
+    def report(self, elapsed, rest, open_tickets, memory_before, memory_after):
+        # rest holds the calls made while the shoppers ran, setting up the storefronts isn't counted
+        interactions = sum(len(samples) for step, samples in self.latencies.items() if step != "ticket_ready")
+        tickets = max(1, self.completed)
+        return {
+            "users": self.options.users,
+            "guilds": self.options.guilds,
+            "completed": self.completed,
+            "failed": sum(self.errors.values()),
+            "errors": dict(self.errors),
+            "seconds": round(elapsed, 3),
+            "interactions": interactions,
+            "interactions_per_second": round(interactions / elapsed, 1) if elapsed else 0.0,
+            "acknowledgement": percentiles(self.acknowledgements),
+            "steps": {step: percentiles(samples) for step, samples in self.latencies.items()},
+            "rest_calls": sum(rest.values()),
+            "rest_calls_per_ticket": round(sum(rest.values()) / tickets, 1),
+            "rest_routes": dict(sorted(rest.items(), key=lambda item: -item[1])),
+            "open_tickets": open_tickets,
+            "memory": "python heap" if self.options.tracemalloc else "rss",
+            "memory_per_open_ticket_kb": round((memory_after - memory_before) / max(1, open_tickets) / 1024, 2)
+        }
+
+def current_rss():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Peak, the best there is off Linux
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return round(ordered[min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1)] * 1000, 2)
+
+    return {"count": len(ordered), "p50_ms": at(0.5), "p90_ms": at(0.9), "p99_ms": at(0.99), "max_ms": at(1.0)}
+
+def print_report(report):
+    print(f"{report['completed']}/{report['users']} shoppers completed in {report['seconds']}s over {report['guilds']} guilds, "
+          f"{report['interactions_per_second']} interactions/s")
+    print(f"{'step':<20}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for step, stats in [("acknowledgement", report["acknowledgement"]), *report["steps"].items()]:
+        if stats:
+            print(f"{step:<20}{stats['count']:>8}{stats['p50_ms']:>10}{stats['p90_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+    print(f"REST calls per ticket: {report['rest_calls_per_ticket']} ({report['rest_calls']} in total)")
+    for key, calls in report["rest_routes"].items():
+        print(f"  {calls:>8}  {key}")
+    print(f"Memory per open ticket: {report['memory_per_open_ticket_kb']} KiB ({report['memory']}, {report['open_tickets']} open tickets)")
+    for error, count in report["errors"].items():
+        print(f"FAILED x{count}: {error}")
+
+def check_limits(report, options):
+    # The CI gate. Returns what was exceeded, empty when the run passes.
+    failures = []
+    if report["failed"] > options.max_failed:
+        failures.append(f"{report['failed']} shoppers failed, at most {options.max_failed} allowed")
+    worst = max([stats["p99_ms"] for stats in report["steps"].values() if stats] or [0.0])
+    if options.max_p99 is not None and worst > options.max_p99 * 1000:
+        failures.append(f"slowest step p99 {worst} ms is over {options.max_p99 * 1000} ms")
+    if options.max_rest_per_ticket is not None and report["rest_calls_per_ticket"] > options.max_rest_per_ticket:
+        failures.append(f"{report['rest_calls_per_ticket']} REST calls per ticket is over {options.max_rest_per_ticket}")
+    if options.max_memory_per_ticket is not None and report["memory_per_open_ticket_kb"] > options.max_memory_per_ticket:
+        failures.append(f"{report['memory_per_open_ticket_kb']} KiB per open ticket is over {options.max_memory_per_ticket}")
+    return failures
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Drive rev.py offline with virtual shoppers and report its performance.")
+    parser.add_argument("--users", type=int, default=200, help="virtual shoppers, all running at once")
+    parser.add_argument("--guilds", type=int, help="storefronts to spread them over, default one per 10 shoppers")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which the shoppers arrive")
+    parser.add_argument("--think", type=float, default=0.5, help="average seconds a shopper waits between steps")
+    parser.add_argument("--rest-latency", type=float, default=0.05, help="average seconds each REST call takes")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds a step may take before the shopper gives up")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where the bot keeps its files, a new temporary directory by default")
+    parser.add_argument("--tracemalloc", action="store_true", help="measure memory as the bot's Python heap instead of RSS, slower")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--start-at", type=float, help="unix time to start the shoppers at, once the storefronts are open")
+    parser.add_argument("--max-p99", type=float, help="fail if any step's p99 is over this many seconds")
+    parser.add_argument("--max-rest-per-ticket", type=float, help="fail if a ticket takes more REST calls than this")
+    parser.add_argument("--max-memory-per-ticket", type=float, help="fail if an open ticket takes more KiB than this")
+    parser.add_argument("--max-failed", type=int, default=0, help="shoppers allowed to fail, 0 by default")
+    options = parser.parse_args(argv)
+    if options.guilds is None:
+        options.guilds = max(1, math.ceil(options.users / 10))
+    return options
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    report = asyncio.run(Shop(options).run())
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    failures = check_limits(report, options)
+    for failure in failures:
+        print(f"LIMIT EXCEEDED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+# Deal ledger benchmark: what saving one completed deal costs as the customer count grows.
+#
+#   python bench/ledger.py
+#   python bench/ledger.py --sizes 1000,1000000 --deals 3000 --max-growth 2
+#
+# For each size a snapshot with that many customers is written, the ledger is loaded from it, and
+# --deals deals are recorded for a mix of existing and new customers, including the background
+# compactions they set off. The old save_deal_data rewrote the whole JSON file on every deal, that
+# cost is measured too for sizes up to --legacy-up-to. --max-growth fails the run if the median
+# save at the largest size is more than that many times the median at the smallest.
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from array import array
+
+from harness import import_rev, percentiles
+
+def build_snapshot(rev, directory, size):
+    ids = array("Q", range(1000, 1000 + size * 2, 2))  # Every other id, so new customers land in between
+    cents = array("q", (random.randrange(100, 100000) for _ in range(size)))
+    deals = array("I", (random.randrange(1, 20) for _ in range(size)))
+    path = os.path.join(directory, "deal_stats.bin")
+    rev.write_deal_stats(path, 0, ids, cents, deals)
+    return path, ids, cents, deals
+
+def legacy_save_seconds(directory, ids, cents, deals):
+    # One call of the old save_deal_data, the whole dict dumped with indent=4
+    users = {
+        str(user_id): {"deals_completed": count, "total_spent": total / 100}
+        for user_id, total, count in zip(ids, cents, deals)
+    }
+    started = time.perf_counter()
+    with open(os.path.join(directory, "deal_data.json"), "w") as file:
+        json.dump(users, file, indent=4)
+    return time.perf_counter() - started
+
+def measure(rev, size, options):
+    directory = tempfile.mkdtemp(prefix=f"rev-ledger-{size}-", dir=options.data_dir)
+    snapshot_path, ids, cents, deals = build_snapshot(rev, directory, size)
+    ledger = rev.DealLedger(snapshot_path, os.path.join(directory, "deal_ledger.jsonl"))
+    started = time.perf_counter()
+    ledger.load()
+    load_seconds = time.perf_counter() - started
+
+    saves = []
+    for _ in range(options.deals):
+        if random.random() < 0.8:
+            user_id = ids[random.randrange(size)]  # Returning customer
+        else:
+            user_id = 1001 + 2 * random.randrange(size)  # New customer
+        started = time.perf_counter()
+        ledger.record_deal(user_id, random.randrange(100, 10000))
+        saves.append(time.perf_counter() - started)
+    while ledger.compacting:
+        time.sleep(0.01)
+
+    result = {
+        "customers": size,
+        "load_ms": round(load_seconds * 1000, 2),
+        "save": percentiles(saves),
+        "save_mean_ms": round(statistics.mean(saves) * 1000, 3),
+        "compactions": options.deals // rev.DEAL_LEDGER_COMPACT_EVERY,
+        "legacy_save_ms": None
+    }
+    if size <= options.legacy_up_to:
+        result["legacy_save_ms"] = round(legacy_save_seconds(directory, ids, cents, deals) * 1000, 2)
+    return result
+
+def print_report(report):
+    print(f"{'customers':>10}{'load ms':>10}{'save p50 ms':>13}{'save p99 ms':>13}{'save max ms':>13}{'old save ms':>13}")
+    for result in report["sizes"]:
+        legacy = result["legacy_save_ms"] if result["legacy_save_ms"] is not None else "-"
+        save = result["save"]
+        print(f"{result['customers']:>10}{result['load_ms']:>10}{save['p50_ms']:>13}{save['p99_ms']:>13}{save['max_ms']:>13}{legacy:>13}")
+    print(f"Median save at {report['sizes'][-1]['customers']} customers is {report['growth']}x the median at {report['sizes'][0]['customers']}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cost of recording a deal as the customer count grows.")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000", help="comma separated customer counts")
+    parser.add_argument("--deals", type=int, default=2000, help="deals recorded at each size, compactions included")
+    parser.add_argument("--legacy-up-to", type=int, default=100000, help="largest size to time the old whole-file save at")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where the snapshots are written, a new temporary directory by default")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-growth", type=float, help="fail if the median save grows more than this many times")
+    options = parser.parse_args(argv)
+    options.sizes = [int(size) for size in options.sizes.split(",")]
+    return options
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    rev = import_rev(options.data_dir)
+    sizes = [measure(rev, size, options) for size in options.sizes]
+    report = {"sizes": sizes, "growth": round(sizes[-1]["save"]["p50_ms"] / max(sizes[0]["save"]["p50_ms"], 0.001), 2)}
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    if options.max_growth is not None and report["growth"] > options.max_growth:
+        print(f"LIMIT EXCEEDED: median save grew {report['growth']}x, at most {options.max_growth}x allowed", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
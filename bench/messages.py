@@ -0,0 +1,154 @@
+# Message throughput benchmark: how fast the bot gets through chat while many shoppers are in the
+# middle of choosing a quantity.
+#
+#   python bench/messages.py
+#   python bench/messages.py --shoppers 1000 --messages 200000 --min-rate 20000
+#
+# --shoppers shoppers go through the real handlers up to the quantity modal and leave it open. Then
+# --messages chat messages from other members are delivered over the fake gateway, spread over the
+# storefronts and the open tickets, and the report has how many the bot handled per second. The
+# same messages are replayed with one bot.wait_for("message") listener per shopper registered, the
+# way the quantity prompt worked before it became a modal, so the two can be compared.
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+import time
+
+from harness import Shop, StepFailed, expect_message, expect_modal, find_component, user_payload
+
+CHAT = ["hi", "is this legit?", "how long does delivery take", "5", "done", "thanks!", "anyone here?", "ok"]
+BATCH = 1000  # Messages delivered before waiting for the bot to catch up
+
+class Chatter(Shop):
+    def __init__(self, options):
+        super().__init__(options)
+        self.parked = []  # (buyer id, ticket channel id) of shoppers with the quantity modal open
+
+    async def park(self, number, guild_id, storefront):
+        await asyncio.sleep(random.uniform(0, self.options.ramp))
+        buyer = user_payload(self.fake.snowflake(), f"shopper{number}")
+        message, button = storefront
+        try:
+            channel_id = await self.step("purchase", self.click(buyer, guild_id, message, button), expect_message(
+                lambda message: (match := re.search(r"Ticket created: <#(\d+)>", message["content"])) and int(match.group(1))
+            ))
+            message, select = await self.fake.wait_for_message(
+                channel_id, lambda history: find_component(history, "item_select"), self.options.timeout
+            )
+            await self.step("item_select", self.click(buyer, guild_id, message, select, [select["options"][0]["value"]]), expect_modal)
+            self.parked.append((int(buyer["id"]), channel_id))
+        except StepFailed as e:
+            self.errors[str(e)] += 1
+
+    def chat(self, count):
+        # Payloads of messages from members who aren't shopping, half in storefronts and half in tickets
+        members = [user_payload(self.fake.snowflake(), f"member{number}") for number in range(200)]
+        channels = [storefront_id for _, storefront_id, _, _ in self.guilds] + [channel_id for _, channel_id in self.parked]
+        weights = [1 / len(self.guilds)] * len(self.guilds) + [1 / max(1, len(self.parked))] * len(self.parked)
+        payloads = []
+        for channel_id in random.choices(channels, weights, k=count):
+            payload = self.fake.message(channel_id, {"content": random.choice(CHAT)})
+            payload["author"] = random.choice(members)
+            payloads.append(payload)
+        return payloads
+
+    async def deliver(self, payloads):
+        # Messages go straight into the connection state, as the gateway would hand them over. Each
+        # one schedules on_message as a task, so a batch is done once those tasks are gone again.
+        parse = self.fake.state.parse_message_create
+        baseline = len(asyncio.all_tasks())
+        started = time.perf_counter()
+        for start in range(0, len(payloads), BATCH):
+            for payload in payloads[start:start + BATCH]:
+                parse(payload)
+            while len(asyncio.all_tasks()) > baseline:
+                await asyncio.sleep(0)
+        return time.perf_counter() - started
+
+    async def run(self):
+        options = self.options
+        await self.fake.start(self.setup_guilds(self.guild_ids(options.guilds)))
+        storefronts = await asyncio.gather(*(self.open_storefront(*guild) for guild in self.guilds))
+        await asyncio.gather(*(
+            self.park(number, self.guilds[number % len(self.guilds)][0], storefronts[number % len(self.guilds)])
+            for number in range(options.shoppers)
+        ))
+
+        payloads = self.chat(options.messages)
+        await self.deliver(payloads[:BATCH])  # Warm up
+        listeners = len(self.rev.bot._listeners.get("message", ()))
+        modal_seconds = await self.deliver(payloads)
+
+        # The old prompt: one listener per shopper, each checked against every message
+        waiters = [
+            asyncio.create_task(self.rev.bot.wait_for(
+                "message", check=lambda message, buyer_id=buyer_id, channel_id=channel_id: (
+                    message.author.id == buyer_id and message.channel.id == channel_id
+                )
+            ))
+            for buyer_id, channel_id in self.parked
+        ]
+        await asyncio.sleep(0)  # Let them register
+        wait_for_seconds = await self.deliver(payloads)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await self.fake.close()
+
+        return {
+            "shoppers": options.shoppers,
+            "parked": len(self.parked),
+            "failed": sum(self.errors.values()),
+            "errors": dict(self.errors),
+            "messages": len(payloads),
+            "message_listeners": listeners,
+            "messages_per_second": round(len(payloads) / modal_seconds),
+            "wait_for_messages_per_second": round(len(payloads) / wait_for_seconds),
+            "speedup": round(wait_for_seconds / modal_seconds, 2)
+        }
+
+def print_report(report):
+    print(f"{report['parked']}/{report['shoppers']} shoppers have the quantity modal open, {report['message_listeners']} message listeners")
+    print(f"{report['messages']} messages: {report['messages_per_second']} messages/s")
+    print(f"With a wait_for listener per shopper: {report['wait_for_messages_per_second']} messages/s, {report['speedup']}x slower")
+    for error, count in report["errors"].items():
+        print(f"FAILED x{count}: {error}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure message throughput while shoppers are choosing a quantity.")
+    parser.add_argument("--shoppers", type=int, default=1000)
+    parser.add_argument("--guilds", type=int, help="storefronts, default one per 8 shoppers to stay under the ticket limit")
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which the shoppers arrive")
+    parser.add_argument("--rest-latency", type=float, default=0.01, help="average seconds each REST call takes")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds a step may take before the shopper gives up")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where the bot keeps its files, a new temporary directory by default")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--min-rate", type=float, help="fail if fewer messages per second are handled")
+    options = parser.parse_args(argv)
+    if options.guilds is None:
+        options.guilds = max(1, -(-options.shoppers // 8))
+    options.think = 0.0
+    return options
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    report = asyncio.run(Chatter(options).run())
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    failures = [f"{report['failed']} shoppers failed"] if report["failed"] else []
+    if options.min_rate is not None and report["messages_per_second"] < options.min_rate:
+        failures.append(f"{report['messages_per_second']} messages/s is under {options.min_rate}")
+    for failure in failures:
+        print(f"LIMIT EXCEEDED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
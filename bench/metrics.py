@@ -0,0 +1,161 @@
+# Metrics overhead benchmark: what recording latency histograms and error counters costs per
+# handler and per REST call, and what share of the bot's CPU time that is under a shopping load.
+#
+#   python bench/metrics.py
+#   python bench/metrics.py --users 500 --iterations 500000 --max-overhead 1
+#
+# First the recording paths are timed on their own: record_handler, the instrumented() wrapper
+# around a handler that returns straight away, and instrument_http around a REST call that does
+# the same, each against the bare call. Then --users shoppers go through the whole flow as in
+# bench/harness.py with metrics on, and the CPU time of that run is read. The overhead is the
+# number of observations the run recorded times their measured cost, as a share of that CPU time.
+# Last, the endpoint's Prometheus text and the JSON dump are rendered from what the run recorded.
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from harness import Shop
+
+class Load(Shop):
+    async def per_call(self, call, iterations):
+        # Seconds per await of call(), the loop included
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await call()
+        return (time.perf_counter() - started) / iterations
+
+    async def recording_costs(self):
+        rev = self.rev
+        iterations = self.options.iterations
+        names = list(rev.component_handlers) or ["purchase"]  # As many series as the real handlers make
+
+        started = time.perf_counter()
+        for number in range(iterations):
+            rev.record_handler("bench", names[number % len(names)], 0.01, False)
+        record = (time.perf_counter() - started) / iterations
+
+        async def handler():
+            return None
+
+        wrapped = rev.instrumented("bench", "handler")(handler)
+        bare_call = await self.per_call(handler, iterations)
+        wrapped_call = await self.per_call(wrapped, iterations)
+
+        class Route:
+            method, path = "GET", "/bench"
+
+        class Http:
+            async def request(self, route, **kwargs):
+                return None
+
+        http = Http()
+        bare_request = await self.per_call(lambda: http.request(Route), iterations)
+        rev.instrument_http(http)
+        timed_request = await self.per_call(lambda: http.request(Route), iterations)
+        for key in [key for key in rev.metrics.histograms if ("kind", "bench") in key[1] or ("route", "GET /bench") in key[1]]:
+            del rev.metrics.histograms[key]  # Not part of the load that follows
+        return {
+            "record_handler_ns": round(record * 1e9),
+            "handler_overhead_ns": round((wrapped_call - bare_call) * 1e9),
+            "rest_overhead_ns": round((timed_request - bare_request) * 1e9)
+        }
+
+    def observations(self):
+        counts = {"handler_seconds": 0, "discord_rest_seconds": 0}
+        for (name, _), histogram in self.rev.metrics.histograms.items():
+            if name in counts:
+                counts[name] += histogram.count
+        return counts
+
+    async def run(self):
+        costs = await self.recording_costs()
+        cpu = time.process_time()
+        load = await super().run()
+        cpu_seconds = time.process_time() - cpu
+
+        metrics = self.rev.metrics
+        observations = self.observations()
+        spent = (
+            observations["handler_seconds"] * costs["handler_overhead_ns"]
+            + observations["discord_rest_seconds"] * costs["rest_overhead_ns"]
+        ) / 1e9
+
+        started = time.perf_counter()
+        text = await metrics.render_prometheus()
+        prometheus_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        dump = json.dumps(await metrics.to_dict())
+        json_seconds = time.perf_counter() - started
+        return {
+            **costs,
+            "users": load["users"],
+            "completed": load["completed"],
+            "failed": load["failed"],
+            "errors": load["errors"],
+            "cpu_seconds": round(cpu_seconds, 3),
+            "handler_observations": observations["handler_seconds"],
+            "rest_observations": observations["discord_rest_seconds"],
+            "metrics_cpu_seconds": round(spent, 4),
+            "overhead_percent": round(spent / cpu_seconds * 100, 3),
+            "series": len(metrics.counters) + len(metrics.histograms),
+            "prometheus_ms": round(prometheus_seconds * 1000, 2),
+            "prometheus_kb": round(len(text) / 1024, 1),
+            "json_ms": round(json_seconds * 1000, 2),
+            "json_kb": round(len(dump) / 1024, 1)
+        }
+
+def print_report(report):
+    print(
+        f"record_handler {report['record_handler_ns']} ns, instrumented handler +{report['handler_overhead_ns']} ns, "
+        f"timed REST call +{report['rest_overhead_ns']} ns"
+    )
+    print(f"{report['completed']}/{report['users']} shoppers completed using {report['cpu_seconds']}s of CPU")
+    print(
+        f"{report['handler_observations']} handler and {report['rest_observations']} REST observations cost about "
+        f"{report['metrics_cpu_seconds']}s, {report['overhead_percent']}% of the CPU time"
+    )
+    print(
+        f"{report['series']} series: Prometheus text {report['prometheus_kb']} KiB in {report['prometheus_ms']} ms, "
+        f"JSON {report['json_kb']} KiB in {report['json_ms']} ms"
+    )
+    for error, count in report["errors"].items():
+        print(f"FAILED x{count}: {error}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure what recording metrics costs the bot.")
+    parser.add_argument("--iterations", type=int, default=200000, help="calls timed for each recording path")
+    parser.add_argument("--users", type=int, default=200, help="virtual shoppers in the load")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which the shoppers arrive")
+    parser.add_argument("--think", type=float, default=0.2, help="average seconds a shopper waits between steps")
+    parser.add_argument("--rest-latency", type=float, default=0.05, help="average seconds each REST call takes")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds a step may take before the shopper gives up")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where the bot keeps its files, a new temporary directory by default")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-overhead", type=float, help="fail if metrics take more than this percent of the CPU time")
+    options = parser.parse_args(argv)
+    options.tracemalloc = False
+    options.start_at = None
+    return options
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    report = asyncio.run(Load(options).run())
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    failures = [f"{report['failed']} shoppers failed"] if report["failed"] else []
+    if options.max_overhead is not None and report["overhead_percent"] > options.max_overhead:
+        failures.append(f"metrics took {report['overhead_percent']}% of the CPU time, over {options.max_overhead}%")
+    for failure in failures:
+        print(f"LIMIT EXCEEDED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+# Payment watcher benchmark: one poll cycle over 50k tickets waiting for an on-chain payment.
+#
+#   python bench/payments.py
+#   python bench/payments.py --pending 50000 --paid 1000 --chain-latency 0.2 --max-cycle 10
+#
+# --pending crypto tickets awaiting payment, each with its own deposit address, are written to the
+# store before the bot starts. The chain backend is MockPaymentBackend with every poll request
+# taking --chain-latency, as a round trip to a node would. Before each of --cycles cycles --paid
+# of the tickets are paid in full, and as many again get a payment that doesn't have enough
+# confirmations yet. The paid tickets' channels exist, so the watcher posts in them as it would in
+# production. The report has each cycle's wall time, the backend requests it made and how many
+# tickets it moved to paid.
+import argparse
+import asyncio
+import json
+import random
+import sqlite3
+import sys
+import time
+
+from harness import Shop
+
+COINS = ("BTC", "ETH", "LTC")
+
+class Chain(Shop):
+    def __init__(self, options):
+        super().__init__(options)
+        backend = self.backend = self.rev.MockPaymentBackend()
+        self.requests = 0
+        poll = backend.poll
+
+        async def slow_poll(coin, addresses):
+            self.requests += 1
+            await asyncio.sleep(self.options.chain_latency * random.uniform(0.5, 1.5))
+            return await poll(coin, addresses)
+
+        backend.poll = slow_poll
+
+    def seed(self, guild_ids):
+        # Straight into SQLite, the bot hasn't started yet
+        rev = self.rev
+        now = time.time()
+        tickets, deposits = [], []
+        indexes = dict.fromkeys(COINS, 0)
+        for number in range(self.options.pending):
+            coin = COINS[number % len(COINS)]
+            channel_id, guild_id, buyer_id = self.fake.snowflake(), guild_ids[number % len(guild_ids)], self.fake.snowflake()
+            cents = random.randrange(500, 50000)
+            address = self.backend.derive_address(coin, indexes[coin])
+            indexes[coin] += 1
+            tickets.append((channel_id, guild_id, buyer_id, rev.TICKET_AWAITING_PAYMENT, coin, cents, now, now))
+            deposits.append((address, coin, channel_id, guild_id, buyer_id, cents, now))
+        conn = sqlite3.connect(rev.STORE_FILE)
+        with conn:
+            conn.executemany(
+                "INSERT INTO tickets (channel_id, guild_id, buyer_id, status, payment_method, total_cents, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", tickets
+            )
+            conn.executemany(
+                "INSERT INTO deposits (address, coin, channel_id, guild_id, buyer_id, expected_cents, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                deposits
+            )
+            conn.executemany("INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)", [
+                (f"deposit_index:{coin}", str(index)) for coin, index in indexes.items()
+            ])
+        conn.close()
+        return [(address, coin, channel_id, guild_id, cents) for address, coin, channel_id, guild_id, buyer_id, cents, created_at in deposits]
+
+    def add_channels(self, payloads, deposits):
+        payloads_by_guild = {int(payload["id"]): payload for payload in payloads}
+        for address, coin, channel_id, guild_id, cents in deposits:
+            channel = self.fake.text_channel(guild_id, f"ticket-{channel_id}")
+            channel["id"] = str(channel_id)
+            self.fake.channels[channel_id] = channel
+            payloads_by_guild[guild_id]["channels"].append(channel)
+
+    async def cycle(self, watcher, paid, unconfirmed):
+        for address, coin, channel_id, guild_id, cents in paid:
+            self.backend.send(address, cents)
+        for address, coin, channel_id, guild_id, cents in unconfirmed:
+            self.backend.send(address, cents, confirmations=self.rev.PAYMENT_CONFIRMATIONS[coin] - 1)
+        requests = self.requests
+        started = time.perf_counter()
+        cpu = time.process_time()
+        await watcher.poll()
+        return {
+            "seconds": round(time.perf_counter() - started, 3),
+            "cpu_seconds": round(time.process_time() - cpu, 3),
+            "requests": self.requests - requests,
+            "sent": len(paid)
+        }
+
+    async def run(self):
+        options = self.options
+        payloads = self.setup_guilds(self.guild_ids(options.guilds))
+        deposits = self.seed([guild_id for guild_id, _, _, _ in self.guilds])
+        random.shuffle(deposits)
+        batches = [deposits[number * options.paid:(number + 1) * options.paid] for number in range(options.cycles)]
+        unconfirmed = deposits[options.cycles * options.paid:(options.cycles + 1) * options.paid]
+        self.add_channels(payloads, [deposit for batch in batches for deposit in batch])
+        await self.fake.start(payloads)
+
+        watcher = self.rev.PaymentWatcher(self.rev.ticket_store, self.backend)
+        cycles = [await self.cycle(watcher, batch, unconfirmed if number == 0 else ()) for number, batch in enumerate(batches)]
+        paid = len(await self.rev.ticket_store.tickets_with_status(self.rev.TICKET_PAID))
+        await self.fake.close()
+        return {
+            "pending": options.pending,
+            "batch_size": self.backend.batch_size,
+            "cycles": cycles,
+            "paid": paid,
+            "expected_paid": sum(len(batch) for batch in batches)
+        }
+
+def print_report(report):
+    print(f"{report['pending']} pending deposits, polled {report['batch_size']} addresses per request")
+    print(f"{'cycle':>6}{'seconds':>9}{'CPU s':>8}{'requests':>10}{'paid':>6}")
+    for number, cycle in enumerate(report["cycles"], 1):
+        print(f"{number:>6}{cycle['seconds']:>9}{cycle['cpu_seconds']:>8}{cycle['requests']:>10}{cycle['sent']:>6}")
+    print(f"{report['paid']}/{report['expected_paid']} paid tickets moved to paid, unconfirmed payments left alone")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure a payment watcher poll cycle over many pending deposits.")
+    parser.add_argument("--pending", type=int, default=50000, help="tickets waiting for an on-chain payment")
+    parser.add_argument("--paid", type=int, default=200, help="tickets paid before each cycle")
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--chain-latency", type=float, default=0.1, help="average seconds each backend request takes")
+    parser.add_argument("--rest-latency", type=float, default=0.05, help="average seconds each REST call takes")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where the bot keeps its files, a new temporary directory by default")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-cycle", type=float, help="fail if a poll cycle takes more seconds than this")
+    options = parser.parse_args(argv)
+    options.think = 0.0
+    return options
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    report = asyncio.run(Chain(options).run())
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    failures = []
+    if report["paid"] != report["expected_paid"]:
+        failures.append(f"{report['paid']} tickets moved to paid, {report['expected_paid']} were paid")
+    slowest = max(cycle["seconds"] for cycle in report["cycles"])
+    if options.max_cycle is not None and slowest > options.max_cycle:
+        failures.append(f"a poll cycle took {slowest}s, over {options.max_cycle}s")
+    for failure in failures:
+        print(f"LIMIT EXCEEDED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
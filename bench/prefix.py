@@ -0,0 +1,180 @@
+# Prefix command benchmark: on_message throughput over a replay of synthetic messages, and how much
+# memory routing one message allocates.
+#
+#   python bench/prefix.py
+#   python bench/prefix.py --messages 1000000 --min-rate 500000
+#
+# The messages are mostly chat, with some that start with another guild's prefix or name an unknown
+# command, and --commands of them are real commands. A quarter of the guilds have a prefix of their
+# own. Messages are lightweight stand-ins carrying what on_message reads, so the numbers are the
+# router's and not the gateway's. For comparison the messages that aren't commands also go through
+# bot.process_commands, which the old on_message called for every message. Commands are left out of
+# that run, discord.py's own help command needs a real Message. Allocation is the tracemalloc peak
+# while routing a single message, averaged per kind of message, less what calling an empty async
+# handler takes: that coroutine is created for every message whatever the handler does.
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from harness import FakeDiscord, import_rev
+
+CHAT = ["hello", "is this legit?", "how long does delivery take", "thanks!", "ok", "lol", "anyone online?", "5"]
+OTHER = ["$help", "!nope", "?help", "!", "!!help", "! help"]  # Another guild's prefix, unknown or malformed commands
+
+class Guild:
+    __slots__ = ("id",)
+
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+class Author:
+    __slots__ = ("id", "bot")
+
+    def __init__(self, user_id):
+        self.id = user_id
+        self.bot = False
+
+class Channel:
+    __slots__ = ("id", "sent")
+
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+
+class Message:
+    __slots__ = ("content", "guild", "author", "channel", "_state", "kind")
+
+    def __init__(self, content, guild, author, channel, state, kind):
+        self.content = content
+        self.guild = guild
+        self.author = author
+        self.channel = channel
+        self._state = state
+        self.kind = kind
+
+def messages(rev, options):
+    # options.distinct messages, replayed until there are options.messages of them
+    guilds = [Guild(10**17 + number) for number in range(options.guilds)]
+    for guild in guilds[::4]:
+        rev.prefix_router.set_prefix(guild.id, "$")
+    authors = [Author(10**16 + number) for number in range(1000)]
+    channels = [Channel(10**15 + number) for number in range(options.guilds)]
+    state = rev.bot._connection
+    pool = []
+    for _ in range(options.distinct):
+        number = random.randrange(options.guilds)
+        guild, channel = guilds[number], channels[number]
+        roll = random.random()
+        if roll < options.commands:
+            prefix = rev.prefix_router.guild_prefixes.get(guild.id, rev.prefix_router.default_prefix)
+            content, kind = f"{prefix}help", "command"
+        elif roll < options.commands + 0.05:
+            content, kind = random.choice(OTHER), "not a command"
+        else:
+            content, kind = random.choice(CHAT), "chat"
+        pool.append(Message(content, guild, random.choice(authors), channel, state, kind))
+    return [pool[number % len(pool)] for number in range(options.messages)]
+
+async def rate(handle, replay):
+    started = time.perf_counter()
+    for message in replay:
+        await handle(message)
+    return len(replay) / (time.perf_counter() - started)
+
+async def empty_handler(message):
+    pass
+
+async def peaks(handle, replay):
+    totals, counts = {}, {}
+    tracemalloc.start()
+    for message in replay:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        await handle(message)
+        totals[message.kind] = totals.get(message.kind, 0) + tracemalloc.get_traced_memory()[1] - baseline
+        counts[message.kind] = counts.get(message.kind, 0) + 1
+    tracemalloc.stop()
+    return {kind: totals[kind] / counts[kind] for kind in totals}
+
+async def allocated_bytes(handle, replay):
+    # Mean tracemalloc peak above the baseline while one message is handled, per kind of message,
+    # beyond what an empty handler takes
+    calls = await peaks(empty_handler, replay)
+    return {kind: round(max(0.0, peak - calls[kind]), 1) for kind, peak in (await peaks(handle, replay)).items()}
+
+async def run(options):
+    rev = import_rev(options.data_dir)
+    fake = FakeDiscord(rev.bot)
+    await fake.start([])
+    replay = messages(rev, options)
+    sample = replay[:options.distinct]
+
+    not_commands = [message for message in replay if message.kind != "command"]
+
+    await rate(rev.on_message, sample)  # Warm up
+    report = {
+        "messages": len(replay),
+        "commands": len(replay) - len(not_commands),
+        "messages_per_second": round(await rate(rev.on_message, replay)),
+        "bytes_per_message": await allocated_bytes(rev.on_message, sample),
+        "not_commands_per_second": round(await rate(rev.on_message, not_commands)),
+        "process_commands_per_second": round(await rate(rev.bot.process_commands, not_commands)),
+        "process_commands_bytes_per_message": await allocated_bytes(
+            rev.bot.process_commands, [message for message in sample if message.kind != "command"]
+        )
+    }
+    report["speedup"] = round(report["not_commands_per_second"] / report["process_commands_per_second"], 2)
+    await fake.close()
+    return report
+
+def print_report(report):
+    print(f"{report['messages']} messages, {report['commands']} of them commands")
+    print(f"on_message: {report['messages_per_second']} messages/s")
+    print(
+        f"Without the commands: on_message {report['not_commands_per_second']} messages/s, "
+        f"bot.process_commands {report['process_commands_per_second']} messages/s, {report['speedup']}x slower"
+    )
+    print(f"{'bytes allocated':<16}{'on_message':>12}{'process_commands':>18}")
+    for kind, allocated in report["bytes_per_message"].items():
+        print(f"{kind:<16}{allocated:>12}{report['process_commands_bytes_per_message'].get(kind, '-'):>18}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how fast on_message turns away or routes prefix commands.")
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--distinct", type=int, default=10000, help="different messages in the replay, also the allocation sample")
+    parser.add_argument("--commands", type=float, default=0.01, help="fraction of messages that are commands")
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where the bot keeps its files, a new temporary directory by default")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--min-rate", type=float, help="fail if on_message handles fewer messages per second")
+    parser.add_argument("--max-chat-bytes", type=float, help="fail if a chat message allocates more bytes than this")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    report = asyncio.run(run(options))
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    failures = []
+    if options.min_rate is not None and report["messages_per_second"] < options.min_rate:
+        failures.append(f"{report['messages_per_second']} messages/s is under {options.min_rate}")
+    chat_bytes = report["bytes_per_message"].get("chat", 0)
+    if options.max_chat_bytes is not None and chat_bytes > options.max_chat_bytes:
+        failures.append(f"a chat message allocates {chat_bytes} bytes, over {options.max_chat_bytes}")
+    for failure in failures:
+        print(f"LIMIT EXCEEDED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
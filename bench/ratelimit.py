@@ -0,0 +1,170 @@
+# Rate limiter benchmark: what the anti-spam check costs per interaction and how much memory its
+# buckets hold when millions of distinct users come through.
+#
+#   python bench/ratelimit.py
+#   python bench/ratelimit.py --users 5000000 --arrivals 5000 --max-call-ns 5000 --max-buckets 100000
+#
+# Limiters are built with the same rates as interaction_limits and ticket_limits, and the clock they
+# read is simulated, so hours of traffic run in seconds. --users distinct users then arrive at
+# --arrivals per second, spread over --guilds, each clicking once. That runs three times: timed,
+# under tracemalloc, and under tracemalloc again with idle buckets never expired, which is what
+# keeping a bucket per user forever would cost. Then a few spammers click as fast as they can
+# among regular users, and the clicks each gets through are checked against what the bucket allows.
+import argparse
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from harness import import_rev
+
+class Clock:
+    # Stands in for time.monotonic, moved forward by the benchmark
+    def __init__(self):
+        self.now = time.monotonic()
+
+    def __call__(self):
+        return self.now
+
+def copy_limits(rev, limits, expire=True):
+    copies = {scope: rev.RateLimiter(limiter.rate, limiter.capacity) for scope, limiter in limits.items()}
+    if not expire:
+        for limiter in copies.values():
+            limiter.idle_after = float("inf")
+    return copies
+
+def churn(rev, limits, clock, options):
+    # Every user clicks once. Returns seconds spent in rate_limited and the most buckets held at once.
+    step = 1 / options.arrivals
+    spent = 0.0
+    most = 0
+    for user_id in range(1, options.users + 1):
+        clock.now += step
+        started = time.perf_counter()
+        rev.rate_limited(limits, user_id, user_id % options.guilds)
+        spent += time.perf_counter() - started
+        if user_id % 1000 == 0:
+            most = max(most, sum(len(limiter.buckets) for limiter in limits.values()))
+    return spent, most
+
+def traced_churn(rev, limits, clock, options):
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    _, most = churn(rev, limits, clock, options)
+    held = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return held, most
+
+def spam(rev, limits, clock, options):
+    # --spammers click every --spam-interval for --spam-seconds while regular users click at half
+    # the rate their bucket refills, a click every two seconds or a ticket every two minutes
+    user = limits["user"]
+    regular_every = max(1, round(2 / user.rate / options.spam_interval))
+    accepted = dict.fromkeys(range(options.spammers), 0)
+    regular = [0, 0]  # accepted, clicks
+    started = time.perf_counter()
+    calls = 0
+    ticks = round(options.spam_seconds / options.spam_interval)
+    for tick in range(ticks):
+        clock.now += options.spam_interval
+        for spammer in accepted:
+            accepted[spammer] += not rev.rate_limited(limits, -1 - spammer, spammer % options.guilds)
+            calls += 1
+        if tick % regular_every == 0:
+            for user_id in range(1, options.regulars + 1):
+                regular[0] += not rev.rate_limited(limits, user_id, user_id % options.guilds)
+                regular[1] += 1
+                calls += 1
+    seconds = time.perf_counter() - started
+    allowed = user.capacity + user.rate * options.spam_seconds  # What one bucket lets through in that time
+    return {
+        "calls": calls,
+        "call_ns": round(seconds / calls * 1e9),
+        "allowed_per_spammer": round(allowed, 1),
+        "most_accepted": max(accepted.values()),
+        "regular_accepted": regular[0],
+        "regular_clicks": regular[1]
+    }
+
+def run(rev, clock, options):
+    report = {"users": options.users, "arrivals": options.arrivals, "limits": {}}
+    for name, limits in (("interaction", rev.interaction_limits), ("ticket", rev.ticket_limits)):
+        spent, most = churn(rev, copy_limits(rev, limits), clock, options)
+        held, _ = traced_churn(rev, copy_limits(rev, limits), clock, options)
+        unbounded, _ = traced_churn(rev, copy_limits(rev, limits, expire=False), clock, options)
+        report["limits"][name] = {
+            "idle_after": limits["user"].idle_after,
+            "call_ns": round(spent / options.users * 1e9),
+            "most_buckets": most,
+            "memory_mb": round(held / 2**20, 1),
+            "unexpired_memory_mb": round(unbounded / 2**20, 1),
+            "spam": spam(rev, copy_limits(rev, limits), clock, options)
+        }
+    return report
+
+def print_report(report):
+    print(f"{report['users']} distinct users at {report['arrivals']} a second, simulated clock")
+    print(f"{'limit':>12}{'idle s':>8}{'ns/call':>9}{'buckets':>9}{'MiB':>7}{'never expired MiB':>19}")
+    for name, result in report["limits"].items():
+        print(
+            f"{name:>12}{result['idle_after']:>8}{result['call_ns']:>9}{result['most_buckets']:>9}"
+            f"{result['memory_mb']:>7}{result['unexpired_memory_mb']:>19}"
+        )
+    for name, result in report["limits"].items():
+        spam = result["spam"]
+        print(
+            f"{name} spam: the busiest spammer got {spam['most_accepted']} clicks through, a bucket allows "
+            f"{spam['allowed_per_spammer']}; regular users {spam['regular_accepted']}/{spam['regular_clicks']}; {spam['call_ns']} ns/call"
+        )
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cost and memory of the anti-spam rate limiters.")
+    parser.add_argument("--users", type=int, default=1000000, help="distinct users that each click once")
+    parser.add_argument("--arrivals", type=float, default=2000, help="new users a second")
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--spammers", type=int, default=20)
+    parser.add_argument("--regulars", type=int, default=10, help="regular users clicking during the spam")
+    parser.add_argument("--spam-interval", type=float, default=0.01, help="seconds between each spammer's clicks")
+    parser.add_argument("--spam-seconds", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where the bot keeps its files, a new temporary directory by default")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-call-ns", type=float, help="fail if a rate limit check takes longer on average")
+    parser.add_argument("--max-buckets", type=int, help="fail if a limiter ever holds more buckets than this")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    rev = import_rev(options.data_dir)
+    clock = Clock()
+    monotonic = rev.time.monotonic
+    rev.time.monotonic = clock  # TokenBucket and RateLimiter read the time through it
+    try:
+        report = run(rev, clock, options)
+    finally:
+        rev.time.monotonic = monotonic
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    failures = []
+    for name, result in report["limits"].items():
+        spam = result["spam"]
+        if spam["most_accepted"] > spam["allowed_per_spammer"] + 1:
+            failures.append(f"a spammer got {spam['most_accepted']} {name} clicks through, over {spam['allowed_per_spammer']}")
+        if spam["regular_accepted"] < spam["regular_clicks"]:
+            failures.append(f"{spam['regular_clicks'] - spam['regular_accepted']} {name} clicks of regular users rejected")
+        if options.max_call_ns is not None and result["call_ns"] > options.max_call_ns:
+            failures.append(f"a {name} check took {result['call_ns']} ns, over {options.max_call_ns} ns")
+        if options.max_buckets is not None and result["most_buckets"] > options.max_buckets:
+            failures.append(f"the {name} limiters held {result['most_buckets']} buckets, over {options.max_buckets}")
+    for failure in failures:
+        print(f"LIMIT EXCEEDED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+# Ticket lifecycle benchmark: what 100k scheduled tickets cost the bot while nothing is due, and
+# whether the ones that are overdue get closed.
+#
+#   python bench/scheduler.py
+#   python bench/scheduler.py --tickets 100000 --idle 30 --max-idle-cpu 1 --max-memory 40
+#
+# --tickets tickets in every stage are written to the store before the bot starts, all active
+# recently enough that none of their deadlines comes up during the run. --overdue more have been
+# quiet past their automatic close, as after a restart that followed some downtime, and their
+# channels exist with a few messages each. The bot logs in and the scheduler picks up every ticket
+# in on_ready. Once the overdue tickets are archived and deleted the bot is left idle for --idle
+# seconds, and the report has the CPU time it used meanwhile. Memory is what a fresh scheduler
+# holds for the same tickets under tracemalloc, next to one sleeping task per ticket, which is
+# what the scheduler replaced.
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+from harness import Shop, current_rss, user_payload
+
+class Lifecycle(Shop):
+    def seed(self, guild_ids, overdue_channels):
+        # Straight into SQLite, the bot hasn't started yet
+        rev = self.rev
+        now = time.time()
+        stages = list(rev.TICKET_DEADLINES)
+        tickets = []
+        for number in range(self.options.tickets):
+            stage = stages[number % len(stages)]
+            first = min((after for after in rev.TICKET_DEADLINES[stage] if after is not None), default=3600)
+            updated_at = now - random.uniform(0, first / 2)
+            tickets.append(self.row(guild_ids[number % len(guild_ids)], self.fake.snowflake(), stage, updated_at))
+        for number, (guild_id, channel_id) in enumerate(overdue_channels):
+            stage = [rev.TICKET_OPEN, "item_selected", rev.TICKET_AWAITING_PAYMENT, rev.TICKET_COMPLETED][number % 4]
+            tickets.append(self.row(guild_id, channel_id, stage, now - rev.TICKET_DEADLINES[stage][1] - 60))
+        conn = sqlite3.connect(rev.STORE_FILE)
+        with conn:
+            conn.executemany(
+                "INSERT INTO tickets (channel_id, guild_id, buyer_id, status, total_cents, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                tickets
+            )
+        conn.close()
+        return [
+            {"channel_id": channel_id, "guild_id": guild_id, "status": status, "total_cents": total_cents, "updated_at": updated_at}
+            for channel_id, guild_id, buyer_id, status, total_cents, created_at, updated_at in tickets
+        ]
+
+    def row(self, guild_id, channel_id, stage, updated_at):
+        # item_selected is stored as open with something in the cart
+        status, total_cents = (self.rev.TICKET_OPEN, 1000) if stage == "item_selected" else (stage, 0)
+        return (channel_id, guild_id, self.fake.snowflake(), status, total_cents, updated_at - 600, updated_at)
+
+    def overdue_channels(self, payloads):
+        channels = []
+        for number in range(self.options.overdue):
+            payload = payloads[number % len(payloads)]
+            guild_id = int(payload["id"])
+            channel = self.fake.text_channel(guild_id, f"ticket-{number}")
+            channel_id = int(channel["id"])
+            self.fake.channels[channel_id] = channel
+            payload["channels"].append(channel)
+            for content in ("welcome to your ticket!", "Please select an item to purchase:", "sent it"):
+                message = self.fake.message(channel_id, {"content": content})
+                message["author"] = user_payload(self.fake.snowflake(), "buyer")
+                self.fake.history[channel_id].append(message)  # Not the channel's last message, so it doesn't count as activity
+            channels.append((guild_id, channel_id))
+        return channels
+
+    async def closed(self, channels):
+        # Waits until every overdue ticket's channel has been deleted, or --timeout runs out
+        started = time.perf_counter()
+        while any(channel_id in self.fake.channels for _, channel_id in channels):
+            if time.perf_counter() - started > self.options.timeout:
+                break
+            await asyncio.sleep(0.05)
+        return time.perf_counter() - started, sum(channel_id not in self.fake.channels for _, channel_id in channels)
+
+    async def idle(self):
+        gc.collect()
+        rss = current_rss()
+        cpu = time.process_time()
+        await asyncio.sleep(self.options.idle)
+        return time.process_time() - cpu, current_rss() - rss
+
+    def scheduler_memory(self, tickets):
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        scheduler = self.rev.TicketScheduler()
+        for ticket in tickets:
+            scheduler.schedule_ticket(ticket, ticket["updated_at"])
+        allocated = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        return allocated, len(scheduler.heap)
+
+    async def sleeping_tasks(self, tickets):
+        # The alternative: a task per ticket sleeping until its first deadline
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        now = time.time()
+        tasks = []
+        for ticket in tickets:
+            remind_after, close_after = self.rev.TICKET_DEADLINES.get(self.rev.ticket_stage(ticket), (None, None))
+            deadlines = [ticket["updated_at"] + after for after in (remind_after, close_after) if after is not None]
+            if deadlines:
+                tasks.append(asyncio.create_task(asyncio.sleep(min(deadlines) - now)))
+        await asyncio.sleep(0)  # Let them start sleeping
+        allocated = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        cpu_seconds, _ = await self.idle()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return allocated, cpu_seconds
+
+    async def run(self):
+        options = self.options
+        payloads = self.setup_guilds(self.guild_ids(options.guilds))
+        channels = self.overdue_channels(payloads)
+        tickets = self.seed([guild_id for guild_id, _, _, _ in self.guilds], channels)
+        idle_tickets = tickets[:options.tickets]
+
+        started = time.perf_counter()
+        await self.fake.start(payloads)
+        startup_seconds = time.perf_counter() - started
+        scheduler = self.rev.ticket_scheduler
+        scheduled = len(scheduler.scheduled)
+
+        close_seconds, closed = await self.closed(channels)
+        transcripts = sum(len(files) for _, _, files in os.walk(self.rev.TRANSCRIPT_DIR))
+        idle_cpu, idle_rss = await self.idle()
+        scheduler_bytes, heap_entries = self.scheduler_memory(idle_tickets)
+        tasks_bytes, tasks_cpu = await self.sleeping_tasks(idle_tickets)
+        await self.fake.close()
+        return {
+            "tickets": len(idle_tickets),
+            "overdue": len(channels),
+            "startup_seconds": round(startup_seconds, 3),
+            "scheduled_at_startup": scheduled,
+            "still_scheduled": len(scheduler.scheduled),
+            "closed": closed,
+            "transcripts": transcripts,
+            "close_seconds": round(close_seconds, 2),
+            "idle_seconds": options.idle,
+            "idle_cpu_percent": round(idle_cpu / options.idle * 100, 3),
+            "idle_rss_growth_mb": round(idle_rss / 2**20, 2),
+            "heap_entries": heap_entries,
+            "scheduler_memory_mb": round(scheduler_bytes / 2**20, 2),
+            "scheduler_bytes_per_ticket": round(scheduler_bytes / max(1, heap_entries), 1),
+            "tasks_memory_mb": round(tasks_bytes / 2**20, 2),
+            "tasks_bytes_per_ticket": round(tasks_bytes / max(1, heap_entries), 1),
+            "tasks_idle_cpu_percent": round(tasks_cpu / options.idle * 100, 3)
+        }
+
+def print_report(report):
+    print(f"{report['tickets']} tickets plus {report['overdue']} overdue, started in {report['startup_seconds']}s with {report['scheduled_at_startup']} scheduled")
+    print(f"Overdue: {report['closed']} closed and {report['transcripts']} transcripts written in {report['close_seconds']}s, {report['still_scheduled']} still scheduled")
+    print(f"Idle for {report['idle_seconds']}s: {report['idle_cpu_percent']}% CPU, RSS grew {report['idle_rss_growth_mb']} MiB")
+    print(f"{'':<24}{'MiB':>8}{'bytes/ticket':>14}{'idle CPU %':>12}")
+    print(f"{'scheduler heap':<24}{report['scheduler_memory_mb']:>8}{report['scheduler_bytes_per_ticket']:>14}{report['idle_cpu_percent']:>12}")
+    print(f"{'a task per ticket':<24}{report['tasks_memory_mb']:>8}{report['tasks_bytes_per_ticket']:>14}{report['tasks_idle_cpu_percent']:>12}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure what many scheduled tickets cost while idle, and the closing of overdue ones.")
+    parser.add_argument("--tickets", type=int, default=100000, help="tickets in the store with deadlines still ahead")
+    parser.add_argument("--overdue", type=int, default=40, help="tickets past their automatic close when the bot starts")
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--idle", type=float, default=10.0, help="seconds the bot is left idle while CPU time is measured")
+    parser.add_argument("--rest-latency", type=float, default=0.05, help="average seconds each REST call takes")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds the overdue tickets have to close")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where the bot keeps its files, a new temporary directory by default")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-idle-cpu", type=float, help="fail if the idle bot uses more than this percent of a CPU")
+    parser.add_argument("--max-memory", type=float, help="fail if the scheduler holds more MiB than this")
+    options = parser.parse_args(argv)
+    options.think = 0.0
+    return options
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    report = asyncio.run(Lifecycle(options).run())
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    failures = []
+    if report["closed"] < report["overdue"]:
+        failures.append(f"{report['overdue'] - report['closed']} overdue tickets were not closed")
+    if options.max_idle_cpu is not None and report["idle_cpu_percent"] > options.max_idle_cpu:
+        failures.append(f"idle CPU {report['idle_cpu_percent']}% is over {options.max_idle_cpu}%")
+    if options.max_memory is not None and report["scheduler_memory_mb"] > options.max_memory:
+        failures.append(f"the scheduler holds {report['scheduler_memory_mb']} MiB, over {options.max_memory} MiB")
+    for failure in failures:
+        print(f"LIMIT EXCEEDED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
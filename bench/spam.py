@@ -0,0 +1,153 @@
+# Anti-spam load test: latency for legitimate shoppers while other users hammer the Purchase button.
+#
+#   python bench/spam.py
+#   python bench/spam.py --users 200 --spammers 40 --spam-rate 20 --max-p99 1.5
+#
+# The same shopping run happens twice on separate guilds: once alone, and once while --spammers
+# users in those guilds click Purchase --spam-rate times a second each until every shopper is done.
+# The spam starts --spam-lead seconds before the first shopper arrives.
+# Shoppers go through the whole flow as in bench/harness.py. The report compares the shoppers' step
+# latencies between the two runs, and counts how the bot answered the spam clicks and how many
+# tickets the spammers got.
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+
+from harness import Shop, StepFailed, percentiles, user_payload
+
+SPAM_ANSWERS = {
+    "Ticket created": "ticket opened",
+    "You already have an open ticket": "pointed at their ticket",
+    "You're doing that too fast": "too fast",
+    "Too many tickets are being opened": "guild ticket limit",
+    "The bot is very busy": "busy"
+}
+
+class Spam(Shop):
+    def __init__(self, options):
+        super().__init__(options)
+        self.spam_answers = Counter()
+
+    async def answer(self, interaction):
+        try:
+            content = await interaction.wait(lambda sent: sent.messages[-1]["content"] if sent.messages else None, self.options.timeout)
+        except StepFailed:
+            content = None
+        finally:
+            self.fake.done_with(interaction)
+        if content is None:
+            self.spam_answers["no answer"] += 1
+        else:
+            self.spam_answers[next((name for text, name in SPAM_ANSWERS.items() if content.startswith(text)), content[:40])] += 1
+
+    async def spam(self, guild_id, storefront, done):
+        spammer = user_payload(self.fake.snowflake(), "spammer")
+        message, button = storefront
+        click = self.click(spammer, guild_id, message, button)
+        answers = []
+        while not done.is_set():
+            answers.append(asyncio.create_task(self.answer(click())))
+            await asyncio.sleep(random.expovariate(self.options.spam_rate))
+        await asyncio.gather(*answers)
+
+    async def shop(self, guilds, storefronts, spammers):
+        self.latencies.clear()
+        self.acknowledgements.clear()
+        self.errors.clear()
+        self.completed = 0
+        self.spam_answers.clear()
+        done = asyncio.Event()
+        spam = [
+            asyncio.create_task(self.spam(guilds[number % len(guilds)][0], storefronts[number % len(guilds)], done))
+            for number in range(spammers)
+        ]
+        if spammers:
+            await asyncio.sleep(self.options.spam_lead)
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            self.shopper(number, guilds[number % len(guilds)][0], storefronts[number % len(guilds)], guilds[number % len(guilds)][3])
+            for number in range(self.options.users)
+        ))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await asyncio.gather(*spam)
+
+        steps = {step: percentiles(samples) for step, samples in self.latencies.items()}
+        return {
+            "spammers": spammers,
+            "spam_clicks": sum(self.spam_answers.values()),
+            "spam_answers": dict(self.spam_answers),
+            "completed": self.completed,
+            "failed": sum(self.errors.values()),
+            "errors": dict(self.errors),
+            "seconds": round(elapsed, 2),
+            "acknowledgement": percentiles(self.acknowledgements),
+            "steps": steps,
+            "worst_p99_ms": max([stats["p99_ms"] for step, stats in steps.items() if step != "ticket_ready"] or [0.0])
+        }
+
+    async def run(self):
+        options = self.options
+        await self.fake.start(self.setup_guilds(self.guild_ids(options.guilds * 2)))
+        storefronts = await asyncio.gather(*(self.open_storefront(*guild) for guild in self.guilds))
+        runs = [
+            await self.shop(self.guilds[:options.guilds], storefronts[:options.guilds], 0),
+            await self.shop(self.guilds[options.guilds:], storefronts[options.guilds:], options.spammers)
+        ]
+        await self.fake.close()
+        return {"users": options.users, "guilds": options.guilds, "spam_rate": options.spam_rate, "runs": runs}
+
+def print_report(report):
+    print(f"{report['users']} shoppers over {report['guilds']} guilds")
+    print(f"{'spammers':>9}{'clicks':>8}{'completed':>11}{'ack p99 ms':>12}{'purchase p99 ms':>17}{'ready p99 ms':>14}{'worst p99 ms':>14}")
+    for run in report["runs"]:
+        steps = run["steps"]
+        print(
+            f"{run['spammers']:>9}{run['spam_clicks']:>8}{run['completed']:>11}{run['acknowledgement'].get('p99_ms', '-'):>12}"
+            f"{steps.get('purchase', {}).get('p99_ms', '-'):>17}{steps.get('ticket_ready', {}).get('p99_ms', '-'):>14}{run['worst_p99_ms']:>14}"
+        )
+    for run in report["runs"]:
+        for answer, count in sorted(run["spam_answers"].items(), key=lambda item: -item[1]):
+            print(f"  {count:>8}  spam clicks: {answer}")
+        for error, count in run["errors"].items():
+            print(f"FAILED x{count} with {run['spammers']} spammers: {error}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure shoppers' latency while other users spam the Purchase button.")
+    parser.add_argument("--users", type=int, default=100, help="legitimate shoppers per run")
+    parser.add_argument("--guilds", type=int, default=10, help="guilds per run, each run gets its own")
+    parser.add_argument("--spammers", type=int, default=20)
+    parser.add_argument("--spam-rate", type=float, default=10.0, help="average clicks per second from each spammer")
+    parser.add_argument("--spam-lead", type=float, default=0.0, help="seconds the spam runs before the shoppers start")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which the shoppers arrive")
+    parser.add_argument("--think", type=float, default=0.2, help="average seconds a shopper waits between steps")
+    parser.add_argument("--rest-latency", type=float, default=0.05, help="average seconds each REST call takes")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds a step may take before the shopper gives up")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where the bot keeps its files, a new temporary directory by default")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-p99", type=float, help="fail if any shopper step's p99 under spam is over this many seconds")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    report = asyncio.run(Spam(options).run())
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    spammed = report["runs"][-1]
+    failures = [f"{run['failed']} shoppers failed with {run['spammers']} spammers" for run in report["runs"] if run["failed"]]
+    if options.max_p99 is not None and spammed["worst_p99_ms"] > options.max_p99 * 1000:
+        failures.append(f"slowest step p99 {spammed['worst_p99_ms']} ms under spam is over {options.max_p99 * 1000} ms")
+    for failure in failures:
+        print(f"LIMIT EXCEEDED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
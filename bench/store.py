@@ -0,0 +1,125 @@
+# Ticket store load test: interaction latency with many tickets open at once.
+#
+#   python bench/store.py
+#   python bench/store.py --open-tickets 10000 --rate 2000 --max-p99 0.05
+#
+# Opens --open-tickets tickets across --guilds guilds, each with a cart, then has every one of them
+# make an interaction's worth of store calls at --rate interactions per second: look the ticket up
+# by channel and by buyer, change a cart line, read the cart back and move the ticket to awaiting
+# payment and back. The report has the latency percentiles of those interactions and how late the
+# event loop ran while they were in flight, which stays near zero as long as no query blocks it.
+# bench/harness.py measures whole interactions through the bot's handlers.
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from harness import import_rev, percentiles
+
+ITEMS = ["Item A", "Item B", "Item C", "Item D"]
+LAG_INTERVAL = 0.01  # Seconds between event loop lag samples
+
+async def watch_loop_lag(samples, stop):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        samples.append(time.perf_counter() - started - LAG_INTERVAL)
+
+async def open_tickets(store, options):
+    tickets = []
+    for i in range(options.open_tickets):
+        channel_id, guild_id, buyer_id = 10**17 + i, 10**16 + i % options.guilds, 10**15 + i
+        tickets.append((channel_id, guild_id, buyer_id))
+    started = time.perf_counter()
+    for chunk in range(0, len(tickets), 500):
+        await asyncio.gather(*[store.create_ticket(*ticket) for ticket in tickets[chunk:chunk + 500]])
+        await asyncio.gather(*[
+            store.set_cart_quantity(channel_id, random.choice(ITEMS), random.randint(1, 5), 1000)
+            for channel_id, _, _ in tickets[chunk:chunk + 500]
+        ])
+    return tickets, time.perf_counter() - started
+
+async def interaction(rev, store, ticket, latencies):
+    channel_id, guild_id, buyer_id = ticket
+    started = time.perf_counter()
+    assert await store.get_ticket(channel_id)
+    assert await store.open_ticket_for_buyer(guild_id, buyer_id)
+    await store.set_cart_quantity(channel_id, random.choice(ITEMS), random.randint(1, 5), 1000)
+    assert await store.get_cart(channel_id)
+    assert await store.transition(channel_id, rev.CART_EDITABLE_STATUSES, rev.TICKET_AWAITING_PAYMENT)
+    assert await store.transition(channel_id, rev.TICKET_AWAITING_PAYMENT, rev.TICKET_OPEN)
+    latencies.append(time.perf_counter() - started)
+
+async def run(rev, options):
+    store = rev.TicketStore(os.path.join(options.data_dir, "tickets.db"), workers=options.workers)
+    tickets, setup_seconds = await open_tickets(store, options)
+
+    latencies, lag = [], []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop_lag(lag, stop))
+    random.shuffle(tickets)
+    started = time.perf_counter()
+    tasks = []
+    for i, ticket in enumerate(tickets):
+        delay = started + i / options.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(interaction(rev, store, ticket, latencies)))
+    await asyncio.gather(*tasks)
+    seconds = time.perf_counter() - started
+    stop.set()
+    await watcher
+
+    return {
+        "open_tickets": len(tickets),
+        "guilds": options.guilds,
+        "workers": options.workers,
+        "setup_seconds": round(setup_seconds, 2),
+        "seconds": round(seconds, 2),
+        "interactions_per_second": round(len(latencies) / seconds, 1),
+        "interaction": percentiles(latencies),
+        "loop_lag": percentiles(lag)
+    }
+
+def print_report(report):
+    print(f"{report['open_tickets']} open tickets over {report['guilds']} guilds, opened in {report['setup_seconds']}s")
+    print(f"{report['interactions_per_second']} interactions/s on {report['workers']} store threads")
+    print(f"{'':<14}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name in ("interaction", "loop_lag"):
+        stats = report[name]
+        print(f"{name:<14}{stats['count']:>8}{stats['p50_ms']:>10}{stats['p90_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure ticket store latency with many tickets open at once.")
+    parser.add_argument("--open-tickets", type=int, default=10000)
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=2000.0, help="interactions started per second")
+    parser.add_argument("--workers", type=int, default=4, help="store threads, as in TicketStore")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where the store is created, a new temporary directory by default")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-p99", type=float, help="fail if the interaction p99 is over this many seconds")
+    options = parser.parse_args(argv)
+    options.data_dir = options.data_dir or tempfile.mkdtemp(prefix="rev-store-")
+    return options
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    rev = import_rev(options.data_dir)
+    report = asyncio.run(run(rev, options))
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    if options.max_p99 is not None and report["interaction"]["p99_ms"] > options.max_p99 * 1000:
+        print(f"LIMIT EXCEEDED: interaction p99 {report['interaction']['p99_ms']} ms is over {options.max_p99 * 1000} ms", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+# Embed template micro-benchmark: CPU time and memory per interaction, building each embed from
+# scratch the way the handlers used to against rendering it from the template cache.
+#
+#   python bench/templates.py
+#   python bench/templates.py --iterations 50000 --min-speedup 1.5
+#
+# Every case fills in the same dynamic parts as its handler and ends with to_dict(), which is what
+# goes out in the request. "before" calls the template's builder every time, and for a payment
+# method also rebuilds the payment details dict as PaymentMethodDropdown did. "after" uses
+# render_embed, or cached_embed for the embeds that are sent as they are.
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from harness import import_rev
+
+AVATAR = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+def cases(rev, config):
+    cart = rev.Cart({
+        "Item A": rev.CartLine(2, 1000, 2000),
+        "Item B": rev.CartLine(1, 1500, 1500),
+        "Item C": rev.CartLine(5, 250, 1250)
+    }, 4750)
+    ticket = {"payment_method": "BTC"}
+
+    def fill_cart(embed):
+        for item, line in cart.lines.items():
+            embed.add_field(name=item, value=f"Quantity: {line.quantity}\nPrice: {rev.format_cents(line.subtotal_cents)}", inline=False)
+        return embed
+
+    def fill_paid(embed):
+        embed.description = "<@1> has marked the payment as paid."
+        embed.add_field(name="Items Purchased", value=cart.summary(), inline=False)
+        embed.add_field(name="Total Price", value=rev.format_cents(cart.total_cents), inline=False)
+        embed.add_field(name="Payment Method", value=ticket["payment_method"], inline=False)
+        return embed
+
+    def fill_completed(embed):
+        embed.description = "<@1>, give a review. If you don't, you will be blacklisted."
+        return embed
+
+    def fill_review(embed):
+        embed.description = "Fast and friendly."
+        embed.set_author(name="shopper", icon_url=AVATAR)
+        embed.add_field(name="Items Purchased", value=cart.summary(), inline=False)
+        embed.add_field(name="Total Price", value=rev.format_cents(cart.total_cents), inline=False)
+        embed.add_field(name="Payment Method", value=ticket["payment_method"], inline=False)
+        embed.add_field(name="Star Rating", value="⭐" * 5, inline=False)
+        return embed
+
+    def payment_before():
+        details = {method: dict(fields) for method, fields in rev.PAYMENT_DETAILS.items()}  # Rebuilt on every selection
+        return rev.build_payment_embed("BTC", {**config.settings, "payment_details": details})
+
+    build = rev.embed_builders
+    return {
+        "setup": (lambda: build["setup"](config), lambda: rev.cached_embed(config, "setup")),
+        "cart": (lambda: fill_cart(build["cart"](config)), lambda: fill_cart(rev.render_embed(config, "cart"))),
+        "marked_as_paid": (
+            lambda: fill_paid(build["marked_as_paid"](config)), lambda: fill_paid(rev.render_embed(config, "marked_as_paid"))
+        ),
+        "deal_completed": (
+            lambda: fill_completed(build["deal_completed"](config)), lambda: fill_completed(rev.render_embed(config, "deal_completed"))
+        ),
+        "review": (lambda: fill_review(build["review"](config)), lambda: fill_review(rev.render_embed(config, "review"))),
+        "payment": (payment_before, lambda: rev.cached_embed(config, "payment:BTC"))
+    }
+
+def cpu_us(render, iterations):
+    render().to_dict()  # Fills the template cache
+    started = time.process_time()
+    for _ in range(iterations):
+        render().to_dict()
+    return (time.process_time() - started) / iterations * 1e6
+
+def allocated_kb(render, iterations):
+    # Peak traced memory of one interaction, rendering and serializing included, averaged
+    render().to_dict()
+    gc.collect()
+    tracemalloc.start()
+    total = 0
+    for _ in range(iterations):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        payload = render().to_dict()
+        total += tracemalloc.get_traced_memory()[1] - baseline
+        del payload
+    tracemalloc.stop()
+    return total / iterations / 1024
+
+def run(options):
+    rev = import_rev(options.data_dir)
+    config = rev.GuildConfig(None, {"payment_details": rev.PAYMENT_DETAILS})  # A storefront with payment methods set up
+    report = {"iterations": options.iterations, "cases": {}}
+    for name, (before, after) in cases(rev, config).items():
+        report["cases"][name] = {
+            "before_us": round(cpu_us(before, options.iterations), 2),
+            "after_us": round(cpu_us(after, options.iterations), 2),
+            "before_kb": round(allocated_kb(before, options.iterations // 10 or 1), 2),
+            "after_kb": round(allocated_kb(after, options.iterations // 10 or 1), 2)
+        }
+    results = report["cases"].values()
+    report["before_us"] = round(sum(result["before_us"] for result in results), 2)
+    report["after_us"] = round(sum(result["after_us"] for result in results), 2)
+    report["speedup"] = round(report["before_us"] / report["after_us"], 2)
+    return report
+
+def print_report(report):
+    print(f"{'embed':<16}{'before us':>11}{'after us':>10}{'before KiB':>12}{'after KiB':>11}")
+    for name, result in report["cases"].items():
+        print(f"{name:<16}{result['before_us']:>11}{result['after_us']:>10}{result['before_kb']:>12}{result['after_kb']:>11}")
+    print(f"All six: {report['before_us']} us before, {report['after_us']} us after, {report['speedup']}x faster")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare building embeds from scratch with rendering them from templates.")
+    parser.add_argument("--iterations", type=int, default=20000, help="renders timed per case, a tenth of that traced for memory")
+    parser.add_argument("--data-dir", help="where the bot keeps its files, a new temporary directory by default")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--min-speedup", type=float, help="fail if the templates are not at least this many times faster")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    options = parse_args(argv)
+    report = run(options)
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    if options.min_speedup is not None and report["speedup"] < options.min_speedup:
+        print(f"LIMIT EXCEEDED: {report['speedup']}x is under {options.min_speedup}x", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
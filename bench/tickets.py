@@ -0,0 +1,160 @@
+# Ticket opening benchmark: tickets opened per second during a purchase rush, against FakeDiscord
+# with every REST call taking --rest-latency.
+#
+#   python bench/tickets.py
+#   python bench/tickets.py --guilds 100 --per-guild 8 --rest-latency 0.1 --min-rate 100
+#
+# The rush runs twice on separate guilds, first with the warm pool of ticket channels turned off,
+# so every ticket creates its channel, then with TICKET_POOL_SIZE channels kept ready. Creating a
+# channel takes --create-latency on top of the usual REST latency, claiming one from the pool is an
+# ordinary edit. Purchases run on the bot's worker pool, so --workers bounds the rate. Each guild
+# gets one unmeasured purchase first, which resolves its ticket category and fills its pool the
+# way the first purchase after a restart would. Then --per-guild shoppers per guild click Purchase
+# within --ramp seconds. A ticket counts as open when its item select has been posted in it.
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+import time
+from collections import Counter
+
+from harness import Shop, StepFailed, expect_message, find_component, percentiles, user_payload
+
+CREATE_CHANNEL = "POST /guilds/{guild_id}/channels"
+
+class Rush(Shop):
+    def __init__(self, options):
+        super().__init__(options)
+        self.pool_size = self.rev.TICKET_POOL_SIZE
+        if options.workers:
+            self.rev.worker_pool.workers = options.workers  # Read when the first job starts the workers
+        self.request = self.fake.request
+        self.fake.request = self.slow_create
+
+    async def slow_create(self, route, body=None, params=None):
+        if route.key == CREATE_CHANNEL and self.options.create_latency:
+            await asyncio.sleep(self.options.create_latency * random.uniform(0.5, 1.5))
+        return await self.request(route, body, params)
+
+    async def open_ticket(self, name, guild_id, storefront, ramp=0.0):
+        await asyncio.sleep(random.uniform(0, ramp))
+        message, button = storefront
+        started = time.perf_counter()
+        buyer = user_payload(self.fake.snowflake(), name)
+        channel_id = await self.step("purchase", self.click(buyer, guild_id, message, button), expect_message(
+            lambda message: (match := re.search(r"Ticket created: <#(\d+)>", message["content"])) and int(match.group(1))
+        ))
+        await self.fake.wait_for_message(channel_id, lambda history: find_component(history, "item_select"), self.options.timeout)
+        self.latencies["ticket_ready"].append(time.perf_counter() - started)
+
+    async def rush(self, pool_size, guilds, storefronts):
+        self.rev.TICKET_POOL_SIZE = pool_size
+        await asyncio.gather(*(
+            self.open_ticket(f"warmup-{guild[0]}", guild[0], storefront) for guild, storefront in zip(guilds, storefronts)
+        ))
+        while self.rev.ticket_pool_refills:
+            await asyncio.sleep(0.01)
+        self.latencies.clear()
+        self.errors.clear()
+
+        calls = Counter(self.fake.calls)
+        started = time.perf_counter()
+        results = await asyncio.gather(*(
+            self.open_ticket(f"shopper-{number}", guild[0], storefront, self.options.ramp)
+            for number in range(self.options.per_guild)
+            for guild, storefront in zip(guilds, storefronts)
+        ), return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        while self.rev.ticket_pool_refills:
+            await asyncio.sleep(0.01)  # Refills after the rush still cost REST calls
+
+        failed = [result for result in results if isinstance(result, Exception)]
+        for error in failed:
+            if not isinstance(error, StepFailed):
+                raise error
+        opened = len(results) - len(failed)
+        rest = sum((self.fake.calls - calls).values())
+        return {
+            "pool_size": pool_size,
+            "tickets": opened,
+            "failed": len(failed),
+            "errors": dict(Counter(str(error) for error in failed)),
+            "seconds": round(elapsed, 3),
+            "tickets_per_second": round(opened / elapsed, 1) if elapsed else 0.0,
+            "purchase": percentiles(self.latencies["purchase"]),
+            "ticket_ready": percentiles(self.latencies["ticket_ready"]),
+            "rest_calls_per_ticket": round(rest / max(1, opened), 1)
+        }
+
+    async def run(self):
+        options = self.options
+        await self.fake.start(self.setup_guilds(self.guild_ids(options.guilds * 2)))
+        storefronts = await asyncio.gather(*(self.open_storefront(*guild) for guild in self.guilds))
+        runs = [
+            await self.rush(0, self.guilds[:options.guilds], storefronts[:options.guilds]),
+            await self.rush(self.pool_size, self.guilds[options.guilds:], storefronts[options.guilds:])
+        ]
+        await self.fake.close()
+        return {
+            "guilds": options.guilds,
+            "per_guild": options.per_guild,
+            "rest_latency": options.rest_latency,
+            "create_latency": options.create_latency,
+            "workers": self.rev.worker_pool.workers,
+            "runs": runs
+        }
+
+def print_report(report):
+    print(
+        f"{report['per_guild']} purchases in each of {report['guilds']} guilds on {report['workers']} workers, "
+        f"{report['rest_latency'] * 1000:g} ms per REST call and {report['create_latency'] * 1000:g} ms more to create a channel"
+    )
+    print(f"{'pool':>6}{'tickets':>9}{'failed':>8}{'per second':>12}{'reply p50 ms':>14}{'reply p99 ms':>14}{'ready p50 ms':>14}{'ready p99 ms':>14}{'REST/ticket':>13}")
+    for run in report["runs"]:
+        purchase, ready = run["purchase"], run["ticket_ready"]
+        print(
+            f"{run['pool_size']:>6}{run['tickets']:>9}{run['failed']:>8}{run['tickets_per_second']:>12}{purchase.get('p50_ms', '-'):>14}"
+            f"{purchase.get('p99_ms', '-'):>14}{ready.get('p50_ms', '-'):>14}{ready.get('p99_ms', '-'):>14}{run['rest_calls_per_ticket']:>13}"
+        )
+    for run in report["runs"]:
+        for error, count in run["errors"].items():
+            print(f"FAILED x{count} with pool size {run['pool_size']}: {error}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how many tickets per second the purchase flow opens.")
+    parser.add_argument("--guilds", type=int, default=50, help="guilds per run, each run gets its own")
+    parser.add_argument("--per-guild", type=int, default=8, help="purchases per guild, the anti-spam limit allows 9 at once")
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which the purchases arrive")
+    parser.add_argument("--rest-latency", type=float, default=0.05, help="average seconds each REST call takes")
+    parser.add_argument("--create-latency", type=float, default=0.2, help="average extra seconds creating a channel takes")
+    parser.add_argument("--workers", type=int, help="deferred handlers running at once, WORKER_POOL_SIZE by default")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds a purchase may take before it counts as failed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where the bot keeps its files, a new temporary directory by default")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--min-rate", type=float, help="fail if the run with the pool opens fewer tickets per second")
+    options = parser.parse_args(argv)
+    options.think = 0.0
+    return options
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    report = asyncio.run(Rush(options).run())
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    # Only the run with the pool is how the bot is deployed, the other one is there to compare against
+    pooled = report["runs"][-1]
+    failures = [f"{pooled['failed']} purchases failed"] if pooled["failed"] else []
+    if options.min_rate is not None and pooled["tickets_per_second"] < options.min_rate:
+        failures.append(f"{pooled['tickets_per_second']} tickets/s is under {options.min_rate}")
+    for failure in failures:
+        print(f"LIMIT EXCEEDED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+# Transcript export benchmark: memory and speed of archiving long tickets, and how long closing one
+# keeps the buyer waiting.
+#
+#   python bench/transcripts.py
+#   python bench/transcripts.py --sizes 1000,10000,50000 --max-peak 2048
+#
+# For each of --sizes a ticket channel is filled with that many messages from the buyer and staff,
+# some with attachments or a payment embed, and archived with archive_transcript, once timed and
+# once under tracemalloc. The same history is also exported the naive way, reading every record
+# into memory and writing the file in one go, for comparison. Only Python allocations are traced,
+# zlib's buffers are not, and the fake's pages are part of the peak as discord.py's would be. The
+# largest ticket is then closed with close_ticket: the report has how long that call took, which
+# is all the buyer waits for, and how long until the channel was deleted. Finally each transcript
+# is looked up by buyer and read back to check it's complete.
+import argparse
+import asyncio
+import gc
+import gzip
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+from harness import Shop, user_payload
+
+CHAT = ["hi", "I'd like 2 of the large one", "sent it", "here's the proof", "thanks!", "any update?", "received, completing now"]
+
+class Export(Shop):
+    def __init__(self, options):
+        super().__init__(options)
+        self.sent = {}  # channel id -> ids of its messages, oldest first, kept after the channel is deleted
+
+    def fill(self, payload, messages):
+        # A ticket channel with messages history in it, and its ticket row
+        guild_id = int(payload["id"])
+        channel = self.fake.text_channel(guild_id, f"ticket-{messages}")
+        channel_id = int(channel["id"])
+        self.fake.channels[channel_id] = channel
+        payload["channels"].append(channel)
+        buyer = user_payload(self.fake.snowflake(), "buyer")
+        staff = user_payload(self.fake.snowflake(), "staff")
+        config = self.rev.GuildConfig(None, {"payment_details": self.rev.PAYMENT_DETAILS})
+        payment = self.rev.build_payment_embed("BTC", config.settings).to_dict()
+        for number in range(messages):
+            message = self.fake.message(channel_id, {"content": random.choice(CHAT)})
+            message["author"] = buyer if number % 3 else staff
+            roll = random.random()
+            if roll < 0.05:
+                attachment_id = self.fake.snowflake()
+                message["attachments"] = [{
+                    "id": str(attachment_id), "filename": "proof.png", "size": 184320, "content_type": "image/png",
+                    "url": f"https://cdn.discordapp.com/attachments/{channel_id}/{attachment_id}/proof.png",
+                    "proxy_url": f"https://media.discordapp.net/attachments/{channel_id}/{attachment_id}/proof.png"
+                }]
+            elif roll < 0.07:
+                message["author"] = self.fake.bot_user
+                message["embeds"] = [payment]
+            self.fake.history[channel_id].append(message)
+        self.sent[channel_id] = [int(message["id"]) for message in self.fake.history[channel_id]]
+        now = time.time()
+        conn = sqlite3.connect(self.rev.STORE_FILE)
+        with conn:
+            conn.execute(
+                "INSERT INTO tickets (channel_id, guild_id, buyer_id, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (channel_id, guild_id, int(buyer["id"]), self.rev.TICKET_COMPLETED, now - 3600, now)
+            )
+        conn.close()
+        return guild_id, channel_id, int(buyer["id"])
+
+    async def timed(self, export):
+        started = time.perf_counter()
+        result = await export()
+        return result, time.perf_counter() - started
+
+    async def traced(self, export):
+        # Peak Python memory above what was held before the export started. Tracing slows the
+        # export down several times, so it's timed on its own run.
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        await export()
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+        return peak
+
+    async def buffered(self, channel):
+        # Every record in memory, then one write
+        rev = self.rev
+        records = [rev.transcript_record(message) async for message in channel.history(limit=None, oldest_first=True)]
+        text = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        path = f"{rev.TRANSCRIPT_DIR}/buffered-{channel.id}.ndjson.gz"
+        with gzip.open(path, "wt", encoding="utf-8") as file:
+            file.write(text)
+        return path
+
+    async def close(self, channel):
+        started = time.perf_counter()
+        await self.rev.close_ticket(channel, "Benchmark")
+        hidden = time.perf_counter() - started
+        while channel.id in self.fake.channels and time.perf_counter() - started < self.options.timeout:
+            await asyncio.sleep(0.01)
+        return hidden, time.perf_counter() - started, channel.id not in self.fake.channels
+
+    async def run(self):
+        options = self.options
+        payloads = self.setup_guilds(self.guild_ids(1))
+        tickets = [self.fill(payloads[0], size) for size in options.sizes]
+        await self.fake.start(payloads)
+        rev = self.rev
+
+        sizes = []
+        for size, (guild_id, channel_id, buyer_id) in zip(options.sizes, tickets):
+            channel = rev.bot.get_channel(channel_id)
+            path, seconds = await self.timed(lambda: rev.archive_transcript(channel))
+            _, buffered_seconds = await self.timed(lambda: self.buffered(channel))
+            peak = await self.traced(lambda: rev.archive_transcript(channel))
+            buffered_peak = await self.traced(lambda: self.buffered(channel))
+            sizes.append({
+                "messages": size,
+                "seconds": round(seconds, 3),
+                "messages_per_second": round(size / seconds),
+                "peak_kb": round(peak / 1024, 1),
+                "buffered_seconds": round(buffered_seconds, 3),
+                "buffered_peak_kb": round(buffered_peak / 1024, 1),
+                "bytes_per_message": round(os.path.getsize(path) / size, 1)
+            })
+
+        hidden, deleted, closed = await self.close(rev.bot.get_channel(tickets[-1][1]))
+
+        complete = 0
+        for size, (guild_id, channel_id, buyer_id) in zip(options.sizes, tickets):
+            rows = await rev.ticket_store.find_transcripts(guild_id, buyer_id)
+            if rows and rows[0]["channel_id"] == channel_id and rows[0]["messages"] == size:
+                with gzip.open(rows[0]["path"], "rt", encoding="utf-8") as file:
+                    complete += [json.loads(line)["id"] for line in file] == self.sent[channel_id]
+        await self.fake.close()
+        return {
+            "sizes": sizes,
+            "page_size": rev.TRANSCRIPT_PAGE_SIZE,
+            "peak_growth": round(sizes[-1]["peak_kb"] / max(0.1, sizes[0]["peak_kb"]), 2),
+            "close_seconds": round(hidden, 3),
+            "deleted_seconds": round(deleted, 3),
+            "closed": closed,
+            "complete_transcripts": complete
+        }
+
+def print_report(report):
+    print(f"{'messages':>9}{'seconds':>9}{'msgs/s':>9}{'peak KiB':>10}{'B/msg':>7}{'buffered s':>12}{'buffered KiB':>14}")
+    for size in report["sizes"]:
+        print(
+            f"{size['messages']:>9}{size['seconds']:>9}{size['messages_per_second']:>9}{size['peak_kb']:>10}"
+            f"{size['bytes_per_message']:>7}{size['buffered_seconds']:>12}{size['buffered_peak_kb']:>14}"
+        )
+    print(f"Peak memory grew {report['peak_growth']}x from the smallest ticket to the largest, pages of {report['page_size']}")
+    print(
+        f"Closing the largest: close_ticket returned in {report['close_seconds']}s, "
+        f"channel {'deleted' if report['closed'] else 'NOT deleted'} after {report['deleted_seconds']}s"
+    )
+    print(f"{report['complete_transcripts']}/{len(report['sizes'])} transcripts found by buyer and complete")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure memory and speed of exporting long ticket transcripts.")
+    parser.add_argument("--sizes", default="1000,10000", help="messages in each ticket, comma separated")
+    parser.add_argument("--rest-latency", type=float, default=0.01, help="average seconds each REST call takes")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds the closed ticket has to be deleted")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where the bot keeps its files, a new temporary directory by default")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-peak", type=float, help="fail if exporting any ticket peaks above this many KiB")
+    options = parser.parse_args(argv)
+    options.sizes = [int(size) for size in options.sizes.split(",")]
+    options.think = 0.0
+    return options
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    report = asyncio.run(Export(options).run())
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    failures = []
+    if not report["closed"]:
+        failures.append("the closed ticket's channel was not deleted")
+    if report["complete_transcripts"] < len(report["sizes"]):
+        failures.append(f"{len(report['sizes']) - report['complete_transcripts']} transcripts missing or incomplete")
+    peak = max(size["peak_kb"] for size in report["sizes"])
+    if options.max_peak is not None and peak > options.max_peak:
+        failures.append(f"an export peaked at {peak} KiB, over {options.max_peak} KiB")
+    for failure in failures:
+        print(f"LIMIT EXCEEDED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+# Restart benchmark: startup time and memory with many open tickets in the store, and how fast their
+# components work afterwards.
+#
+#   python bench/views.py
+#   python bench/views.py --tickets 50000 --max-startup 5 --max-memory 50
+#
+# --tickets open tickets are written to the store before the bot starts, as if it had been
+# restarted in the middle of a busy day. The bot then logs in to FakeDiscord, receives its guilds
+# and runs on_ready, which is what is timed, and RSS is read before and after. Only the --clicks
+# tickets that get clicked afterwards have their channels in the guilds. Each click is on the item
+# select of a message that was never sent by this process, so the view behind it has to be
+# restored from the store when it's used. For comparison the report also has what rebuilding every
+# ticket's view eagerly would have cost.
+import argparse
+import asyncio
+import gc
+import json
+import random
+import sqlite3
+import sys
+import time
+
+from harness import Shop, StepFailed, current_rss, expect_modal, find_component, percentiles, user_payload
+
+class Restart(Shop):
+    def seed(self, guild_ids):
+        # Straight into SQLite, the bot hasn't started yet
+        now = time.time()
+        tickets = []
+        for number in range(self.options.tickets):
+            status = self.rev.TICKET_OPEN if number % 3 else self.rev.TICKET_AWAITING_PAYMENT
+            tickets.append((self.fake.snowflake(), guild_ids[number % len(guild_ids)], self.fake.snowflake(), status, now, now))
+        conn = sqlite3.connect(self.rev.STORE_FILE)
+        with conn:
+            conn.executemany(
+                "INSERT INTO tickets (channel_id, guild_id, buyer_id, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)", tickets
+            )
+        conn.close()
+        return tickets
+
+    async def click(self, ticket, ramp):
+        channel_id, guild_id, buyer_id = ticket[:3]
+        await asyncio.sleep(random.uniform(0, ramp))
+        catalog = await self.rev.catalogs.get(guild_id)
+        view = self.rev.ItemSelectionView(catalog, buyer_id, channel_id)
+        message = self.fake.message(channel_id, {"components": view.to_components()})
+        message, select = find_component([message], "item_select")
+        buyer = user_payload(buyer_id, f"buyer-{buyer_id}")
+        try:
+            await self.step("item_select", super().click(buyer, guild_id, message, select, [select["options"][0]["value"]]), expect_modal)
+        except StepFailed as e:
+            self.errors[str(e)] += 1
+
+    async def eager(self, tickets):
+        # What on_ready would do if it rebuilt a view for every open ticket up front
+        gc.collect()
+        rss = current_rss()
+        started = time.perf_counter()
+        views = []
+        for channel_id, guild_id, buyer_id, status, created_at, updated_at in tickets:
+            ticket = {"channel_id": channel_id, "guild_id": guild_id, "buyer_id": buyer_id, "status": status}
+            views.append(await self.rev.ItemSelectionView.restore(ticket))
+        seconds = time.perf_counter() - started
+        gc.collect()
+        megabytes = (current_rss() - rss) / 2**20
+        del views
+        return seconds, megabytes
+
+    async def run(self):
+        options = self.options
+        payloads = self.setup_guilds(self.guild_ids(options.guilds))
+        tickets = self.seed([guild_id for guild_id, _, _, _ in self.guilds])
+        clicked = random.sample(tickets, min(options.clicks, len(tickets)))
+        payloads_by_guild = {int(payload["id"]): payload for payload in payloads}
+        for channel_id, guild_id, *_ in clicked:
+            channel = self.fake.text_channel(guild_id, f"ticket-{channel_id}")
+            channel["id"] = str(channel_id)
+            self.fake.channels[channel_id] = channel
+            payloads_by_guild[guild_id]["channels"].append(channel)
+
+        gc.collect()
+        rss = current_rss()
+        started = time.perf_counter()
+        await self.fake.start(payloads)
+        startup_seconds = time.perf_counter() - started
+        gc.collect()
+        startup_megabytes = (current_rss() - rss) / 2**20
+        view_store = self.fake.state._view_store
+
+        await asyncio.gather(*(self.click(ticket, options.ramp) for ticket in clicked))
+        eager_seconds, eager_megabytes = await self.eager(tickets)
+        await self.fake.close()
+        return {
+            "tickets": len(tickets),
+            "guilds": options.guilds,
+            "startup_seconds": round(startup_seconds, 3),
+            "startup_memory_mb": round(startup_megabytes, 1),
+            "scheduled_tickets": len(self.rev.ticket_scheduler.scheduled),
+            "persistent_views": len(view_store.persistent_views),
+            "clicks": len(clicked),
+            "failed": sum(self.errors.values()),
+            "errors": dict(self.errors),
+            "first_use": percentiles(self.latencies["item_select"]),
+            "eager_seconds": round(eager_seconds, 3),
+            "eager_memory_mb": round(eager_megabytes, 1)
+        }
+
+def print_report(report):
+    print(f"{report['tickets']} open tickets over {report['guilds']} guilds")
+    print(
+        f"Startup {report['startup_seconds']}s and {report['startup_memory_mb']} MiB, {report['persistent_views']} views held, "
+        f"{report['scheduled_tickets']} tickets scheduled"
+    )
+    first_use = report["first_use"]
+    if first_use:
+        print(f"First use of {first_use['count']} restored views: p50 {first_use['p50_ms']} ms, p99 {first_use['p99_ms']} ms")
+    print(f"Rebuilding every view at startup would add {report['eager_seconds']}s and {report['eager_memory_mb']} MiB")
+    for error, count in report["errors"].items():
+        print(f"FAILED x{count}: {error}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure startup with many open tickets and the first use of their views.")
+    parser.add_argument("--tickets", type=int, default=50000, help="open tickets in the store when the bot starts")
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--clicks", type=int, default=200, help="tickets whose item select is clicked after startup")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which the clicks arrive")
+    parser.add_argument("--rest-latency", type=float, default=0.05, help="average seconds each REST call takes")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds a click may take before it counts as failed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where the bot keeps its files, a new temporary directory by default")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-startup", type=float, help="fail if startup takes more seconds than this")
+    parser.add_argument("--max-memory", type=float, help="fail if startup takes more MiB than this")
+    options = parser.parse_args(argv)
+    options.think = 0.0
+    return options
+
+def main(argv=None):
+    options = parse_args(argv)
+    random.seed(options.seed)
+    report = asyncio.run(Restart(options).run())
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(report, file, indent=2)
+    failures = [f"{report['failed']} clicks failed"] if report["failed"] else []
+    if options.max_startup is not None and report["startup_seconds"] > options.max_startup:
+        failures.append(f"startup took {report['startup_seconds']}s, over {options.max_startup}s")
+    if options.max_memory is not None and report["startup_memory_mb"] > options.max_memory:
+        failures.append(f"startup took {report['startup_memory_mb']} MiB, over {options.max_memory} MiB")
+    for failure in failures:
+        print(f"LIMIT EXCEEDED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,30 +4,1372 @@ from discord.ext import commands
 from discord import app_commands
 from discord.ui import View, Button, Modal, TextInput, Select
 import asyncio
+import bisect
 import json
+import mmap
+import sqlite3
+import struct
+import threading
+import time
+from array import array
+from abc import ABC, abstractmethod
+from collections import namedtuple, OrderedDict, deque
+from functools import partial, wraps
+import hashlib
+import contextlib
+import random
+import csv
+import io
+import gzip
+import heapq
+import logging
+from aiohttp import web
+import subprocess
+import sys
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+startup_started = time.perf_counter()
+from concurrent.futures import ThreadPoolExecutor
+
+# Deployment. With nothing set the bot runs as a single process on one shard.
+#   SHARD_COUNT=auto   one process, discord.py picks the shard count
+#   SHARD_COUNT=<n>    one process running all n shards
+#   CLUSTER_COUNT=<k>  with SHARD_COUNT=<n>, split the shards over k processes. The processes share
+#                      tickets, carts, stock, settings and deals through the files below.
+#   DATA_DIR=<path>    where those files and the transcripts are kept, the working directory by
+#                      default. Every process of one deployment must use the same directory.
+SHARD_COUNT = os.environ.get("SHARD_COUNT")
+CLUSTER_COUNT = int(os.environ.get("CLUSTER_COUNT", "1"))
+CLUSTER_ID = int(os.environ.get("CLUSTER_ID", "0"))
+CLUSTER_OWNER = f"cluster-{CLUSTER_ID}:{os.getpid()}"  # Names this process in cluster locks
+CLUSTER_SYNC_INTERVAL = 5.0  # Seconds between checks for changes made by other clusters
+DATA_DIR = os.environ.get("DATA_DIR", ".")
+os.makedirs(DATA_DIR, exist_ok=True)
+
+def run_clusters():
+    # Parent process: start one child per cluster, each running this file with CLUSTER_ID set
+    children = []
+    for cluster_id in range(CLUSTER_COUNT):
+        env = dict(os.environ, CLUSTER_ID=str(cluster_id))
+        children.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env))
+    try:
+        for child in children:
+            child.wait()
+    except KeyboardInterrupt:
+        for child in children:
+            child.terminate()
+
+if __name__ == "__main__" and CLUSTER_COUNT > 1 and "CLUSTER_ID" not in os.environ:
+    if not (SHARD_COUNT or "").isdigit():
+        sys.exit("CLUSTER_COUNT needs SHARD_COUNT set to a number of shards")
+    run_clusters()
+    sys.exit()
+
+@contextlib.contextmanager
+def file_lock(path):
+    # Exclusive lock shared between processes, for files that every cluster writes
+    with open(path, "a+b") as file:
+        if fcntl:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+# Deal data: a binary snapshot of every customer's totals plus an append-only ledger of completed deals
+DEAL_DATA_FILE = os.path.join(DATA_DIR, "deal_data.json")  # Legacy JSON snapshot, imported once into DEAL_STATS_FILE
+DEAL_STATS_FILE = os.path.join(DATA_DIR, "deal_stats.bin")
+DEAL_LEDGER_FILE = os.path.join(DATA_DIR, "deal_ledger.jsonl")
+DEAL_LEDGER_COMPACT_EVERY = 1000  # Fold the ledger into the snapshot after this many records
+
+# Snapshot layout, little-endian: header, then count user ids (u64, ascending), count totals in
+# cents (i64) and count deal counts (u32). Every column is a plain array, so the file is mapped
+# and searched where it lies instead of being parsed.
+DEAL_STATS_HEADER = struct.Struct("<4sIQQ")  # Magic, format version, ledger seq, count
+DEAL_STATS_MAGIC = b"DEAL"
+DEAL_STATS_VERSION = 1
+
+def migrate_deal_record(value):
+    if isinstance(value, int):  # Old structure
+        return {"deals_completed": value, "total_spent": 0.0}
+    return value
+
+class DealRecord:
+    __slots__ = ("deals_completed", "total_cents")
+
+    def __init__(self, deals_completed, total_cents):
+        self.deals_completed = deals_completed
+        self.total_cents = total_cents
+
+class DealStats:
+    # Customers in the last snapshot live in three parallel columns sorted by user id and are found
+    # with a binary search. Customers with a deal since then get a DealRecord in a small dict on
+    # top, which compaction folds back into new columns.
+    def __init__(self, ids=None, cents=None, deals=None, buffer=None):
+        self.ids = array("Q") if ids is None else ids
+        self.cents = array("q") if cents is None else cents
+        self.deals = array("I") if deals is None else deals
+        self.buffer = buffer  # The mapped file the columns point into, kept open while they're in use
+        self.recent = {}  # user_id -> DealRecord
+
+    @classmethod
+    def open(cls, path):
+        # Returns the stats and the ledger seq they include. Costs the same however big the file is.
+        with open(path, "rb") as file:
+            if os.name == "nt":
+                buffer = file.read()  # Windows can't replace a file that is mapped, and compaction does
+            else:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(buffer) < DEAL_STATS_HEADER.size:
+            raise ValueError("truncated header")
+        magic, version, seq, count = DEAL_STATS_HEADER.unpack_from(buffer)
+        if magic != DEAL_STATS_MAGIC or version != DEAL_STATS_VERSION:
+            raise ValueError("not a deal stats file")
+        if len(buffer) != DEAL_STATS_HEADER.size + count * 20:
+            raise ValueError("wrong size")
+
+        view = memoryview(buffer)
+        ids_end = DEAL_STATS_HEADER.size + count * 8
+        cents_end = ids_end + count * 8
+        columns = [
+            view[DEAL_STATS_HEADER.size:ids_end].cast("Q"),
+            view[ids_end:cents_end].cast("q"),
+            view[cents_end:].cast("I")
+        ]
+        if sys.byteorder == "big":
+            for i, column in enumerate(columns):
+                columns[i] = array(column.format, column)
+                columns[i].byteswap()
+        return cls(*columns, buffer=buffer), seq
+
+    @classmethod
+    def from_users(cls, users):
+        # From the legacy {"<user id>": {"deals_completed": n, "total_spent": dollars}} layout
+        ids, cents, deals = array("Q"), array("q"), array("I")
+        for user_id, value in sorted((int(user_id), migrate_deal_record(value)) for user_id, value in users.items()):
+            ids.append(user_id)
+            cents.append(round(value["total_spent"] * 100))
+            deals.append(value["deals_completed"])
+        return cls(ids, cents, deals)
+
+    def find(self, user_id):
+        i = bisect.bisect_left(self.ids, user_id)
+        return i if i < len(self.ids) and self.ids[i] == user_id else None
+
+    def get(self, user_id):
+        user_id = int(user_id)
+        record = self.recent.get(user_id)
+        if record is None:
+            i = self.find(user_id)
+            if i is not None:
+                record = DealRecord(self.deals[i], self.cents[i])
+        return record
+
+    def add(self, user_id, cents):
+        user_id = int(user_id)
+        record = self.get(user_id) or DealRecord(0, 0)
+        record.deals_completed += 1
+        record.total_cents += cents
+        self.recent[user_id] = record
+
+    def columns(self):
+        # Copies of the columns with the recent records folded in. Existing customers are updated
+        # in place, new ones are spliced in between slices, so this is a few memory copies plus a
+        # binary search per recent customer.
+        ids, cents, deals = array("Q"), array("q"), array("I")
+        ids.frombytes(memoryview(self.ids).cast("B"))
+        cents.frombytes(memoryview(self.cents).cast("B"))
+        deals.frombytes(memoryview(self.deals).cast("B"))
+
+        new = []
+        for user_id, record in self.recent.items():
+            i = self.find(user_id)
+            if i is None:
+                new.append((user_id, record))
+            else:
+                cents[i] = record.total_cents
+                deals[i] = record.deals_completed
+        if not new:
+            return ids, cents, deals
+
+        new.sort(key=lambda item: item[0])
+        merged = array("Q"), array("q"), array("I")
+        start = 0
+        for user_id, record in new:
+            end = bisect.bisect_left(ids, user_id, start)
+            for column, source in zip(merged, (ids, cents, deals)):
+                column.extend(source[start:end])
+            merged[0].append(user_id)
+            merged[1].append(record.total_cents)
+            merged[2].append(record.deals_completed)
+            start = end
+        for column, source in zip(merged, (ids, cents, deals)):
+            column.extend(source[start:])
+        return merged
+
+def write_deal_stats(path, seq, ids, cents, deals):
+    # Write to a temp file and rename over the target so readers never see a half-written file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(DEAL_STATS_HEADER.pack(DEAL_STATS_MAGIC, DEAL_STATS_VERSION, seq, len(ids)))
+        for column in (ids, cents, deals):
+            if sys.byteorder == "big":
+                column = array(column.typecode, column)
+                column.byteswap()
+            column.tofile(file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+class DealLedger:
+    # Every cluster appends to the same ledger. Writers take a file lock and catch up on records
+    # from other clusters first, so sequence numbers stay unique across processes.
+    def __init__(self, snapshot_path, ledger_path, legacy_path=None):
+        self.snapshot_path = snapshot_path
+        self.ledger_path = ledger_path
+        self.legacy_path = legacy_path
+        self.compacting_path = ledger_path + ".compacting"
+        self.lock_path = ledger_path + ".lock"
+        self.data = DealStats()
+        self.seq = 0  # Sequence number of the last applied record
+        self.offset = 0  # Bytes of the ledger already applied
+        self.snapshot_stamp = None  # Tells us when another cluster has compacted
+        self.pending = 0  # Records in the ledger that are not in the snapshot yet
+        self.compacting = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        with file_lock(self.lock_path), self.lock:
+            self.read()
+        return self.data
+
+    def read(self):
+        self.pending = 0
+        if os.path.exists(self.snapshot_path):
+            try:
+                self.data, snapshot_seq = DealStats.open(self.snapshot_path)
+            except ValueError:
+                # Snapshots are replaced atomically, so this is real damage. Keep it for inspection.
+                os.replace(self.snapshot_path, self.snapshot_path + ".corrupt")
+                print(f"{self.snapshot_path} is corrupt, moved it to {self.snapshot_path}.corrupt")
+                self.data, snapshot_seq = DealStats(), 0
+        elif self.legacy_path and os.path.exists(self.legacy_path):
+            self.data, snapshot_seq = self.import_legacy()
+        else:
+            self.data, snapshot_seq = DealStats(), 0
+
+        self.seq = snapshot_seq
+        leftover = self.replay(self.compacting_path, snapshot_seq) is not None
+        self.offset = self.replay(self.ledger_path, snapshot_seq) or 0
 
-# Load or initialize deal data
-DEAL_DATA_FILE = "deal_data.json"
+        # A previous compaction died before finishing, fold everything in before the leftover goes away
+        if leftover:
+            write_deal_stats(self.snapshot_path, self.seq, *self.data.columns())
+            os.remove(self.compacting_path)
+            self.pending = 0
+        self.snapshot_stamp = self.stamp()
 
-def load_deal_data():
-    if os.path.exists(DEAL_DATA_FILE):
+    def import_legacy(self):
+        # The JSON snapshot is converted once and left in place, the binary one is used from then on
         try:
-            with open(DEAL_DATA_FILE, "r") as file:
-                data = json.load(file)
-                # Migrate old data to new structure
-                for user_id, value in data.items():
-                    if isinstance(value, int):  # Old structure
-                        data[user_id] = {"deals_completed": value, "total_spent": 0.0}
-                return data
+            with open(self.legacy_path, "r") as file:
+                snapshot = json.load(file)
         except json.JSONDecodeError:
-            return {}  # If the file is empty or contains invalid JSON, return an empty dictionary
-    return {}  # If the file doesn't exist, return an empty dictionary
+            print(f"{self.legacy_path} is corrupt, starting from the ledger alone")
+            snapshot = {}
+
+        if isinstance(snapshot.get("seq"), int) and isinstance(snapshot.get("users"), dict):
+            seq = snapshot["seq"]
+            users = snapshot["users"]
+        else:
+            seq = 0
+            users = snapshot  # Legacy whole-file format
+
+        data = DealStats.from_users(users)
+        write_deal_stats(self.snapshot_path, seq, data.ids, data.cents, data.deals)
+        print(f"Imported {len(data.ids)} customers from {self.legacy_path} into {self.snapshot_path}")
+        return DealStats.open(self.snapshot_path)
+
+    def stamp(self):
+        try:
+            stat = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def replay(self, path, after_seq, start=0):
+        # Applies records past after_seq and returns the size of the valid part of the file,
+        # or None if there is no file
+        if not os.path.exists(path):
+            return None
+        valid_size = start
+        with open(path, "rb") as file:
+            file.seek(start)
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break  # Torn write at the tail from a crash, it was never acknowledged
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                valid_size += len(line)
+                if record["seq"] <= after_seq:
+                    continue  # Already folded into the snapshot
+                self.apply(record)
+                self.seq = record["seq"]
+                self.pending += 1
+
+        # Cut off the torn tail so new records don't get glued onto it
+        if valid_size != os.path.getsize(path):
+            os.truncate(path, valid_size)
+        return valid_size
+
+    def refresh(self):
+        # Apply whatever other clusters wrote since we last looked. Caller holds both locks.
+        if self.stamp() != self.snapshot_stamp:
+            self.read()  # Another cluster compacted, start over from its snapshot
+        else:
+            self.offset = self.replay(self.ledger_path, self.seq, self.offset) or 0
+
+    def sync(self):
+        with file_lock(self.lock_path), self.lock:
+            self.refresh()
+
+    def apply(self, record):
+        # Records written before amounts were kept in cents carry "amount" in dollars
+        cents = record["cents"] if "cents" in record else round(record["amount"] * 100)
+        self.data.add(record["user_id"], cents)
+
+    def record_deal(self, user_id, cents):
+        # Appends one line per deal, so the cost does not depend on how many customers there are
+        with file_lock(self.lock_path), self.lock:
+            self.refresh()
+            self.seq += 1
+            record = {"seq": self.seq, "user_id": user_id, "cents": cents}
+            line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+            # Opened per write so no process keeps a handle that would stop compaction renaming the file
+            with open(self.ledger_path, "ab") as ledger:
+                ledger.write(line)
+                ledger.flush()
+                os.fsync(ledger.fileno())
+            self.offset += len(line)
+            self.apply(record)
+            self.pending += 1
+            start_compaction = self.pending >= DEAL_LEDGER_COMPACT_EVERY and not self.compacting
+            if start_compaction:
+                self.compacting = True
+
+        if start_compaction:
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def compact(self):
+        # Runs on its own thread. The file lock is held until the snapshot is written so other
+        # clusters never see the ledger swapped out before the snapshot that replaces it.
+        try:
+            with file_lock(self.lock_path):
+                with self.lock:
+                    self.refresh()
+                    columns = self.data.columns()
+                    seq = self.seq
+                    if os.path.exists(self.ledger_path):
+                        os.replace(self.ledger_path, self.compacting_path)
+                    self.offset = 0
+                    self.pending = 0
+
+                write_deal_stats(self.snapshot_path, seq, *columns)
+                if os.path.exists(self.compacting_path):
+                    os.remove(self.compacting_path)
+                with self.lock:
+                    self.read()  # Map the new snapshot, so the recent records it took in are dropped
+        finally:
+            with self.lock:
+                self.compacting = False
+
+deal_ledger = DealLedger(DEAL_STATS_FILE, DEAL_LEDGER_FILE, DEAL_DATA_FILE)
+deal_ledger.load()  # A customer's totals: deal_ledger.data.get(user_id)
+
+# Tickets, carts and stock live in SQLite so they survive restarts
+STORE_FILE = os.path.join(DATA_DIR, "tickets.db")
+
+# Ticket status values
+TICKET_OPEN = "open"
+TICKET_AWAITING_PAYMENT = "awaiting_payment"
+TICKET_PAID = "paid"
+TICKET_COMPLETED = "completed"
+TICKET_REVIEWED = "reviewed"
+CART_EDITABLE_STATUSES = (TICKET_OPEN, TICKET_AWAITING_PAYMENT)  # Once a ticket is paid its cart is final
+
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    channel_id INTEGER PRIMARY KEY,
+    guild_id INTEGER,
+    buyer_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    payment_method TEXT,
+    total_cents INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tickets_buyer_id ON tickets (buyer_id);
+CREATE INDEX IF NOT EXISTS tickets_guild_id ON tickets (guild_id, status);
+CREATE INDEX IF NOT EXISTS tickets_status ON tickets (status, updated_at);
+
+CREATE TABLE IF NOT EXISTS cart_items (
+    channel_id INTEGER NOT NULL,
+    item TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    unit_price_cents INTEGER NOT NULL,
+    subtotal_cents INTEGER NOT NULL,
+    PRIMARY KEY (channel_id, item)
+);
+
+CREATE TABLE IF NOT EXISTS guild_config (
+    guild_id INTEGER PRIMARY KEY,
+    settings TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS bot_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS review_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER,
+    channel_id INTEGER NOT NULL,
+    embed TEXT NOT NULL,
+    chars INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS review_outbox_channel ON review_outbox (channel_id, id);
+
+-- Analytics. One compact row per completed deal and per review, plus running totals that are
+-- updated in the same transaction. dimension is 'summary', 'payment_method', 'item', 'stars' or 'buyer'.
+CREATE TABLE IF NOT EXISTS sales (
+    channel_id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    buyer_id INTEGER NOT NULL,
+    payment_method TEXT NOT NULL,
+    total_cents INTEGER NOT NULL,
+    items TEXT NOT NULL,
+    completed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sales_guild ON sales (guild_id, completed_at);
+
+CREATE TABLE IF NOT EXISTS reviews (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel_id INTEGER NOT NULL,
+    guild_id INTEGER NOT NULL,
+    buyer_id INTEGER NOT NULL,
+    stars INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reviews_guild ON reviews (guild_id, created_at);
+
+CREATE TABLE IF NOT EXISTS sales_totals (
+    guild_id INTEGER NOT NULL,
+    dimension TEXT NOT NULL,
+    key TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    cents INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, dimension, key)
+);
+CREATE INDEX IF NOT EXISTS sales_totals_ranked ON sales_totals (guild_id, dimension, cents);
+
+-- Index of archived ticket transcripts, the transcripts themselves are files under TRANSCRIPT_DIR
+CREATE TABLE IF NOT EXISTS transcripts (
+    channel_id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    buyer_id INTEGER,
+    path TEXT NOT NULL,
+    messages INTEGER NOT NULL,
+    opened_at REAL NOT NULL,
+    closed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transcripts_buyer ON transcripts (guild_id, buyer_id, closed_at);
+CREATE INDEX IF NOT EXISTS transcripts_closed ON transcripts (guild_id, closed_at);
+
+-- Per-ticket deposit addresses for on-chain payments, and the payments seen at each one
+CREATE TABLE IF NOT EXISTS deposits (
+    address TEXT PRIMARY KEY,
+    coin TEXT NOT NULL,
+    channel_id INTEGER NOT NULL,
+    guild_id INTEGER NOT NULL,
+    buyer_id INTEGER,
+    expected_cents INTEGER NOT NULL,
+    received_cents INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    paid_at REAL,
+    closed_at REAL  -- The ticket closed or switched coin. Still watched for a while, a payment may be on its way.
+);
+CREATE INDEX IF NOT EXISTS deposits_channel ON deposits (channel_id, coin);
+CREATE INDEX IF NOT EXISTS deposits_pending ON deposits (guild_id) WHERE paid_at IS NULL;
+
+CREATE TABLE IF NOT EXISTS deposit_payments (
+    txid TEXT NOT NULL,
+    address TEXT NOT NULL,
+    value_cents INTEGER NOT NULL,
+    PRIMARY KEY (txid, address)
+);
+
+-- Paid tickets waiting for an admin to complete the deal
+CREATE TABLE IF NOT EXISTS work_queue (
+    channel_id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    buyer_id INTEGER NOT NULL,
+    total_cents INTEGER NOT NULL,
+    paid_at REAL NOT NULL,
+    claimed_by INTEGER,
+    claimed_at REAL
+);
+CREATE INDEX IF NOT EXISTS work_queue_guild ON work_queue (guild_id, paid_at);
+
+CREATE TABLE IF NOT EXISTS cluster_locks (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+
+-- Each guild sells its own catalog. An older single "stock" table may still exist, see load_stock.
+CREATE TABLE IF NOT EXISTS guild_stock (
+    guild_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    price_cents INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    category TEXT NOT NULL DEFAULT 'General',
+    PRIMARY KEY (guild_id, name)
+);
+CREATE INDEX IF NOT EXISTS guild_stock_category ON guild_stock (guild_id, category, name);
+"""
+
+CartLine = namedtuple("CartLine", ["quantity", "unit_price_cents", "subtotal_cents"])
+
+class Cart:
+    # Read-only view of a ticket's cart with the subtotals and total already worked out
+    def __init__(self, lines, total_cents):
+        self.lines = lines
+        self.total_cents = total_cents
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def summary(self):
+        return "\n".join(f"{item} x{line.quantity}" for item, line in self.lines.items())
+
+class TicketStore:
+    # Every query runs on a small thread pool (one connection per thread) so the event loop never
+    # waits on disk. WAL mode lets readers keep going while another thread writes.
+    def __init__(self, path, workers=4):
+        self.path = path
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ticket-store")
+        with self.connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(STORE_SCHEMA)
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _execute(self, query, params=()):
+        with self.connection() as conn:
+            return conn.execute(query, params).rowcount
+
+    def _fetch_one(self, query, params=()):
+        row = self.connection().execute(query, params).fetchone()
+        return dict(row) if row else None
+
+    def _fetch_all(self, query, params=()):
+        return [dict(row) for row in self.connection().execute(query, params)]
+
+    @contextlib.contextmanager
+    def transaction(self, write=False):
+        # sqlite3 only opens a transaction at the first write, so reads before it see whatever another
+        # thread committed in between. BEGIN IMMEDIATE also takes the write lock up front, which keeps
+        # a read-modify-write from interleaving with another one.
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        with conn:
+            yield conn
+
+    # Tickets
+    async def create_ticket(self, channel_id, guild_id, buyer_id):
+        now = time.time()
+        await self.run(
+            self._execute,
+            "INSERT OR REPLACE INTO tickets (channel_id, guild_id, buyer_id, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (channel_id, guild_id, buyer_id, TICKET_OPEN, now, now)
+        )
+
+    async def get_ticket(self, channel_id):
+        return await self.run(self._fetch_one, "SELECT * FROM tickets WHERE channel_id = ?", (channel_id,))
+
+    async def open_ticket_for_buyer(self, guild_id, buyer_id):
+        return await self.run(
+            self._fetch_one,
+            "SELECT * FROM tickets WHERE buyer_id = ? AND guild_id = ? AND status IN (?, ?, ?) ORDER BY created_at DESC LIMIT 1",
+            (buyer_id, guild_id, TICKET_OPEN, TICKET_AWAITING_PAYMENT, TICKET_PAID)
+        )
+
+    async def tickets_for_guild(self, guild_id, statuses=None, updated_before=None):
+        query = "SELECT * FROM tickets WHERE guild_id = ?"
+        params = [guild_id]
+        if statuses:
+            query += f" AND status IN ({', '.join('?' * len(statuses))})"
+            params.extend(statuses)
+        if updated_before is not None:
+            query += " AND updated_at < ?"
+            params.append(updated_before)
+        return await self.run(self._fetch_all, query, params)
+
+    async def ticket_totals(self):
+        return await self.run(
+            self._fetch_all, "SELECT status, COUNT(*) AS tickets, SUM(total_cents) AS cents FROM tickets GROUP BY status"
+        )
+
+    async def cart_totals(self):
+        return await self.run(
+            self._fetch_all,
+            "SELECT tickets.status, COUNT(*) AS lines, SUM(cart_items.quantity) AS quantity "
+            "FROM cart_items JOIN tickets USING (channel_id) GROUP BY tickets.status"
+        )
+
+    async def tickets_with_status(self, status):
+        return await self.run(
+            self._fetch_all, "SELECT * FROM tickets WHERE status = ? ORDER BY updated_at", (status,)
+        )
+
+    async def transition(self, channel_id, from_status, to_status, payment_method=None):
+        # Compare-and-set, so two clicks on the same button can't both win. from_status may be a
+        # tuple of the statuses the ticket is allowed to move from.
+        from_statuses = from_status if isinstance(from_status, tuple) else (from_status,)
+        query = "UPDATE tickets SET status = ?, updated_at = ?"
+        params = [to_status, time.time()]
+        if payment_method is not None:
+            query += ", payment_method = ?"
+            params.append(payment_method)
+        query += f" WHERE channel_id = ? AND status IN ({', '.join('?' * len(from_statuses))})"
+        params.append(channel_id)
+        params.extend(from_statuses)
+        return await self.run(self._execute, query, params) > 0
+
+    def _delete_ticket(self, channel_id):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM cart_items WHERE channel_id = ?", (channel_id,))
+            conn.execute(
+                "UPDATE deposits SET closed_at = ? WHERE channel_id = ? AND paid_at IS NULL AND closed_at IS NULL", (time.time(), channel_id)
+            )
+            conn.execute("DELETE FROM work_queue WHERE channel_id = ?", (channel_id,))
+            conn.execute("DELETE FROM tickets WHERE channel_id = ?", (channel_id,))
+
+    async def delete_ticket(self, channel_id):
+        await self.run(self._delete_ticket, channel_id)
+
+    # Carts. Line subtotals and the ticket's total_cents are updated in the same transaction as
+    # the line itself, so reading a cart never has to add anything up.
+    def _get_cart(self, channel_id):
+        with self.transaction() as conn:  # The lines and the total from the same snapshot
+            rows = conn.execute(
+                "SELECT item, quantity, unit_price_cents, subtotal_cents FROM cart_items WHERE channel_id = ? ORDER BY rowid",
+                (channel_id,)
+            ).fetchall()
+            total = conn.execute("SELECT total_cents FROM tickets WHERE channel_id = ?", (channel_id,)).fetchone()
+        lines = {row["item"]: CartLine(row["quantity"], row["unit_price_cents"], row["subtotal_cents"]) for row in rows}
+        return Cart(lines, total["total_cents"] if total else sum(line.subtotal_cents for line in lines.values()))
+
+    async def get_cart(self, channel_id):
+        return await self.run(self._get_cart, channel_id)
+
+    def _set_cart_quantity(self, channel_id, item, quantity, unit_price_cents):
+        with self.transaction(write=True) as conn:
+            line = conn.execute(
+                "SELECT unit_price_cents, subtotal_cents FROM cart_items WHERE channel_id = ? AND item = ?",
+                (channel_id, item)
+            ).fetchone()
+            if line:
+                # The price was frozen when the item first went into the cart
+                unit_price_cents = line["unit_price_cents"]
+                old_subtotal = line["subtotal_cents"]
+            else:
+                old_subtotal = 0
+            subtotal = quantity * unit_price_cents
+            conn.execute(
+                "INSERT INTO cart_items (channel_id, item, quantity, unit_price_cents, subtotal_cents) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (channel_id, item) DO UPDATE SET quantity = excluded.quantity, subtotal_cents = excluded.subtotal_cents",
+                (channel_id, item, quantity, unit_price_cents, subtotal)
+            )
+            conn.execute(
+                "UPDATE tickets SET total_cents = total_cents + ?, updated_at = ? WHERE channel_id = ?",
+                (subtotal - old_subtotal, time.time(), channel_id)
+            )
+
+    async def set_cart_quantity(self, channel_id, item, quantity, unit_price_cents):
+        await self.run(self._set_cart_quantity, channel_id, item, quantity, unit_price_cents)
+
+    def _remove_cart_item(self, channel_id, item):
+        with self.transaction(write=True) as conn:
+            line = conn.execute(
+                "SELECT subtotal_cents FROM cart_items WHERE channel_id = ? AND item = ?", (channel_id, item)
+            ).fetchone()
+            if not line:
+                return False
+            conn.execute("DELETE FROM cart_items WHERE channel_id = ? AND item = ?", (channel_id, item))
+            conn.execute(
+                "UPDATE tickets SET total_cents = total_cents - ?, updated_at = ? WHERE channel_id = ?",
+                (line["subtotal_cents"], time.time(), channel_id)
+            )
+            return True
+
+    async def remove_cart_item(self, channel_id, item):
+        return await self.run(self._remove_cart_item, channel_id, item)
+
+    # Small key/value settings the bot keeps between runs
+    async def get_state(self, key):
+        row = await self.run(self._fetch_one, "SELECT value FROM bot_state WHERE key = ?", (key,))
+        return row["value"] if row else None
+
+    async def set_state(self, key, value):
+        await self.run(self._execute, "INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)", (key, value))
+
+    # Reviews waiting to be posted, oldest first
+    async def enqueue_review(self, guild_id, channel_id, embed, chars):
+        await self.run(
+            self._execute,
+            "INSERT INTO review_outbox (guild_id, channel_id, embed, chars, created_at) VALUES (?, ?, ?, ?, ?)",
+            (guild_id, channel_id, embed, chars, time.time())
+        )
+
+    async def review_channels(self):
+        return await self.run(self._fetch_all, "SELECT DISTINCT guild_id, channel_id FROM review_outbox")
+
+    async def pending_reviews(self, channel_id):
+        return await self.run(
+            self._fetch_all, "SELECT id, embed, chars FROM review_outbox WHERE channel_id = ? ORDER BY id", (channel_id,)
+        )
+
+    async def delete_reviews(self, review_ids):
+        await self.run(
+            self._execute, f"DELETE FROM review_outbox WHERE id IN ({', '.join('?' * len(review_ids))})", review_ids
+        )
+
+    # Analytics. Each sale or review updates the totals as it's written, so reports never scan history.
+    def _add_to_total(self, conn, guild_id, dimension, key, count, cents=0):
+        conn.execute(
+            "INSERT INTO sales_totals (guild_id, dimension, key, count, cents) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (guild_id, dimension, key) DO UPDATE SET count = count + excluded.count, cents = cents + excluded.cents",
+            (guild_id, dimension, key, count, cents)
+        )
+        return conn.execute(
+            "SELECT count FROM sales_totals WHERE guild_id = ? AND dimension = ? AND key = ?", (guild_id, dimension, key)
+        ).fetchone()["count"]
+
+    def _record_sale(self, ticket, cart):
+        guild_id = ticket["guild_id"] or 0
+        payment_method = ticket["payment_method"] or "Unknown"
+        items = [[item, line.quantity, line.subtotal_cents] for item, line in cart.lines.items()]
+        with self.connection() as conn:
+            if not conn.execute(
+                "INSERT OR IGNORE INTO sales (channel_id, guild_id, buyer_id, payment_method, total_cents, items, completed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (ticket["channel_id"], guild_id, ticket["buyer_id"], payment_method, cart.total_cents,
+                 json.dumps(items, separators=(",", ":")), time.time())
+            ).rowcount:
+                return  # Already counted
+            add = partial(self._add_to_total, conn, guild_id)
+            add("summary", "deals", 1, cart.total_cents)
+            add("payment_method", payment_method, 1, cart.total_cents)
+            for item, quantity, subtotal_cents in items:
+                add("item", item, quantity, subtotal_cents)
+            buyer_deals = add("buyer", str(ticket["buyer_id"]), 1, cart.total_cents)
+            if buyer_deals == 1:
+                add("summary", "buyers", 1)
+            elif buyer_deals == 2:
+                add("summary", "repeat_buyers", 1)
+
+    async def record_sale(self, ticket, cart):
+        await self.run(self._record_sale, ticket, cart)
+
+    def _record_review(self, channel_id, guild_id, buyer_id, stars):
+        guild_id = guild_id or 0
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT INTO reviews (channel_id, guild_id, buyer_id, stars, created_at) VALUES (?, ?, ?, ?, ?)",
+                (channel_id, guild_id, buyer_id, stars, time.time())
+            )
+            self._add_to_total(conn, guild_id, "summary", "reviews", 1)
+            self._add_to_total(conn, guild_id, "summary", "stars", stars)
+            self._add_to_total(conn, guild_id, "stars", str(stars), 1)
+
+    async def record_review(self, channel_id, guild_id, buyer_id, stars):
+        await self.run(self._record_review, channel_id, guild_id, buyer_id, stars)
+
+    def _sales_report(self, guild_id, top_items):
+        conn = self.connection()
+        totals = {}
+        for dimension in ("summary", "payment_method", "stars"):
+            rows = conn.execute(
+                "SELECT key, count, cents FROM sales_totals WHERE guild_id = ? AND dimension = ? ORDER BY cents DESC, key",
+                (guild_id, dimension)
+            )
+            totals[dimension] = {row["key"]: (row["count"], row["cents"]) for row in rows}
+        rows = conn.execute(
+            "SELECT key, count, cents FROM sales_totals WHERE guild_id = ? AND dimension = 'item' ORDER BY cents DESC LIMIT ?",
+            (guild_id, top_items)
+        )
+        totals["item"] = {row["key"]: (row["count"], row["cents"]) for row in rows}
+        return totals
+
+    async def sales_report(self, guild_id, top_items=5):
+        return await self.run(self._sales_report, guild_id, top_items)
+
+    def _export_csv(self, table, guild_id):
+        # Streamed from the cursor into a temporary file, so a big export never sits in memory.
+        # The caller closes the file, which deletes it.
+        columns = {
+            "sales": ["channel_id", "buyer_id", "payment_method", "total_cents", "items", "completed_at"],
+            "reviews": ["channel_id", "buyer_id", "stars", "created_at"]
+        }[table]
+        cursor = self.connection().execute(
+            f"SELECT {', '.join(columns)} FROM {table} WHERE guild_id = ? ORDER BY {columns[-1]}", (guild_id,)
+        )
+        file = tempfile.TemporaryFile()
+        output = io.TextIOWrapper(file, encoding="utf-8", newline="")
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        writer.writerows(cursor)
+        output.flush()
+        output.detach()  # Hand back the binary file without closing it
+        file.seek(0)
+        return file
+
+    async def export_csv(self, table, guild_id):
+        return await self.run(self._export_csv, table, guild_id)
+
+    # Deposits. Addresses come from the backend's derive_address, numbered per coin.
+    def _create_deposit(self, coin, channel_id, guild_id, buyer_id, expected_cents, derive_address):
+        with self.transaction(write=True) as conn:
+            deposit = conn.execute(
+                "SELECT address FROM deposits WHERE channel_id = ? AND coin = ? AND paid_at IS NULL AND closed_at IS NULL", (channel_id, coin)
+            ).fetchone()
+            if deposit:
+                return deposit["address"]  # Chose the same coin again
+
+            # Switching coin retires the other address, which is still watched in case a payment is already on its way
+            now = time.time()
+            conn.execute(
+                "UPDATE deposits SET closed_at = ? WHERE channel_id = ? AND paid_at IS NULL AND closed_at IS NULL", (now, channel_id)
+            )
+            address = derive_address(coin, self._increment(conn, f"deposit_index:{coin}"))
+            conn.execute(
+                "INSERT INTO deposits (address, coin, channel_id, guild_id, buyer_id, expected_cents, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (address, coin, channel_id, guild_id, buyer_id, expected_cents, now)
+            )
+            return address
+
+    async def create_deposit(self, coin, channel_id, guild_id, buyer_id, expected_cents, derive_address):
+        return await self.run(self._create_deposit, coin, channel_id, guild_id, buyer_id, expected_cents, derive_address)
+
+    async def open_deposit(self, channel_id):
+        return await self.run(
+            self._fetch_one, "SELECT * FROM deposits WHERE channel_id = ? AND paid_at IS NULL AND closed_at IS NULL", (channel_id,)
+        )
+
+    async def pending_deposits(self, guild_ids, closed_after):
+        # Unpaid deposits, including closed ones that closed after closed_after
+        if not guild_ids:
+            return []
+        return await self.run(
+            self._fetch_all,
+            "SELECT address, coin, channel_id FROM deposits WHERE paid_at IS NULL AND (closed_at IS NULL OR closed_at > ?) "
+            f"AND guild_id IN ({', '.join('?' * len(guild_ids))})",
+            [closed_after, *guild_ids]
+        )
+
+    def _credit_deposit(self, txid, address, value_cents):
+        # Returns the deposit when this payment is the one that covers it, None otherwise. It has to
+        # cover the ticket's current total as well as what was asked for when the address was issued.
+        with self.transaction(write=True) as conn:
+            if not conn.execute(
+                "INSERT OR IGNORE INTO deposit_payments (txid, address, value_cents) VALUES (?, ?, ?)", (txid, address, value_cents)
+            ).rowcount:
+                return None  # Seen before
+            conn.execute("UPDATE deposits SET received_cents = received_cents + ? WHERE address = ?", (value_cents, address))
+            deposit = conn.execute(
+                "SELECT deposits.*, tickets.total_cents AS ticket_cents FROM deposits "
+                "LEFT JOIN tickets ON tickets.channel_id = deposits.channel_id WHERE address = ?",
+                (address,)
+            ).fetchone()
+            if not deposit or deposit["paid_at"] is not None:
+                return None
+            if deposit["received_cents"] < max(deposit["expected_cents"], deposit["ticket_cents"] or 0):
+                return None
+            conn.execute("UPDATE deposits SET paid_at = ? WHERE address = ?", (time.time(), address))
+            return dict(deposit)
+
+    async def credit_deposit(self, txid, address, value_cents):
+        return await self.run(self._credit_deposit, txid, address, value_cents)
+
+    # Admin work queue
+    def _enqueue_work(self, channel_id, guild_id, buyer_id, total_cents):
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO work_queue (channel_id, guild_id, buyer_id, total_cents, paid_at) VALUES (?, ?, ?, ?, ?)",
+                (channel_id, guild_id, buyer_id, total_cents, time.time())
+            )
+            return dict(conn.execute("SELECT * FROM work_queue WHERE channel_id = ?", (channel_id,)).fetchone())
+
+    async def enqueue_work(self, channel_id, guild_id, buyer_id, total_cents):
+        return await self.run(self._enqueue_work, channel_id, guild_id, buyer_id, total_cents)
+
+    def _work_queue(self, guild_id):
+        with self.connection() as conn:
+            # Picks up tickets paid before the queue existed, their last update stands in for the payment time
+            conn.execute(
+                "INSERT OR IGNORE INTO work_queue (channel_id, guild_id, buyer_id, total_cents, paid_at) "
+                "SELECT channel_id, guild_id, buyer_id, total_cents, updated_at FROM tickets WHERE guild_id = ? AND status = ?",
+                (guild_id, TICKET_PAID)
+            )
+            return [dict(row) for row in conn.execute("SELECT * FROM work_queue WHERE guild_id = ? ORDER BY paid_at", (guild_id,))]
+
+    async def work_queue(self, guild_id):
+        return await self.run(self._work_queue, guild_id)
+
+    async def claim_work(self, channel_id, admin_id):
+        # Compare-and-set, so two admins pressing Claim together can't both get the deal
+        return await self.run(
+            self._execute,
+            "UPDATE work_queue SET claimed_by = ?, claimed_at = ? WHERE channel_id = ? AND claimed_by IS NULL",
+            (admin_id, time.time(), channel_id)
+        ) > 0
+
+    async def release_work(self, channel_id, admin_id):
+        return await self.run(
+            self._execute,
+            "UPDATE work_queue SET claimed_by = NULL, claimed_at = NULL WHERE channel_id = ? AND claimed_by = ?",
+            (channel_id, admin_id)
+        ) > 0
+
+    async def complete_work(self, channel_id):
+        await self.run(self._execute, "DELETE FROM work_queue WHERE channel_id = ?", (channel_id,))
+
+    # Transcripts
+    async def add_transcript(self, channel_id, guild_id, buyer_id, path, messages, opened_at, closed_at):
+        await self.run(
+            self._execute,
+            "INSERT OR REPLACE INTO transcripts (channel_id, guild_id, buyer_id, path, messages, opened_at, closed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (channel_id, guild_id, buyer_id, path, messages, opened_at, closed_at)
+        )
+
+    async def find_transcripts(self, guild_id, buyer_id=None, closed_after=None, limit=10):
+        query = "SELECT * FROM transcripts WHERE guild_id = ?"
+        params = [guild_id]
+        if buyer_id is not None:
+            query += " AND buyer_id = ?"
+            params.append(buyer_id)
+        if closed_after is not None:
+            query += " AND closed_at >= ?"
+            params.append(closed_after)
+        query += " ORDER BY closed_at DESC LIMIT ?"
+        params.append(limit)
+        return await self.run(self._fetch_all, query, params)
+
+    def _increment(self, conn, key):
+        conn.execute(
+            "INSERT INTO bot_state (key, value) VALUES (?, '1') "
+            "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+            (key,)
+        )
+        return int(conn.execute("SELECT value FROM bot_state WHERE key = ?", (key,)).fetchone()["value"])
+
+    # Generation counters, bumped in the same transaction as a change to data that clusters cache
+    def _bump_generation(self, conn, name):
+        self._increment(conn, f"generation:{name}")
+
+    async def generations(self):
+        rows = await self.run(
+            self._fetch_all, "SELECT key, value FROM bot_state WHERE key >= 'generation:' AND key < 'generation;'"
+        )
+        return {row["key"].partition(":")[2]: row["value"] for row in rows}
+
+    # Leases shared by every cluster. A lease runs out on its own if the process holding it dies.
+    def _acquire_lock(self, name, owner, ttl):
+        now = time.time()
+        return self._execute(
+            "INSERT INTO cluster_locks (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE cluster_locks.expires_at < ? OR cluster_locks.owner = excluded.owner",
+            (name, owner, now + ttl, now)
+        ) > 0
+
+    async def acquire_lock(self, name, owner, ttl):
+        return await self.run(self._acquire_lock, name, owner, ttl)
+
+    async def release_lock(self, name, owner):
+        await self.run(self._execute, "DELETE FROM cluster_locks WHERE name = ? AND owner = ?", (name, owner))
+
+    # Per-guild settings. Only the values a guild overrides are stored.
+    async def get_guild_config(self, guild_id):
+        row = await self.run(self._fetch_one, "SELECT settings FROM guild_config WHERE guild_id = ?", (guild_id,))
+        return json.loads(row["settings"]) if row else {}
+
+    def _set_guild_config(self, guild_id, settings):
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO guild_config (guild_id, settings) VALUES (?, ?)",
+                (guild_id, json.dumps(settings))
+            )
+            self._bump_generation(conn, "guild_config")
+
+    async def set_guild_config(self, guild_id, settings):
+        await self.run(self._set_guild_config, guild_id, settings)
+
+    def load_guild_prefixes(self):
+        # Read synchronously at startup, the prefix router needs these before the first message
+        rows = self._fetch_all(
+            "SELECT guild_id, json_extract(settings, '$.prefix') AS prefix FROM guild_config WHERE prefix IS NOT NULL"
+        )
+        return {row["guild_id"]: row["prefix"] for row in rows}
+
+    # Stock, one catalog per guild. Read the first time a guild needs it, the bot keeps a copy in
+    # memory for building menus.
+    def _load_stock(self, guild_id, default_stock, legacy):
+        with self.connection() as conn:
+            # A guild's catalog is seeded once, so one that removed every item stays empty. The guild
+            # passed with legacy=True takes over the catalog from before stock was kept per guild.
+            if conn.execute("INSERT OR IGNORE INTO bot_state (key, value) VALUES (?, '1')", (f"stock_seeded:{guild_id}",)).rowcount:
+                if legacy and conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stock'").fetchone():
+                    conn.execute(
+                        "INSERT OR IGNORE INTO guild_stock (guild_id, name, price_cents, description, category) "
+                        "SELECT ?, name, price_cents, description, category FROM stock",
+                        (guild_id,)
+                    )
+                else:
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO guild_stock (guild_id, name, price_cents, description, category) VALUES (?, ?, ?, ?, ?)",
+                        [(guild_id, name, item["price_cents"], item["description"], item["category"]) for name, item in default_stock.items()]
+                    )
+            rows = conn.execute(
+                "SELECT name, price_cents, description, category FROM guild_stock WHERE guild_id = ? ORDER BY name", (guild_id,)
+            ).fetchall()
+        return {
+            row["name"]: {"price_cents": row["price_cents"], "description": row["description"], "category": row["category"]}
+            for row in rows
+        }
+
+    async def load_stock(self, guild_id, default_stock, legacy=False):
+        return await self.run(self._load_stock, guild_id, default_stock, legacy)
 
-def save_deal_data(data):
-    with open(DEAL_DATA_FILE, "w") as file:
-        json.dump(data, file, indent=4)
+    def _put_stock_item(self, guild_id, name, price_cents, description, category):
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO guild_stock (guild_id, name, price_cents, description, category) VALUES (?, ?, ?, ?, ?)",
+                (guild_id, name, price_cents, description, category)
+            )
+            self._bump_generation(conn, "stock")
+
+    async def put_stock_item(self, guild_id, name, price_cents, description, category):
+        await self.run(self._put_stock_item, guild_id, name, price_cents, description, category)
+
+    def _delete_stock_item(self, guild_id, name):
+        with self.connection() as conn:
+            if conn.execute("DELETE FROM guild_stock WHERE guild_id = ? AND name = ?", (guild_id, name)).rowcount == 0:
+                return False
+            self._bump_generation(conn, "stock")
+            return True
+
+    async def delete_stock_item(self, guild_id, name):
+        return await self.run(self._delete_stock_item, guild_id, name)
+
+ticket_store = TicketStore(STORE_FILE)
+
+def to_cents(price):
+    return int(round(price * 100))
+
+def format_cents(cents):
+    return f"${cents // 100}.{cents % 100:02d}"
+
+class TokenBucket:
+    # Allows `rate` operations per second with bursts of up to `capacity`
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def take(self):
+        while not self.try_take():
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# Client-side pacing per REST route, so bulk jobs stay under Discord's limits instead of bouncing off 429s
+rest_buckets = {
+    "channel_delete": TokenBucket(rate=5, capacity=5)
+}
+
+# Metrics. Recording one is a dict lookup and a few additions, cheap enough to leave on in
+# production. Gauges are only worked out when someone reads them.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Seconds
+METRICS_HOST = "127.0.0.1"  # Local only
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))  # Each cluster adds its CLUSTER_ID, 0 turns the endpoint off
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one counts everything above the top bucket
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket the q-th observation falls in
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return None  # Above the top bucket
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+class Metrics:
+    # Series are keyed by (name, labels), where labels is a tuple of (key, value) pairs
+    def __init__(self):
+        self.descriptions = {}  # name -> (type, help text)
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}  # name -> async callback returning {labels: value}
+
+    def describe(self, name, kind, description):
+        self.descriptions[name] = (kind, description)
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[(name, labels)] = Histogram()
+        histogram.observe(value)
+
+    def gauge(self, name, description):
+        def decorator(func):
+            self.describe(name, "gauge", description)
+            self.gauges[name] = func
+            return func
+        return decorator
+
+    async def collect(self):
+        series = {}
+        for (name, labels), value in list(self.counters.items()) + list(self.histograms.items()):
+            series.setdefault(name, []).append((labels, value))
+        for name, func in self.gauges.items():
+            try:
+                series[name] = list((await func()).items())
+            except Exception as e:
+                print(f"Failed to read gauge {name}: {e}")
+        return series
+
+    async def render_prometheus(self):
+        lines = []
+        for name, samples in sorted((await self.collect()).items()):
+            kind, description = self.descriptions.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if isinstance(value, Histogram):
+                    cumulative = 0
+                    for bound, count in zip(value.buckets + ("+Inf",), value.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {value.total}")
+                    lines.append(f"{name}_count{format_labels(labels)} {value.count}")
+                else:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    async def to_dict(self):
+        result = {}
+        for name, samples in (await self.collect()).items():
+            result[name] = []
+            for labels, value in samples:
+                if isinstance(value, Histogram):
+                    value = {
+                        "count": value.count,
+                        "sum": value.total,
+                        "p50": value.quantile(0.5),
+                        "p95": value.quantile(0.95),
+                        "p99": value.quantile(0.99)
+                    }
+                result[name].append({"labels": dict(labels), "value": value})
+        return result
+
+metrics = Metrics()
+metrics.describe("handler_seconds", "histogram", "Time spent handling a click, command, modal or prefix command")
+metrics.describe("handler_errors_total", "counter", "Handlers that raised")
+metrics.describe("discord_rest_seconds", "histogram", "Discord REST request latency by route")
+metrics.describe("discord_rest_errors_total", "counter", "Discord REST requests that failed, by route and status")
+metrics.describe("discord_rate_limits_total", "counter", "Rate limits reported by Discord")
+metrics.describe("anti_spam_rejections_total", "counter", "Interactions and tickets turned away by our own limits")
+
+def record_handler(kind, name, elapsed, failed):
+    labels = (("kind", kind), ("handler", name))
+    metrics.observe("handler_seconds", elapsed, labels)
+    if failed:
+        metrics.inc("handler_errors_total", labels)
+
+def instrumented(kind, name):
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = await func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                record_handler(kind, name, time.perf_counter() - started, failed)
+        return wrapper
+    return decorator
+
+class RateLimitCounter(logging.Handler):
+    # discord.py waits out 429s itself and only logs them, so the log lines are what we count
+    def emit(self, record):
+        if "rate limit" in record.getMessage().lower():
+            metrics.inc("discord_rate_limits_total")
+
+logging.getLogger("discord.http").addHandler(RateLimitCounter(logging.WARNING))
+
+def instrument_http(http):
+    # Times every REST call. Routes are labelled by their path template, so the label set stays small.
+    request = http.request
+
+    async def timed_request(route, **kwargs):
+        labels = (("route", f"{route.method} {route.path}"),)
+        started = time.perf_counter()
+        try:
+            return await request(route, **kwargs)
+        except discord.HTTPException as e:
+            metrics.inc("discord_rest_errors_total", labels + (("status", e.status),))
+            raise
+        finally:
+            metrics.observe("discord_rest_seconds", time.perf_counter() - started, labels)
+
+    http.request = timed_request
+
+class RateLimiter:
+    # One TokenBucket per key, a user or guild id. A bucket left alone long enough to refill
+    # completely is no different from a new one, so those are dropped to keep memory bounded.
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.idle_after = capacity / rate
+        self.buckets = OrderedDict()  # key -> bucket, least recently used first
+
+    def bucket(self, key):
+        self.expire()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.capacity)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def expire(self):
+        cutoff = time.monotonic() - self.idle_after
+        while self.buckets:
+            key, bucket = next(iter(self.buckets.items()))
+            if bucket.updated > cutoff:
+                break
+            del self.buckets[key]
+
+# Anti-spam, checked before any work is done for a user
+interaction_limits = {
+    "user": RateLimiter(rate=1, capacity=5),  # Clicks and commands per user
+    "guild": RateLimiter(rate=20, capacity=40)
+}
+ticket_limits = {
+    "user": RateLimiter(rate=1 / 60, capacity=2),  # New tickets per user
+    "guild": RateLimiter(rate=0.5, capacity=10)  # Keeps one guild from eating the channel limit and REST budget
+}
 
-deal_data = load_deal_data()
+def rate_limited(limits, user_id, guild_id):
+    # Takes a token from the user's bucket and the guild's, True if either was empty
+    user_bucket = limits["user"].bucket(user_id)
+    if not user_bucket.try_take():
+        return True
+    if guild_id is not None and not limits["guild"].bucket(guild_id).try_take():
+        user_bucket.tokens += 1  # Give it back, the user didn't get anything for it
+        return True
+    return False
+
+async def check_interaction_rate(interaction):
+    if rate_limited(interaction_limits, interaction.user.id, interaction.guild_id):
+        metrics.inc("anti_spam_rejections_total", (("limit", "interaction"),))
+        await interaction.response.send_message("You're doing that too fast. Please wait a few seconds.", ephemeral=True)
+        return False
+    return True
+
+class GuardedCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction):
+        if interaction.type == discord.InteractionType.autocomplete:
+            return True  # Fires on every keystroke and can't be answered with a message
+        interaction.extras["started"] = time.perf_counter()
+        return await check_interaction_rate(interaction)
+
+    async def on_error(self, interaction, error):
+        started = interaction.extras.get("started")
+        if started is not None:
+            name = interaction.command.qualified_name if interaction.command else "unknown"
+            record_handler("command", name, time.perf_counter() - started, True)
+        await super().on_error(interaction, error)
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -35,12 +1377,71 @@ intents.guilds = True
 intents.members = True
 intents.messages = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+if SHARD_COUNT == "auto":
+    bot = commands.AutoShardedBot(command_prefix="!", intents=intents, tree_cls=GuardedCommandTree)
+elif SHARD_COUNT:
+    # Shards are dealt out round robin, so cluster 0 of 2 runs shards 0, 2, 4, ...
+    shard_ids = [shard_id for shard_id in range(int(SHARD_COUNT)) if shard_id % CLUSTER_COUNT == CLUSTER_ID]
+    bot = commands.AutoShardedBot(command_prefix="!", intents=intents, tree_cls=GuardedCommandTree, shard_count=int(SHARD_COUNT), shard_ids=shard_ids)
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents, tree_cls=GuardedCommandTree)
+instrument_http(bot.http)
+
+DEV_GUILD_ID = None  # Set to a guild id to sync commands only there, which applies instantly while developing
+startup_reported = False
+
+# Payment details of the home storefront, from before they were kept per guild. Every other
+# storefront starts with only "Others" and sets its own with /set_payment_details.
+PAYMENT_DETAILS = {
+    "BTC": {"title": "Bitcoin Payment", "address": "bc1qvvyyha5qn7fqwfkgl26xrznghl30nzedupwqc8"},
+    "ETH": {"title": "Ethereum Payment", "address": "0xf27f0a9e23b41C6a468cb1b64919cB98Ad53e316"},
+    "LTC": {"title": "Litecoin Payment", "address": "ltc1q9vpxfhgzjlr0hjm8ffmn5e40znytur5g7lvkvk"},
+    "PayPal": {
+        "title": "PayPal Payment",
+        "description": "Please ping <@1148847073458925668> for PayPal assistance."
+    },
+    "CashApp": {
+        "title": "CashApp Payment",
+        "description": (
+            "To proceed with the transaction, please follow these instructions carefully:\n\n"
+            "1. **Send the payment to this CashApp tag:**\n"
+            "**`$Nexus5784`**\n\n"
+            "2. **Important Guidelines:**\n"
+            "- Must send payment from **Balance**, not a **Card**.\n"
+            "- Do not include any **Notes** with your payment.\n"
+            "- Send **$1 first** as a test transaction.\n\n"
+            "⚠️ Sending incorrectly may result in the loss of funds!"
+        )
+    },
+    "Robux": {
+        "title": "Robux Payment",
+        "description": (
+            "To proceed with the transaction, please follow these instructions carefully:\n\n"
+            "1. **Send the Robux to this user:**\n"
+            "**`RobuxReceiver123`**\n\n"
+            "2. **Important Guidelines:**\n"
+            "- Include the transaction ID in the notes.\n"
+            "- Ensure the Robux amount matches your purchase.\n\n"
+            "⚠️ Failure to follow these instructions may result in delays!"
+        )
+    },
+    "Others": {
+        "title": "Other Payment Methods",
+        "description": "Please wait for the seller or an admin to assist you."
+    }
+}
+
+PAYMENT_TITLES = {method: details["title"] for method, details in PAYMENT_DETAILS.items()}
+CRYPTO_METHODS = ("BTC", "ETH", "LTC")  # Paid to an address, every other method shows instructions
 
+# Defaults for every guild. Each guild can override them, see GuildConfig below.
 TICKET_CATEGORY_NAME = "Tickets"  # Category for ticket channels
-REVIEWS_CHANNEL_ID = 1319287805058220074  # Channel for reviews
+TICKET_POOL_CHANNEL_NAME = "pending-ticket"  # Hidden, pre-created channels waiting to be claimed
+TICKET_POOL_SIZE = 3  # Pre-created ticket channels kept ready per guild
+REVIEWS_CHANNEL_ID = 1319287805058220074  # The home storefront's reviews channel, other guilds set theirs with /set_reviews_channel
 embed_message_id = None
 ADMIN_IDS = [751941348621287445, 987654321098765432]  # Add admin IDs here
+HOME_GUILD_ID = int(os.environ.get("HOME_GUILD_ID", "0")) or None  # The first storefront, it keeps the stock, payment details and reviews channel from before they were per guild
 REVIEW_EMBED_IMAGE = "https://media.discordapp.net/attachments/1184666977671852133/1338998043391033344/standard_3.gif?ex=67adc75a&is=67ac75da&hm=e7dc1c6c990d6c54a07e97195501d87ab6da2d914e84ad8082be57ac02a60d2a&="  # Default top-right image
 BOTTOM_IMAGE_DEFAULT = "https://media.discordapp.net/attachments/1184666977671852133/1338998042761760798/standard_4.gif?ex=67adc75a&is=67ac75da&hm=489014ea2cde5bf9da327ea890ffe6a9dcafb2b2bc8b777a9a0f0bfaa0659954&="  # Default bottom image
 
@@ -55,72 +1456,711 @@ embed_fields = [
 ]
 embed_footer = "Thank you for choosing Robux Automation!"
 
+DEFAULT_GUILD_CONFIG = {
+    "ticket_category_name": TICKET_CATEGORY_NAME,
+    "reviews_channel_id": None,  # Reviews are recorded but not posted until a channel is set
+    "admin_ids": ADMIN_IDS,
+    "admin_role_ids": [],
+    "review_embed_image": REVIEW_EMBED_IMAGE,
+    "bottom_image": BOTTOM_IMAGE_DEFAULT,
+    "embed_title": embed_title,
+    "embed_description": embed_description,
+    "embed_fields": embed_fields,
+    "embed_footer": embed_footer,
+    "prefix": "!",
+    "queue_channel_id": None,  # Where the admin queue dashboard lives, set with /set_queue_channel
+    "queue_message_id": None,
+    "payment_details": {"Others": PAYMENT_DETAILS["Others"]}  # Method -> title plus address or instructions
+}
+
+HOME_GUILD_CONFIG = {  # Defaults only the home storefront gets
+    "reviews_channel_id": REVIEWS_CHANNEL_ID,
+    "payment_details": PAYMENT_DETAILS
+}
+
+class GuildConfig:
+    # Settings for one storefront. Read like a dict: config["reviews_channel_id"]
+    def __init__(self, guild_id, overrides):
+        self.guild_id = guild_id
+        self.overrides = overrides
+        home = HOME_GUILD_CONFIG if guild_id is not None and guild_id == HOME_GUILD_ID else {}
+        self.settings = {**DEFAULT_GUILD_CONFIG, **home, **overrides}
+        self.admin_ids = frozenset(self.settings["admin_ids"])
+        self.admin_role_ids = frozenset(self.settings["admin_role_ids"])
+        self.embeds = {}  # Embed templates rendered with these settings
+        self.embed_dicts = {}  # Template name -> its to_dict(), for render_embed
+
+    def __getitem__(self, key):
+        return self.settings[key]
+
+    def is_admin(self, member):
+        # Admins are the bot's operators and the roles they appoint with /set_admin_role. Owning the
+        # guild isn't enough: deal history is shared by every storefront, so adding the bot to a
+        # server must not let its owner complete deals.
+        if member.id in self.admin_ids:
+            return True
+        return any(role.id in self.admin_role_ids for role in getattr(member, "roles", ()))
+
+class GuildConfigCache:
+    # Read-through cache over guild_config. A guild's settings are loaded the first time it's
+    # seen, and updating them swaps in a new GuildConfig so everything cached on the old one goes.
+    def __init__(self, store):
+        self.store = store
+        self.configs = {}
+        self.default = GuildConfig(None, {})
+
+    async def get(self, guild_id):
+        if guild_id is None:
+            return self.default
+        config = self.configs.get(guild_id)
+        if config is None:
+            config = GuildConfig(guild_id, await self.store.get_guild_config(guild_id))
+            self.configs[guild_id] = config
+        return config
+
+    async def update(self, guild_id, **changes):
+        config = await self.get(guild_id)
+        overrides = {**config.overrides, **changes}
+        await self.store.set_guild_config(guild_id, overrides)
+        config = GuildConfig(guild_id, overrides)
+        self.configs[guild_id] = config
+        return config
+
+guild_configs = GuildConfigCache(ticket_store)
+
+async def get_config(interaction):
+    return await guild_configs.get(interaction.guild.id if interaction.guild else None)
+
+async def is_admin(interaction):
+    config = await get_config(interaction)
+    return config.is_admin(interaction.user)
+
 # Stock system (default items empty, only one test item)
-stock = {
-    "Test Item": {"price": 10.0, "description": "This is a test item for demonstration purposes."}
+DEFAULT_STOCK = {
+    "Test Item": {"price_cents": 1000, "description": "This is a test item for demonstration purposes.", "category": "General"}
 }
 
-# Cart system
-user_carts = {}
+CATALOG_PAGE_SIZE = 25  # Discord allows at most 25 options in a Select
+DEFAULT_CATEGORY = "General"
+ALL_CATEGORIES = "*"  # Category filter value for the whole catalog, followed by a page number it turns the category list's page
+CATEGORY_PAGE_SIZE = CATALOG_PAGE_SIZE - 2  # Leaves room for "All items" and "More categories"
+MAX_CATEGORY_LENGTH = 40  # Category names travel inside custom_ids, which are capped at 100 characters
+MAX_ITEM_NAME_LENGTH = 100  # Item names are Select option values, which Discord caps at 100 characters
+
+class Catalog:
+    # Sorted indexes over stock so a page or a prefix search never walks the whole catalog.
+    # Rendered pages are cached until add/remove touches their category.
+    def __init__(self, items):
+        self.items = items
+        self.names = sorted(items)
+        self.search_keys = sorted((name.casefold(), name) for name in items)
+        self.categories = {}
+        for name in self.names:
+            self.categories.setdefault(items[name]["category"], []).append(name)
+        self.pages = {}  # category (None for everything) -> {page: options}
+        self.category_names = None  # Sorted, built when first needed
+        self.category_pages = {}  # page -> options of the category Select
+
+    def names_in(self, category):
+        return self.names if category is None else self.categories.get(category, [])
+
+    def page_count(self, category=None):
+        return max(1, -(-len(self.names_in(category)) // CATALOG_PAGE_SIZE))
+
+    def page_options(self, category=None, page=0):
+        pages = self.pages.setdefault(category, {})
+        options = pages.get(page)
+        if options is None:
+            start = page * CATALOG_PAGE_SIZE
+            options = [
+                discord.SelectOption(label=name[:100], value=name, description=self.items[name]["description"][:100])
+                for name in self.names_in(category)[start:start + CATALOG_PAGE_SIZE]
+            ]
+            pages[page] = options
+        return options
+
+    def sorted_categories(self):
+        if self.category_names is None:
+            self.category_names = sorted(self.categories)
+        return self.category_names
+
+    def category_page_count(self):
+        return max(1, -(-len(self.categories) // CATEGORY_PAGE_SIZE))
+
+    def category_page_of(self, category):
+        # The page of the category list that shows category, the first for the whole catalog
+        if category not in self.categories:
+            return 0
+        return bisect.bisect_left(self.sorted_categories(), category) // CATEGORY_PAGE_SIZE
+
+    def category_options(self, page=0):
+        options = self.category_pages.get(page)
+        if options is None:
+            start = page * CATEGORY_PAGE_SIZE
+            options = [discord.SelectOption(label="All items", value=ALL_CATEGORIES)] + [
+                discord.SelectOption(label=name[:100], value=name) for name in self.sorted_categories()[start:start + CATEGORY_PAGE_SIZE]
+            ]
+            page_count = self.category_page_count()
+            if page_count > 1:
+                target = (page + 1) % page_count
+                options.append(discord.SelectOption(
+                    label=f"More categories (page {target + 1}/{page_count})", value=f"{ALL_CATEGORIES}{target}"
+                ))
+            self.category_pages[page] = options
+        return options
+
+    def search(self, prefix, limit=CATALOG_PAGE_SIZE):
+        key = prefix.casefold()
+        start = bisect.bisect_left(self.search_keys, (key,))
+        matches = []
+        for folded, name in self.search_keys[start:start + limit]:
+            if not folded.startswith(key):
+                break
+            matches.append(name)
+        return matches
+
+    def add(self, name, item):
+        if name in self.items:
+            self.remove(name)
+        self.items[name] = item
+        bisect.insort(self.names, name)
+        bisect.insort(self.search_keys, (name.casefold(), name))
+        if item["category"] not in self.categories:
+            self.forget_categories()
+        bisect.insort(self.categories.setdefault(item["category"], []), name)
+        self.invalidate(item["category"])
+
+    def remove(self, name):
+        item = self.items.pop(name)
+        self.names.remove(name)
+        self.search_keys.remove((name.casefold(), name))
+        category_names = self.categories[item["category"]]
+        category_names.remove(name)
+        if not category_names:
+            del self.categories[item["category"]]
+            self.forget_categories()
+        self.invalidate(item["category"])
+
+    def invalidate(self, category):
+        self.pages.pop(category, None)
+        self.pages.pop(None, None)
+
+    def forget_categories(self):
+        # A category came or went
+        self.category_names = None
+        self.category_pages.clear()
+
+class CatalogCache:
+    # Read-through cache of each guild's Catalog. A guild's stock is loaded the first time a menu,
+    # search or command needs it, and Catalog.add/remove keep it in step with the store after that.
+    def __init__(self, store):
+        self.store = store
+        self.catalogs = {}
+        self.empty = Catalog({})  # Outside a guild there is nothing to sell
+
+    async def get(self, guild_id):
+        if guild_id is None:
+            return self.empty
+        catalog = self.catalogs.get(guild_id)
+        if catalog is None:
+            items = await self.store.load_stock(guild_id, DEFAULT_STOCK, legacy=guild_id == HOME_GUILD_ID)
+            catalog = self.catalogs.setdefault(guild_id, Catalog(items))
+        return catalog
+
+catalogs = CatalogCache(ticket_store)
+
+state_loaded_at = time.perf_counter()
+
+# Carts and transaction status are kept per ticket channel in ticket_store
+
+# Embed templates. The static parts of each embed are built once per guild config and cached on
+# it. Handlers take a copy and fill in the dynamic fields. Changing a guild's settings replaces its
+# GuildConfig, which drops the cached embeds with it.
+embed_builders = {}
+
+def embed_template(name):
+    def decorator(build):
+        embed_builders[name] = build
+        return build
+    return decorator
+
+def cached_embed(config, name):
+    # Shared instance, only for embeds that are sent as they are
+    embed = config.embeds.get(name)
+    if embed is None:
+        embed = embed_builders[name](config)
+        config.embeds[name] = embed
+    return embed
+
+def render_embed(config, name):
+    # A copy for the handler to fill in. Embed.copy() goes through to_dict() and from_dict(), so the
+    # template's dict is worked out once and only from_dict() is left for each copy. from_dict()
+    # keeps the dicts it's given rather than copying them. Handlers replace the footer, author and
+    # images through the setters but add to the field list, so that list gets a copy of its own.
+    data = config.embed_dicts.get(name)
+    if data is None:
+        data = config.embed_dicts[name] = cached_embed(config, name).to_dict()
+    if "fields" in data:
+        data = {**data, "fields": [dict(field) for field in data["fields"]]}
+    return discord.Embed.from_dict(data)
+
+@embed_template("setup")
+def build_setup_embed(config):
+    embed = discord.Embed(
+        title=config["embed_title"],
+        description=config["embed_description"],
+        color=0x8000FF
+    )
+
+    for field in config["embed_fields"]:
+        embed.add_field(name=field["name"], value=field["value"], inline=field["inline"])
+
+    embed.set_footer(text=config["embed_footer"])
+    embed.set_thumbnail(url=config["review_embed_image"])  # Image in top-right
+    return embed
+
+@embed_template("cart")
+def build_cart_embed(config):
+    embed = discord.Embed(
+        title="Your Cart",
+        description="Here are the items in your cart:",
+        color=discord.Color.blue()
+    )
+    embed.set_footer(text="Proceed to payment.")
+    embed.set_thumbnail(url=config["review_embed_image"])  # Image in top-right
+    return embed
+
+@embed_template("marked_as_paid")
+def build_marked_as_paid_embed(config):
+    embed = discord.Embed(
+        title="Payment Marked as Paid",
+        color=discord.Color.green()
+    )
+    embed.set_thumbnail(url=config["review_embed_image"])  # Image in top-right
+    return embed
+
+@embed_template("deal_completed")
+def build_deal_completed_embed(config):
+    embed = discord.Embed(
+        title="Deal Completed",
+        color=discord.Color.green()
+    )
+    embed.set_thumbnail(url=config["review_embed_image"])  # Image in top-right
+    return embed
+
+@embed_template("review")
+def build_review_embed(config):
+    embed = discord.Embed(
+        title="New Review",
+        color=discord.Color.green()
+    )
+    embed.set_thumbnail(url=config["review_embed_image"])  # Image in top-right
+    return embed
+
+def build_payment_embed(payment_method, config):
+    selected_payment = config["payment_details"][payment_method]
 
-# Transaction status
-transaction_status = {}
+    embed_payment = discord.Embed(
+        title=selected_payment["title"],
+        color=discord.Color.green()
+    )
+
+    if "address" in selected_payment:
+        embed_payment.description = (
+            f"To proceed with the transaction, please send the required payment to the following address:\n"
+            f"**```{selected_payment['address']}```**\n\n"
+        )
+    else:
+        embed_payment.description = selected_payment["description"]
+
+    embed_payment.set_footer(text="Copy the address and complete your payment.")
+    embed_payment.set_thumbnail(url=config["review_embed_image"])  # Image in top-right
+    return embed_payment
+
+for method in PAYMENT_TITLES:
+    embed_template(f"payment:{method}")(partial(build_payment_embed, method))
+
+# Built once and shared by every PaymentMethodDropdown, which offers the ones its guild has set up
+PAYMENT_OPTIONS = [
+    discord.SelectOption(
+        label="Bitcoin",
+        value="BTC",
+        description="Pay with Bitcoin",
+        emoji="<:bitcoin:1305877376969736264>"
+    ),
+    discord.SelectOption(
+        label="Ethereum",
+        value="ETH",
+        description="Pay with Ethereum",
+        emoji="<:ethw:1305877378207186944>"
+    ),
+    discord.SelectOption(
+        label="Litecoin",
+        value="LTC",
+        description="Pay with Litecoin",
+        emoji="<:litecoin:1305877374667198504>"
+    ),
+    discord.SelectOption(
+        label="PayPal",
+        value="PayPal",
+        description="Pay with PayPal",
+        emoji="<:paypal:1305877375854313535>"
+    ),
+    discord.SelectOption(
+        label="CashApp",
+        value="CashApp",
+        description="Pay with CashApp",
+        emoji="<:CashApp:1305900694426877968>"
+    ),
+    discord.SelectOption(
+        label="Robux",
+        value="Robux",
+        description="Pay with Robux",
+        emoji="<:Robux:1305394825914351704>"
+    ),
+    discord.SelectOption(
+        label="Others",
+        value="Others",
+        description="Other payment methods",
+        emoji="❓"
+    )
+]
+
+# Component buttons are routed through a table instead of an if/elif chain.
+# custom_id is either a bare action ("purchase") or "action:buyer_id:ticket_id[:extra]".
+ComponentPayload = namedtuple("ComponentPayload", ["action", "buyer_id", "ticket_id", "extra"], defaults=[None])
+
+component_handlers = {}
+
+component_lock_scopes = {}  # action -> "ticket" or "buyer", what a click on it locks
+deferred_actions = set()  # Actions whose handlers make several REST calls or wait on disk
+component_prechecks = {}  # action -> check run before a deferred handler is queued, True when it answered
+
+def component_handler(action, lock="ticket", defer=False, precheck=None):
+    # Handlers registered with defer=True are acknowledged straight away and run on the worker
+    # pool, so they must answer through respond() rather than interaction.response. A precheck
+    # answers the clicks that need no real work itself, so they never wait for a worker.
+    def decorator(func):
+        component_handlers[action] = func
+        component_lock_scopes[action] = lock
+        if defer:
+            deferred_actions.add(action)
+        if precheck:
+            component_prechecks[action] = precheck
+        return func
+    return decorator
+
+async def respond(interaction, content=None, **kwargs):
+    # Works before and after the interaction has been deferred
+    if interaction.response.is_done():
+        await interaction.followup.send(content, **kwargs)
+    else:
+        await interaction.response.send_message(content, **kwargs)
+
+WORKER_POOL_SIZE = 8  # Deferred handlers running at once
+WORKER_QUEUE_LIMIT = 500  # Deferred handlers waiting, past this new ones are turned away
+WORKER_GUILD_QUEUE_LIMIT = 50  # Waiting per guild, so one guild can't fill the whole queue
+WORKER_BUSY_MESSAGE = "The bot is very busy right now. Please try again in a moment."
+WORKER_ERROR_MESSAGE = "Something went wrong while handling that. Please try again."
+
+class WorkerPool:
+    # Deferred handlers wait here in one queue per guild. Workers take from the guilds in turn,
+    # so a rush in one guild doesn't hold up everyone else, and the queues have a hard cap.
+    def __init__(self, workers, queue_limit, guild_queue_limit):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.guild_queue_limit = guild_queue_limit
+        self.queues = {}  # guild_id -> deque of (name, job, queued at)
+        self.turns = deque()  # guild ids with jobs waiting, in the order they get served
+        self.queued = 0
+        self.running = 0
+        self.available = None  # Counts waiting jobs, created on the bot's event loop
+
+    def submit(self, guild_id, name, job):
+        # job is a coroutine function. Returns False when the queue is full.
+        if self.available is None:
+            self.available = asyncio.Semaphore(0)
+            for _ in range(self.workers):
+                spawn(self.work())
+
+        queue = self.queues.get(guild_id)
+        if self.queued >= self.queue_limit or (queue and len(queue) >= self.guild_queue_limit):
+            metrics.inc("worker_pool_rejected_total")
+            return False
+        if queue is None:
+            queue = self.queues[guild_id] = deque()
+            self.turns.append(guild_id)
+        queue.append((name, job, time.perf_counter()))
+        self.queued += 1
+        self.available.release()
+        return True
+
+    async def work(self):
+        while True:
+            await self.available.acquire()
+            guild_id = self.turns.popleft()
+            queue = self.queues[guild_id]
+            name, job, queued_at = queue.popleft()
+            if queue:
+                self.turns.append(guild_id)  # Back of the line
+            else:
+                del self.queues[guild_id]
+            self.queued -= 1
+
+            started = time.perf_counter()
+            metrics.observe("worker_pool_wait_seconds", started - queued_at)
+            self.running += 1
+            failed = True
+            try:
+                await job()
+                failed = False
+            except Exception as e:
+                print(f"Deferred handler {name} failed: {e}")
+            finally:
+                self.running -= 1
+                record_handler("deferred", name, time.perf_counter() - started, failed)
+
+worker_pool = WorkerPool(WORKER_POOL_SIZE, WORKER_QUEUE_LIMIT, WORKER_GUILD_QUEUE_LIMIT)
+metrics.describe("worker_pool_wait_seconds", "histogram", "Time deferred handlers spent waiting for a worker")
+metrics.describe("worker_pool_rejected_total", "counter", "Deferred handlers turned away because the queue was full")
+
+@metrics.gauge("worker_pool", "Deferred handlers waiting and running")
+async def worker_pool_gauge():
+    return {
+        (("state", "queued"),): worker_pool.queued,
+        (("state", "running"),): worker_pool.running,
+        (("state", "guilds_waiting"),): len(worker_pool.queues)
+    }
+
+def answer_failures(interaction, job):
+    # A deferred job that fails would leave the user on "thinking..." or a click that never gets an
+    # answer, so tell them before the error goes on to the pool to be logged
+    async def run():
+        try:
+            await job()
+        except Exception:
+            try:
+                await interaction.followup.send(WORKER_ERROR_MESSAGE, ephemeral=True)
+            except discord.HTTPException as e:
+                print(f"Failed to report an error to {interaction.user.id}: {e}")
+            raise
+    return run
+
+def slow_command(func):
+    # For slash commands that take a while. Acknowledges at once, then runs the command on the
+    # worker pool. The command answers with interaction.followup or edit_original_response.
+    @wraps(func)
+    async def wrapper(interaction, *args, **kwargs):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        job = answer_failures(interaction, partial(func, interaction, *args, **kwargs))
+        if not worker_pool.submit(interaction.guild_id, func.__name__, job):
+            await interaction.followup.send(WORKER_BUSY_MESSAGE, ephemeral=True)
+    return wrapper
+
+CLUSTER_LOCK_TTL = 30.0  # Seconds before a lease left behind by a dead process can be taken over
+CLUSTER_LOCK_WAIT = 2.0  # How long a click waits for a busy ticket, interactions must be answered within 3s
+
+local_locks = {}  # lock name -> [asyncio.Lock, number of holders and waiters]
+
+@contextlib.asynccontextmanager
+async def cluster_lock(name):
+    # Yields whether the lock was taken. Callers in this process queue on an asyncio lock, and only
+    # the one at the front takes the lease in the shared store, which other clusters also check.
+    entry = local_locks.setdefault(name, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        try:
+            await asyncio.wait_for(entry[0].acquire(), CLUSTER_LOCK_WAIT)
+        except asyncio.TimeoutError:
+            yield False
+            return
+
+        try:
+            if CLUSTER_COUNT == 1:
+                yield True
+                return
+
+            deadline = time.monotonic() + CLUSTER_LOCK_WAIT
+            while not await ticket_store.acquire_lock(name, CLUSTER_OWNER, CLUSTER_LOCK_TTL):
+                if time.monotonic() >= deadline:
+                    yield False
+                    return
+                await asyncio.sleep(0.05)
+            try:
+                yield True
+            finally:
+                await ticket_store.release_lock(name, CLUSTER_OWNER)
+        finally:
+            entry[0].release()
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del local_locks[name]
+
+def encode_custom_id(action, buyer_id=None, ticket_id=None, extra=None):
+    if buyer_id is None and ticket_id is None and extra is None:
+        return action
+    custom_id = f"{action}:{buyer_id or ''}:{ticket_id or ''}"
+    if extra is not None:
+        custom_id += f":{extra}"
+    return custom_id
+
+def decode_custom_id(custom_id):
+    action, separator, rest = custom_id.partition(":")
+    if separator:
+        buyer_id, _, rest = rest.partition(":")
+        ticket_id, separator, extra = rest.partition(":")
+        return ComponentPayload(
+            action,
+            int(buyer_id) if buyer_id else None,
+            int(ticket_id) if ticket_id else None,
+            extra if separator else None
+        )
+
+    # Buttons sent before payloads were encoded look like "deal_completed_<buyer_id>"
+    if custom_id.startswith("deal_completed_"):
+        return ComponentPayload("deal_completed", int(custom_id[len("deal_completed_"):]), None)
+    return ComponentPayload(custom_id, None, None)
+
+class StatelessView(View):
+    # Layout only. Every component carries a custom_id that the component dispatcher routes, and the
+    # view is rebuilt from that payload and the ticket store whenever it is used. Stopping the view
+    # before it's sent keeps it out of discord.py's view store, so open tickets hold no memory here
+    # and their components keep working after a restart without re-sending anything.
+    def __init__(self):
+        super().__init__(timeout=None)
+        self.stop()
+
+def persistent_view(*actions):
+    # Routes each action to the view's on_<action> method, restoring the view lazily on first use
+    def decorator(cls):
+        for action in actions:
+            component_handler(action)(partial(dispatch_to_view, cls, action))
+        return cls
+    return decorator
+
+async def dispatch_to_view(cls, action, interaction, payload):
+    ticket = await ticket_store.get_ticket(payload.ticket_id) if payload.ticket_id else None
+    if not ticket:
+        await interaction.response.send_message("This ticket is no longer open.", ephemeral=True)
+        return
 
-class ItemSelectionView(View):
-    def __init__(self, user_id):
+    view = await cls.restore(ticket)
+    if await view.interaction_check(interaction):
+        await getattr(view, f"on_{action}")(interaction, payload)
+
+MODAL_TIMEOUT = 600  # Seconds before an unsubmitted modal is dropped
+
+@persistent_view("item_select", "item_category", "item_page")
+class ItemSelectionView(StatelessView):
+    def __init__(self, catalog, user_id, channel_id, page=0, category=None, category_page=None):
         super().__init__()
+        self.catalog = catalog
         self.user_id = user_id
-        self.item_select = Select(
-            placeholder="Select an item to purchase",
-            options=[discord.SelectOption(label=item, description=stock[item]["description"]) for item in stock]
-        )
-        self.add_item(self.item_select)
+        self.channel_id = channel_id
+        page_count = catalog.page_count(category)
+
+        options = catalog.page_options(category, page)
+        if options:
+            self.add_item(Select(
+                placeholder=f"Select an item to purchase (page {page + 1}/{page_count})" if page_count > 1 else "Select an item to purchase",
+                options=list(options),
+                custom_id=encode_custom_id("item_select", user_id, channel_id)
+            ))
+
+        if len(catalog.categories) > 1:
+            if category_page is None or not 0 <= category_page < catalog.category_page_count():
+                category_page = catalog.category_page_of(category)
+            self.add_item(Select(
+                placeholder="Filter by category",
+                options=list(catalog.category_options(category_page)),
+                custom_id=encode_custom_id("item_category", user_id, channel_id, category or ""),  # Kept while the list pages
+                row=1
+            ))
+
+        if page_count > 1:
+            # The target page and filter ride along in the custom_id
+            for label, target, disabled in (("Previous", page - 1, page == 0), ("Next", page + 1, page >= page_count - 1)):
+                self.add_item(Button(
+                    label=label,
+                    style=discord.ButtonStyle.gray,
+                    disabled=disabled,
+                    custom_id=encode_custom_id("item_page", user_id, channel_id, f"{target}:{category or ''}"),
+                    row=2
+                ))
+
+    @classmethod
+    async def restore(cls, ticket):
+        return cls(await catalogs.get(ticket["guild_id"]), ticket["buyer_id"], ticket["channel_id"])
 
     async def interaction_check(self, interaction: discord.Interaction):
         if interaction.user.id != self.user_id:
             await interaction.response.send_message("Only the ticket owner can interact with this.", ephemeral=True)
             return False
+        return True
+
+    async def on_item_select(self, interaction, payload):
+        # Ask for the quantity in a modal instead of waiting on the message stream
+        selected_item = interaction.data["values"][0]
+        await interaction.response.send_modal(QuantityModal(self.user_id, self.channel_id, selected_item))
+
+    async def on_item_category(self, interaction, payload):
+        category = interaction.data["values"][0]
+        if category == ALL_CATEGORIES:
+            view = ItemSelectionView(self.catalog, self.user_id, self.channel_id)
+        elif category.startswith(ALL_CATEGORIES) and category[1:].isdigit():
+            # "More categories": the next page of the list, the items shown stay as they were
+            view = ItemSelectionView(self.catalog, self.user_id, self.channel_id, 0, payload.extra or None, int(category[1:]))
+        else:
+            view = ItemSelectionView(self.catalog, self.user_id, self.channel_id, 0, category)
+        await interaction.response.edit_message(view=view)
 
-        selected_item = self.item_select.values[0]
-        user_carts[self.user_id] = user_carts.get(self.user_id, {})
-        user_carts[self.user_id][selected_item] = 0  # Initialize quantity
+    async def on_item_page(self, interaction, payload):
+        page, _, category = payload.extra.partition(":")
+        view = ItemSelectionView(self.catalog, self.user_id, self.channel_id, max(0, int(page)), category or None)
+        await interaction.response.edit_message(view=view)
 
-        await interaction.response.send_message(
-            f"How many **{selected_item}** would you like to buy?",
-            ephemeral=True
-        )
+class QuantityModal(Modal, title="Choose Quantity"):
+    quantity = TextInput(label="Quantity", placeholder="Enter a number", max_length=6, required=True)
 
-        while True:
-            def check(message):
-                return message.author.id == self.user_id and message.channel == interaction.channel
+    def __init__(self, user_id, channel_id, item):
+        super().__init__(timeout=MODAL_TIMEOUT)
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.item = item
+        self.quantity.placeholder = f"How many {item} would you like to buy?"[:100]
 
-            try:
-                quantity_message = await bot.wait_for('message', timeout=60.0, check=check)
-                quantity = quantity_message.content
+    @instrumented("modal", "quantity")
+    async def on_submit(self, interaction: discord.Interaction):
+        try:
+            quantity = int(self.quantity.value)
+        except ValueError:
+            quantity = 0
+        if quantity <= 0:
+            await interaction.response.send_message(
+                "Quantity must be a positive number. Please select the item again.",
+                view=ItemSelectionView(await catalogs.get(interaction.guild_id), self.user_id, self.channel_id),
+                ephemeral=True
+            )
+            return
 
-                # Check if the user typed "done"
-                if quantity.lower() == "done":
-                    break
+        if not await get_editable_ticket(interaction, self.channel_id):
+            return
 
-                # Try to convert the input to an integer
-                quantity = int(quantity)
-                if quantity > 0:
-                    user_carts[self.user_id][selected_item] = quantity
-                    await interaction.followup.send(
-                        f"Added **{quantity} {selected_item}** to your cart.",
-                        ephemeral=True
-                    )
-                    break
-                else:
-                    await interaction.followup.send("Quantity must be a positive number. Please try again.", ephemeral=True)
-            except asyncio.TimeoutError:
-                await interaction.followup.send("You took too long to respond. Please start over.", ephemeral=True)
-                return
-            except ValueError:
-                await interaction.followup.send("Invalid input. Please enter a number or type 'done' to finish.", ephemeral=True)
+        # Freeze the current price into the cart, an admin may change or remove the item later
+        item = (await catalogs.get(interaction.guild_id)).items.get(self.item)
+        if not item:
+            await interaction.response.send_message("This item is no longer available.", ephemeral=True)
+            return
+
+        await ticket_store.set_cart_quantity(self.channel_id, self.item, quantity, item["price_cents"])
+        await interaction.response.send_message(
+            f"Added **{quantity} {self.item}** to your cart.",
+            ephemeral=True
+        )
 
         # Ask if they want to add more items
-        add_more_view = View()
+        add_more_view = StatelessView()
         add_more_button = Button(label="Add More", style=discord.ButtonStyle.green, custom_id="add_more")
         done_button = Button(label="Done", style=discord.ButtonStyle.red, custom_id="done")
         remove_button = Button(label="Remove Items", style=discord.ButtonStyle.gray, custom_id="remove_items")
@@ -133,24 +2173,36 @@ class ItemSelectionView(View):
             view=add_more_view,
             ephemeral=True
         )
-class RemoveItemsView(View):
-    def __init__(self, user_id):
+
+@persistent_view("cart_remove")
+class RemoveItemsView(StatelessView):
+    def __init__(self, user_id, channel_id, cart=()):
         super().__init__()
         self.user_id = user_id
+        self.channel_id = channel_id
         self.item_select = Select(
             placeholder="Select an item to remove",
-            options=[discord.SelectOption(label=item) for item in user_carts[user_id]]
+            options=[discord.SelectOption(label=item) for item in cart],
+            custom_id=encode_custom_id("cart_remove", user_id, channel_id)
         )
         self.add_item(self.item_select)
 
+    @classmethod
+    async def restore(cls, ticket):
+        return cls(ticket["buyer_id"], ticket["channel_id"])
+
     async def interaction_check(self, interaction: discord.Interaction):
         if interaction.user.id != self.user_id:
             await interaction.response.send_message("Only the ticket owner can interact with this.", ephemeral=True)
             return False
+        return True
 
-        selected_item = self.item_select.values[0]
-        if selected_item in user_carts[self.user_id]:
-            del user_carts[self.user_id][selected_item]
+    async def on_cart_remove(self, interaction, payload):
+        if not await get_editable_ticket(interaction, self.channel_id):
+            return
+
+        selected_item = interaction.data["values"][0]
+        if await ticket_store.remove_cart_item(self.channel_id, selected_item):
             await interaction.response.send_message(
                 f"Removed **{selected_item}** from your cart.",
                 ephemeral=True
@@ -158,136 +2210,59 @@ class RemoveItemsView(View):
         else:
             await interaction.response.send_message("Item not found in your cart.", ephemeral=True)
 
-class PaymentMethodDropdown(View):
-    def __init__(self, user_id):
+@persistent_view("payment_method")
+class PaymentMethodDropdown(StatelessView):
+    def __init__(self, config, user_id, channel_id):
         super().__init__()
+        self.config = config
         self.user_id = user_id
+        self.channel_id = channel_id
         self.crypto_select = Select(
             placeholder="Choose your payment method",
-            options=[
-                discord.SelectOption(
-                    label="Bitcoin",
-                    value="BTC",
-                    description="Pay with Bitcoin",
-                    emoji="<:bitcoin:1305877376969736264>"
-                ),
-                discord.SelectOption(
-                    label="Ethereum",
-                    value="ETH",
-                    description="Pay with Ethereum",
-                    emoji="<:ethw:1305877378207186944>"
-                ),
-                discord.SelectOption(
-                    label="Litecoin",
-                    value="LTC",
-                    description="Pay with Litecoin",
-                    emoji="<:litecoin:1305877374667198504>"
-                ),
-                discord.SelectOption(
-                    label="PayPal",
-                    value="PayPal",
-                    description="Pay with PayPal",
-                    emoji="<:paypal:1305877375854313535>"
-                ),
-                discord.SelectOption(
-                    label="CashApp",
-                    value="CashApp",
-                    description="Pay with CashApp",
-                    emoji="<:CashApp:1305900694426877968>"
-                ),
-                discord.SelectOption(
-                    label="Robux",
-                    value="Robux",
-                    description="Pay with Robux",
-                    emoji="<:Robux:1305394825914351704>"
-                ),
-                discord.SelectOption(
-                    label="Others",
-                    value="Others",
-                    description="Other payment methods",
-                    emoji="❓"
-                )
-            ]
+            options=[option for option in PAYMENT_OPTIONS if option.value in config["payment_details"]],
+            custom_id=encode_custom_id("payment_method", user_id, channel_id)
         )
         self.add_item(self.crypto_select)
 
+    @classmethod
+    async def restore(cls, ticket):
+        return cls(await guild_configs.get(ticket["guild_id"]), ticket["buyer_id"], ticket["channel_id"])
+
     async def interaction_check(self, interaction: discord.Interaction):
         if interaction.user.id != self.user_id:
             await interaction.response.send_message("Only the ticket owner can interact with this.", ephemeral=True)
             return False
+        return True
 
-        payment_method = self.crypto_select.values[0]
-        transaction_status[self.user_id] = {"paid": False, "completed": False, "payment_method": payment_method, "buyer_id": self.user_id}
-
-        # Payment details
-        payment_details = {
-            "BTC": {"title": "Bitcoin Payment", "address": "bc1qvvyyha5qn7fqwfkgl26xrznghl30nzedupwqc8"},
-            "ETH": {"title": "Ethereum Payment", "address": "0xf27f0a9e23b41C6a468cb1b64919cB98Ad53e316"},
-            "LTC": {"title": "Litecoin Payment", "address": "ltc1q9vpxfhgzjlr0hjm8ffmn5e40znytur5g7lvkvk"},
-            "PayPal": {
-                "title": "PayPal Payment",
-                "description": "Please ping <@1148847073458925668> for PayPal assistance."
-            },
-            "CashApp": {
-                "title": "CashApp Payment",
-                "description": (
-                    "To proceed with the transaction, please follow these instructions carefully:\n\n"
-                    "1. **Send the payment to this CashApp tag:**\n"
-                    "**`$Nexus5784`**\n\n"
-                    "2. **Important Guidelines:**\n"
-                    "- Must send payment from **Balance**, not a **Card**.\n"
-                    "- Do not include any **Notes** with your payment.\n"
-                    "- Send **$1 first** as a test transaction.\n\n"
-                    "⚠️ Sending incorrectly may result in the loss of funds!"
-                )
-            },
-            "Robux": {
-                "title": "Robux Payment",
-                "description": (
-                    "To proceed with the transaction, please follow these instructions carefully:\n\n"
-                    "1. **Send the Robux to this user:**\n"
-                    "**`RobuxReceiver123`**\n\n"
-                    "2. **Important Guidelines:**\n"
-                    "- Include the transaction ID in the notes.\n"
-                    "- Ensure the Robux amount matches your purchase.\n\n"
-                    "⚠️ Failure to follow these instructions may result in delays!"
-                )
-            },
-            "Others": {
-                "title": "Other Payment Methods",
-                "description": "Please wait for the seller or an admin to assist you."
-            }
-        }
-
-        selected_payment = payment_details[payment_method]
-
-        embed_payment = discord.Embed(
-            title=selected_payment["title"],
-            color=discord.Color.green()
-        )
-
-        if payment_method == "Others":
-            embed_payment.description = selected_payment["description"]
-        elif payment_method == "CashApp":
-            embed_payment.description = selected_payment["description"]
-        elif payment_method == "PayPal":
-            embed_payment.description = selected_payment["description"]
-        elif payment_method == "Robux":
-            embed_payment.description = selected_payment["description"]
-        else:
+    async def on_payment_method(self, interaction, payload):
+        payment_method = interaction.data["values"][0]
+        if payment_method not in self.config["payment_details"]:
+            await interaction.response.send_message("This payment method is no longer available.", ephemeral=True)
+            return
+        if not await ticket_store.transition(self.channel_id, CART_EDITABLE_STATUSES, TICKET_AWAITING_PAYMENT, payment_method):
+            await interaction.response.send_message("This order has already been paid and can't be changed.", ephemeral=True)
+            return
+        ticket_scheduler.touch(self.channel_id)
+
+        embed_payment = cached_embed(self.config, f"payment:{payment_method}")
+        if payment_watcher and "address" in self.config["payment_details"][payment_method]:
+            # This ticket's own address, the watcher marks it paid once the payment confirms
+            cart = await ticket_store.get_cart(self.channel_id)
+            address = await ticket_store.create_deposit(
+                payment_method, self.channel_id, interaction.guild_id, self.user_id, cart.total_cents, payment_watcher.backend.derive_address
+            )
+            embed_payment = embed_payment.copy()
             embed_payment.description = (
-                f"To proceed with the transaction, please send the required payment to the following address:\n"
-                f"**```{selected_payment['address']}```**\n\n"
+                f"To proceed with the transaction, please send {format_cents(cart.total_cents)} worth of {payment_method} "
+                f"to this ticket's address:\n**```{address}```**\n\n"
+                f"Your ticket is marked as paid automatically once the payment confirms."
             )
 
-        embed_payment.set_footer(text="Copy the address and complete your payment.")
-        embed_payment.set_thumbnail(url=REVIEW_EMBED_IMAGE)  # Image in top-right
-
         # Mark as Paid button
         mark_as_paid_button = Button(label="Mark as Paid", style=discord.ButtonStyle.green, custom_id="mark_as_paid")
         cancel_button = Button(label="Cancel", style=discord.ButtonStyle.red, custom_id="cancel_ticket")
 
-        view = View()
+        view = StatelessView()
         view.add_item(mark_as_paid_button)
         view.add_item(cancel_button)
 
@@ -297,10 +2272,122 @@ class PaymentMethodDropdown(View):
             ephemeral=True
         )
 
+REVIEW_BATCH_SIZE = 10  # Embeds per message, Discord's limit
+REVIEW_BATCH_CHARS = 6000  # Embed text per message, also Discord's limit
+REVIEW_RETRY_BASE = 1.0  # Seconds before the first retry, doubled on each failure in a row
+REVIEW_RETRY_MAX = 60.0
+
+class ReviewOutbox:
+    # Reviews are saved to the store and acknowledged straight away, then posted in the background.
+    # A slow or rate limited reviews channel only delays the post, and anything still unsent is
+    # posted after a restart.
+    def __init__(self, store):
+        self.store = store
+        self.wakeup = None  # Created on the bot's event loop by start()
+        self.failures = {}  # channel id -> failed sends in a row
+        self.retry_at = {}  # channel id -> time.monotonic() before which the channel is left alone
+        self.started = False
+
+    async def post(self, guild_id, channel_id, embed):
+        await self.store.enqueue_review(guild_id, channel_id, json.dumps(embed.to_dict()), len(embed))
+        if self.wakeup:
+            self.wakeup.set()
+
+    def start(self):
+        if not self.started:
+            self.started = True
+            self.wakeup = asyncio.Event()
+            spawn(self.run())
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            try:
+                delay = await self.publish_pending()
+            except Exception as e:
+                print(f"Failed to publish reviews: {e}")
+                delay = REVIEW_RETRY_MAX
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def publish_pending(self):
+        # Returns the seconds until a channel that's backing off can be tried again, or None
+        next_retry = None
+        for row in await self.store.review_channels():
+            channel_id = row["channel_id"]
+            wait = self.retry_at.get(channel_id, 0) - time.monotonic()
+            if wait <= 0:
+                channel = bot.get_channel(channel_id)
+                if channel is None:
+                    if bot.get_guild(row["guild_id"]):
+                        # The guild is ours but the channel is gone, these can never be posted
+                        print(f"Reviews channel {channel_id} no longer exists, dropping its pending reviews")
+                        await self.store.delete_reviews([review["id"] for review in await self.store.pending_reviews(channel_id)])
+                    continue  # Otherwise the guild belongs to another cluster
+
+                # The lock keeps two clusters from posting the same rows while a guild changes hands
+                async with cluster_lock(f"reviews:{channel_id}") as locked:
+                    wait = await self.publish_channel(channel) if locked else None
+            if wait and wait > 0:
+                next_retry = wait if next_retry is None else min(next_retry, wait)
+        return next_retry
+
+    async def publish_channel(self, channel):
+        for batch in self.batches(await self.store.pending_reviews(channel.id)):
+            embeds = [discord.Embed.from_dict(json.loads(review["embed"])) for review in batch]
+            try:
+                await channel.send(embeds=embeds)
+            except discord.RateLimited as e:
+                # Discord said how long to wait, which beats guessing. Not an HTTPException subclass.
+                return self.back_off(channel.id, e.retry_after)
+            except discord.HTTPException as e:
+                if e.status in (400, 404):
+                    # Sending these again would fail the same way
+                    print(f"Dropping {len(batch)} reviews for channel {channel.id}: {e}")
+                else:
+                    # A 429 discord.py gave up retrying, missing permissions or a Discord outage, all worth waiting out
+                    return self.back_off(channel.id)
+            except (OSError, asyncio.TimeoutError):
+                return self.back_off(channel.id)
+            await self.store.delete_reviews([review["id"] for review in batch])
+            self.failures.pop(channel.id, None)
+            self.retry_at.pop(channel.id, None)
+        return None
+
+    def back_off(self, channel_id, retry_after=None):
+        failures = self.failures.get(channel_id, 0) + 1
+        self.failures[channel_id] = failures
+        delay = retry_after or min(REVIEW_RETRY_MAX, REVIEW_RETRY_BASE * 2 ** (failures - 1)) * random.uniform(1.0, 1.25)
+        self.retry_at[channel_id] = time.monotonic() + delay
+        return delay
+
+    @staticmethod
+    def batches(reviews):
+        batch = []
+        chars = 0
+        for review in reviews:
+            if batch and (len(batch) == REVIEW_BATCH_SIZE or chars + review["chars"] > REVIEW_BATCH_CHARS):
+                yield batch
+                batch = []
+                chars = 0
+            batch.append(review)
+            chars += review["chars"]
+        if batch:
+            yield batch
+
+review_outbox = ReviewOutbox(ticket_store)
+
 class ReviewModal(Modal, title="Leave a Review"):
     review = TextInput(label="Your Review", placeholder="Share your experience...", style=discord.TextStyle.long, required=True)
     stars = TextInput(label="Star Rating (1-5)", placeholder="Enter a number between 1 and 5", required=True)
 
+    def __init__(self, channel_id):
+        super().__init__(timeout=MODAL_TIMEOUT)
+        self.channel_id = channel_id
+
+    @instrumented("modal", "review")
     async def on_submit(self, interaction: discord.Interaction):
         try:
             stars = int(self.stars.value)
@@ -311,60 +2398,186 @@ class ReviewModal(Modal, title="Leave a Review"):
             await interaction.response.send_message("Invalid star rating. Please enter a number between 1 and 5.", ephemeral=True)
             return
 
-        reviews_channel = bot.get_channel(REVIEWS_CHANNEL_ID)
-        if reviews_channel:
+        config = await get_config(interaction)
+        reviews_channel_id = config["reviews_channel_id"]
+        reviews_channel = bot.get_channel(reviews_channel_id) if reviews_channel_id else None
+        if reviews_channel or not reviews_channel_id:
+            # One review per deal, so pressing Leave a Review again can't skew the ratings
+            if not await ticket_store.transition(self.channel_id, TICKET_COMPLETED, TICKET_REVIEWED):
+                await interaction.response.send_message("You have already left a review for this order.", ephemeral=True)
+                return
+            ticket_scheduler.touch(self.channel_id)
+
             user = interaction.user
-            cart = user_carts.get(user.id, {})
-            total_price = sum(stock[item]["price"] * quantity for item, quantity in cart.items())
-            payment_method = transaction_status[user.id]["payment_method"]
-
-            embed = discord.Embed(
-                title="New Review",
-                description=self.review.value,
-                color=discord.Color.green()
-            )
-            embed.set_author(name=user.display_name, icon_url=user.avatar.url)
-            embed.add_field(name="Items Purchased", value="\n".join([f"{item} x{quantity}" for item, quantity in cart.items()]), inline=False)
-            embed.add_field(name="Total Price", value=f"${total_price:.2f}", inline=False)
-            embed.add_field(name="Payment Method", value=payment_method, inline=False)
-            embed.add_field(name="Star Rating", value="⭐" * stars, inline=False)
-            embed.set_thumbnail(url=REVIEW_EMBED_IMAGE)  # Image in top-right
-
-            await reviews_channel.send(embed=embed)
+            if reviews_channel:
+                cart = await ticket_store.get_cart(self.channel_id)
+                ticket = await ticket_store.get_ticket(self.channel_id)
+                payment_method = ticket["payment_method"] if ticket else "Unknown"
+
+                embed = render_embed(config, "review")
+                embed.description = self.review.value
+                embed.set_author(name=user.display_name, icon_url=user.display_avatar.url)
+                embed.add_field(name="Items Purchased", value=cart.summary(), inline=False)
+                embed.add_field(name="Total Price", value=format_cents(cart.total_cents), inline=False)
+                embed.add_field(name="Payment Method", value=payment_method, inline=False)
+                embed.add_field(name="Star Rating", value="⭐" * stars, inline=False)
+
+                await asyncio.gather(
+                    review_outbox.post(interaction.guild_id, reviews_channel.id, embed),
+                    ticket_store.record_review(self.channel_id, interaction.guild_id, user.id, stars)
+                )
+            else:
+                # The guild hasn't set a reviews channel, the rating still counts but nothing is posted
+                await ticket_store.record_review(self.channel_id, interaction.guild_id, user.id, stars)
             await interaction.response.send_message("Thank you for your review!", ephemeral=True)
         else:
             await interaction.response.send_message("Reviews channel not found. Please contact an admin.", ephemeral=True)
 
 @bot.event
 async def on_ready():
+    global startup_reported, cluster_watcher_started, metrics_server_started
     print(f"Bot is online and ready. Logged in as {bot.user}")
+    connected_at = time.perf_counter()
 
-    # Sync all commands with Discord
-    try:
-        synced = await bot.tree.sync()
-        print(f"Synced {len(synced)} commands.")
-    except Exception as e:
-        print(f"Failed to sync commands: {e}")
+    # Sync commands with Discord, but only when they changed since the last sync. on_ready also
+    # fires after gateway reconnects, and every global sync counts against a tight rate limit.
+    # The command tree is the same in every cluster, so only the first one syncs it.
+    if CLUSTER_ID == 0:
+        try:
+            await sync_commands_if_changed()
+        except Exception as e:
+            print(f"Failed to sync commands: {e}")
+    synced_at = time.perf_counter()
+
+    # Posts anything left in the outbox before a restart, then waits for new reviews
+    review_outbox.start()
+    # Picks up the deadlines of every ticket still open, then keeps them from one timer
+    await ticket_scheduler.start()
+    if payment_watcher:
+        payment_watcher.start()
+
+    if METRICS_PORT and not metrics_server_started:
+        metrics_server_started = True
+        await start_metrics_server()
+
+    if CLUSTER_COUNT > 1 and not cluster_watcher_started:
+        cluster_watcher_started = True
+        spawn(watch_cluster_state())
+
+    if not startup_reported:
+        startup_reported = True
+        ready_at = time.perf_counter()
+        print(
+            f"Startup took {ready_at - startup_started:.2f}s: "
+            f"loading state {state_loaded_at - startup_started:.2f}s, "
+            f"connecting {connected_at - state_loaded_at:.2f}s, "
+            f"command sync {synced_at - connected_at:.2f}s"
+        )
+        # Mostly the scheduler loading every open ticket, kept apart so it isn't taken for sync time
+        print(f"Restoring tickets and starting background tasks took {ready_at - synced_at:.2f}s")
+
+cluster_watcher_started = False
+metrics_server_started = False
+
+async def metrics_endpoint(request):
+    return web.Response(text=await metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server():
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_endpoint)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    port = METRICS_PORT + CLUSTER_ID
+    await web.TCPSite(runner, METRICS_HOST, port).start()
+    print(f"Metrics at http://{METRICS_HOST}:{port}/metrics")
+
+@metrics.gauge("tickets", "Tickets in the store by status")
+async def tickets_gauge():
+    return {(("status", row["status"]),): row["tickets"] for row in await ticket_store.ticket_totals()}
+
+@metrics.gauge("cart_value_cents", "Value of the carts in the store by ticket status")
+async def cart_value_gauge():
+    return {(("status", row["status"]),): row["cents"] for row in await ticket_store.ticket_totals()}
+
+@metrics.gauge("cart_items", "Items in carts by ticket status, counting quantity")
+async def cart_items_gauge():
+    return {(("status", row["status"]),): row["quantity"] for row in await ticket_store.cart_totals()}
+
+@metrics.gauge("process", "State held by this process")
+async def process_gauge():
+    return {
+        (("state", "scheduled_tickets"),): len(ticket_scheduler.scheduled),
+        (("state", "closing_tickets"),): len(closing_tickets),
+        (("state", "queued_deals"),): sum(len(entries) for entries in admin_queue.entries.values()),
+        (("state", "background_tasks"),): len(background_tasks),
+        (("state", "held_locks"),): len(local_locks),
+        (("state", "rate_limit_buckets"),): sum(len(limiter.buckets) for limits in (interaction_limits, ticket_limits) for limiter in limits.values())
+    }
+
+async def reload_stock():
+    catalogs.catalogs.clear()  # Each guild's catalog is loaded again when it's next needed
+
+async def reload_guild_configs():
+    guild_configs.configs.clear()
+    prefix_router.guild_prefixes = await asyncio.to_thread(ticket_store.load_guild_prefixes)
+
+async def watch_cluster_state():
+    # Other clusters write stock, settings and deals to the shared files directly. Poll the
+    # generation counters and reload only what changed.
+    reloaders = {"stock": reload_stock, "guild_config": reload_guild_configs}
+    seen = await ticket_store.generations()
+    while True:
+        await asyncio.sleep(CLUSTER_SYNC_INTERVAL)
+        try:
+            generations = await ticket_store.generations()
+            for name, reload in reloaders.items():
+                if generations.get(name) != seen.get(name):
+                    await reload()
+            seen = generations
+            await asyncio.to_thread(deal_ledger.sync)
+        except Exception as e:
+            print(f"Failed to sync cluster state: {e}")
+
+def command_tree_hash(guild=None):
+    # Stable fingerprint of names, descriptions and parameter schemas
+    payload = []
+    for command in bot.tree.get_commands(guild=guild):
+        try:
+            payload.append(command.to_dict(bot.tree))
+        except TypeError:
+            payload.append(command.to_dict())  # Older discord.py takes no tree argument
+    payload.sort(key=lambda command: command["name"])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+async def sync_commands_if_changed():
+    guild = discord.Object(id=DEV_GUILD_ID) if DEV_GUILD_ID else None
+    if guild:
+        bot.tree.copy_global_to(guild=guild)
+
+    state_key = f"command_hash:{bot.user.id}:{DEV_GUILD_ID or 'global'}"
+    tree_hash = command_tree_hash(guild)
+    if await ticket_store.get_state(state_key) == tree_hash:
+        print("Commands unchanged, skipping sync.")
+        return
+
+    synced = await bot.tree.sync(guild=guild)
+    await ticket_store.set_state(state_key, tree_hash)
+    print(f"Synced {len(synced)} commands.")
 
 
 @bot.event
 async def on_message(message):
+    # Most messages aren't commands, the router turns those away before doing any other work
+    route = prefix_router.match(message)
+    if route is None:
+        return
+
     # Ignore messages from the bot itself
     if message.author == bot.user:
         return
 
-    # Handle prefix-based commands
-    if message.content.startswith(BOT_PREFIX):
-        # Extract the command and arguments
-        command = message.content[len(BOT_PREFIX):].split()[0]
-        args = message.content[len(BOT_PREFIX) + len(command):].strip()
-
-        # Example: Handle a prefix-based help command
-        if command == "help":
-            await message.channel.send("Use `/help` for a list of commands.")
-
-    # Ensure other events (like on_interaction) are still processed
-    await bot.process_commands(message)
+    handler, args = route
+    await handler(message, args)
 
 @bot.tree.command(name="help", description="Show all available commands.")
 async def help(interaction: discord.Interaction):
@@ -386,7 +2599,7 @@ async def help(interaction: discord.Interaction):
     )
 
     # Admin Commands
-    if interaction.user.id in ADMIN_IDS:
+    if await is_admin(interaction):
         embed.add_field(
             name="Admin Commands",
             value=(
@@ -394,10 +2607,20 @@ async def help(interaction: discord.Interaction):
                 "`/create_embed` - Create a custom embed.\n"
                 "`/add_item` - Add an item to the stock.\n"
                 "`/remove_item` - Remove an item from the stock.\n"
+                "`/stats` - Show sales and review statistics.\n"
+                "`/export_stats` - Download sales or reviews as CSV.\n"
+                "`/queue` - Show paid deals waiting for an admin.\n"
+                "`/set_queue_channel` - Post the live admin queue in a channel.\n"
                 "`/set_review_image` - Set the review embed image.\n"
+                "`/set_reviews_channel` - Set the reviews channel.\n"
+                "`/set_ticket_category` - Set the ticket category.\n"
+                "`/set_admin_role` - Toggle admin access for a role.\n"
+                "`/set_payment_details` - Set where buyers pay.\n"
                 "`/delete_all` - Delete all active tickets.\n"
                 "`/add` - Add a user to a ticket.\n"
                 "`/delete` - Delete the current ticket.\n"
+                "`/transcripts` - Find archived ticket transcripts.\n"
+                "`/metrics` - Download the bot's metrics.\n"
                 "`/change_prefix` - Change the bot's command prefix."
             ),
             inline=False
@@ -407,27 +2630,17 @@ async def help(interaction: discord.Interaction):
 
 @bot.tree.command(name="setup_embed", description="Set up the embed in the current channel. (Admin Only)")
 async def setup_embed(interaction: discord.Interaction):
-    if interaction.user.id not in ADMIN_IDS:
+    if not await is_admin(interaction):
         await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
         return
 
     global embed_message_id
 
-    embed = discord.Embed(
-        title=embed_title,
-        description=embed_description,
-        color=0x8000FF  
-    )
-
-    for field in embed_fields:
-        embed.add_field(name=field["name"], value=field["value"], inline=field["inline"])
-
-    embed.set_footer(text=embed_footer)
-    embed.set_thumbnail(url=REVIEW_EMBED_IMAGE)  # Image in top-right
+    embed = cached_embed(await get_config(interaction), "setup")
 
     purchase_button = Button(label="Purchase", style=discord.ButtonStyle.green, emoji="💸", custom_id="purchase")
 
-    view = View()
+    view = StatelessView()
     view.add_item(purchase_button)
 
     sent_message = await interaction.channel.send(embed=embed, view=view)
@@ -444,15 +2657,16 @@ async def create_embed(
     top_right_image: str = None,
     bottom_image: str = None
 ):
-    if interaction.user.id not in ADMIN_IDS:
+    if not await is_admin(interaction):
         await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
         return
 
     # Use default images if none are provided
+    config = await get_config(interaction)
     if not top_right_image:
-        top_right_image = REVIEW_EMBED_IMAGE
+        top_right_image = config["review_embed_image"]
     if not bottom_image:
-        bottom_image = BOTTOM_IMAGE_DEFAULT
+        bottom_image = config["bottom_image"]
 
     embed = discord.Embed(
         title=title,
@@ -467,65 +2681,238 @@ async def create_embed(
     await interaction.channel.send(embed=embed)
     await interaction.response.send_message("Custom embed created successfully!", ephemeral=True)
 
+async def catalog_autocomplete(interaction: discord.Interaction, current: str):
+    catalog = await catalogs.get(interaction.guild_id)
+    return [app_commands.Choice(name=name[:100], value=name) for name in catalog.search(current)]
+
+async def open_ticket_from_command(interaction):
+    # Same lock the purchase button takes, so a click and the command can't both open a ticket
+    async with cluster_lock(f"buyer:{interaction.user.id}") as locked:
+        if locked:
+            await handle_purchase(interaction, None)
+        else:
+            await interaction.followup.send("Your ticket is already being created.", ephemeral=True)
+
+@bot.tree.command(name="purchase", description="Start a purchase ticket, or add an item to your current ticket.")
+@app_commands.describe(item="Search the catalog for an item to add")
+@app_commands.autocomplete(item=catalog_autocomplete)
+async def purchase(interaction: discord.Interaction, item: str = None):
+    ticket = await ticket_store.get_ticket(interaction.channel.id)
+    if not ticket or ticket["buyer_id"] != interaction.user.id:
+        # Opening a ticket makes several REST calls, so like the Purchase button it's acknowledged
+        # first and run on the worker pool
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        job = answer_failures(interaction, partial(open_ticket_from_command, interaction))
+        if not worker_pool.submit(interaction.guild_id, "purchase", job):
+            await interaction.followup.send(WORKER_BUSY_MESSAGE, ephemeral=True)
+        return
+
+    catalog = await catalogs.get(interaction.guild_id)
+    if item is None:
+        view = ItemSelectionView(catalog, interaction.user.id, ticket["channel_id"])
+        await interaction.response.send_message("Please select an item to purchase:", view=view, ephemeral=True)
+    elif item not in catalog.items:
+        await interaction.response.send_message(f"Item **{item}** not found in stock.", ephemeral=True)
+    else:
+        await interaction.response.send_modal(QuantityModal(interaction.user.id, ticket["channel_id"], item))
+
 @bot.tree.command(name="add_item", description="Add an item to the stock. (Admin Only)")
-async def add_item(interaction: discord.Interaction, name: str, price: float, description: str):
-    if interaction.user.id not in ADMIN_IDS:
+@app_commands.guild_only()
+async def add_item(interaction: discord.Interaction, name: str, price: float, description: str, category: str = DEFAULT_CATEGORY):
+    if not await is_admin(interaction):
         await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
         return
 
-    global stock
+    if len(name) > MAX_ITEM_NAME_LENGTH:
+        await interaction.response.send_message(f"Item names can be at most {MAX_ITEM_NAME_LENGTH} characters.", ephemeral=True)
+        return
+    if len(category) > MAX_CATEGORY_LENGTH:
+        await interaction.response.send_message(f"Category names can be at most {MAX_CATEGORY_LENGTH} characters.", ephemeral=True)
+        return
+    if category.startswith(ALL_CATEGORIES):
+        await interaction.response.send_message(f"Category names can't start with {ALL_CATEGORIES}.", ephemeral=True)
+        return
 
-    stock[name] = {"price": price, "description": description}
+    price_cents = to_cents(price)
+    catalog = await catalogs.get(interaction.guild.id)
+    await ticket_store.put_stock_item(interaction.guild.id, name, price_cents, description, category)
+    catalog.add(name, {"price_cents": price_cents, "description": description, "category": category})
     await interaction.response.send_message(f"Added **{name}** to the stock.", ephemeral=True)
 
 @bot.tree.command(name="remove_item", description="Remove an item from the stock. (Admin Only)")
+@app_commands.guild_only()
+@app_commands.autocomplete(name=catalog_autocomplete)
 async def remove_item(interaction: discord.Interaction, name: str):
-    if interaction.user.id not in ADMIN_IDS:
+    if not await is_admin(interaction):
         await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
         return
 
-    global stock
-
-    if name in stock:
-        del stock[name]
+    catalog = await catalogs.get(interaction.guild.id)
+    if name in catalog.items:
+        await ticket_store.delete_stock_item(interaction.guild.id, name)
+        catalog.remove(name)
         await interaction.response.send_message(f"Removed **{name}** from the stock.", ephemeral=True)
     else:
         await interaction.response.send_message(f"Item **{name}** not found in stock.", ephemeral=True)
 
 @bot.tree.command(name="set_review_image", description="Set the image for review embeds. (Admin Only)")
 async def set_review_image(interaction: discord.Interaction, image_url: str):
-    if interaction.user.id not in ADMIN_IDS:
+    if not await is_admin(interaction):
         await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
         return
 
-    global REVIEW_EMBED_IMAGE
-    REVIEW_EMBED_IMAGE = image_url
+    if not interaction.guild:
+        await interaction.response.send_message("This command can only be used in a server.", ephemeral=True)
+        return
+
+    await guild_configs.update(interaction.guild.id, review_embed_image=image_url)
     await interaction.response.send_message(f"Review embed image updated to: {image_url}", ephemeral=True)
 
-@bot.tree.command(name="delete_all", description="Delete all active tickets in the ticket category. (Admin Only)")
-async def delete_all(interaction: discord.Interaction):
-    if interaction.user.id not in ADMIN_IDS:
+@bot.tree.command(name="set_reviews_channel", description="Set the channel reviews are posted in. (Admin Only)")
+@app_commands.guild_only()
+async def set_reviews_channel(interaction: discord.Interaction, channel: discord.TextChannel):
+    if not await is_admin(interaction):
         await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
         return
 
-    guild = interaction.guild
-    category = discord.utils.get(guild.categories, name=TICKET_CATEGORY_NAME)
+    await guild_configs.update(interaction.guild.id, reviews_channel_id=channel.id)
+    await interaction.response.send_message(f"Reviews will be posted in {channel.mention}.", ephemeral=True)
+
+@bot.tree.command(name="set_ticket_category", description="Set the category ticket channels are created in. (Admin Only)")
+@app_commands.guild_only()
+async def set_ticket_category(interaction: discord.Interaction, name: str):
+    if not await is_admin(interaction):
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+
+    name = name.strip()
+    if not name:
+        await interaction.response.send_message("The category name can't be empty.", ephemeral=True)
+        return
+
+    await guild_configs.update(interaction.guild.id, ticket_category_name=name)
+    # Resolved again on the next purchase. Pool channels stay in the old category and are no longer handed out.
+    ticket_categories.pop(interaction.guild.id, None)
+    ticket_pools.pop(interaction.guild.id, None)
+    await interaction.response.send_message(f"New tickets will be created in the `{name}` category.", ephemeral=True)
+
+@bot.tree.command(name="set_admin_role", description="Give or take away admin access for a role. (Admin Only)")
+@app_commands.guild_only()
+async def set_admin_role(interaction: discord.Interaction, role: discord.Role):
+    if not await is_admin(interaction):
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+
+    config = await get_config(interaction)
+    role_ids = set(config.admin_role_ids)
+    if role.id in role_ids:
+        role_ids.discard(role.id)
+        message = f"{role.mention} is no longer an admin role."
+    else:
+        role_ids.add(role.id)
+        message = f"{role.mention} is now an admin role."
+
+    await guild_configs.update(interaction.guild.id, admin_role_ids=sorted(role_ids))
+    await interaction.response.send_message(message, ephemeral=True)
+
+@bot.tree.command(name="set_payment_details", description="Set where buyers pay with a payment method. (Admin Only)")
+@app_commands.guild_only()
+@app_commands.describe(
+    method="The payment method",
+    details="The address for crypto, instructions for anything else. Leave out to stop offering the method."
+)
+@app_commands.choices(method=[app_commands.Choice(name=method, value=method) for method in PAYMENT_TITLES])
+async def set_payment_details(interaction: discord.Interaction, method: str, details: str = None):
+    if not await is_admin(interaction):
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+
+    config = await get_config(interaction)
+    payment_details = dict(config["payment_details"])
+    if details:
+        payment_details[method] = {"title": PAYMENT_TITLES[method], "address" if method in CRYPTO_METHODS else "description": details}
+        message = f"Buyers paying with {method} now see your details."
+    else:
+        payment_details.pop(method, None)
+        message = f"{method} is no longer offered."
+
+    await guild_configs.update(interaction.guild.id, payment_details=payment_details)
+    await interaction.response.send_message(message, ephemeral=True)
+
+CHANNEL_DELETE_CONCURRENCY = 5  # Ticket channels deleted at the same time by /delete_all
+DELETE_PROGRESS_INTERVAL = 2.0  # Seconds between progress updates
+
+# Ticket states selectable in /delete_all
+TICKET_STATE_FILTERS = {
+    "unpaid": (TICKET_OPEN, TICKET_AWAITING_PAYMENT),
+    "paid": (TICKET_PAID,),
+    "completed": (TICKET_COMPLETED, TICKET_REVIEWED)
+}
+
+async def delete_tickets(guild, tickets, on_progress):
+    semaphore = asyncio.Semaphore(CHANNEL_DELETE_CONCURRENCY)
+    counts = {"deleted": 0, "failed": 0}
+
+    async def delete_one(ticket):
+        # Any failure only costs this ticket, the rest still go and the admin still gets the count
+        async with semaphore:
+            channel = guild.get_channel(ticket["channel_id"])
+            try:
+                if channel:
+                    await archive_and_delete(channel, "Ticket cleanup")
+                else:
+                    await ticket_store.delete_ticket(ticket["channel_id"])
+                counts["deleted"] += 1
+            except Exception as e:
+                print(f"Failed to delete ticket {ticket['channel_id']}: {e!r}")
+                counts["failed"] += 1
+        await on_progress(counts)
+
+    await asyncio.gather(*(delete_one(ticket) for ticket in tickets))
+    return counts
+
+@bot.tree.command(name="delete_all", description="Delete all active tickets in the ticket category. (Admin Only)")
+@app_commands.describe(
+    state="Only delete tickets in this state",
+    older_than_hours="Only delete tickets with no activity for this many hours"
+)
+@app_commands.choices(state=[app_commands.Choice(name=name, value=name) for name in TICKET_STATE_FILTERS])
+@slow_command
+async def delete_all(interaction: discord.Interaction, state: str = None, older_than_hours: float = None):
+    if not await is_admin(interaction):
+        await interaction.followup.send("You do not have permission to use this command.", ephemeral=True)
+        return
 
-    if not category:
-        await interaction.response.send_message("Ticket category not found.", ephemeral=True)
+    updated_before = time.time() - older_than_hours * 3600 if older_than_hours else None
+    tickets = await ticket_store.tickets_for_guild(interaction.guild.id, TICKET_STATE_FILTERS.get(state), updated_before)
+    if not tickets:
+        await interaction.edit_original_response(content="No tickets matched.")
         return
 
-    deleted_count = 0
-    for channel in category.channels:
-        if isinstance(channel, discord.TextChannel) and channel.name.startswith("ticket-"):
-            await channel.delete()
-            deleted_count += 1
+    last_update = time.monotonic()
 
-    await interaction.response.send_message(f"Deleted {deleted_count} tickets.", ephemeral=True)
+    async def report_progress(counts):
+        nonlocal last_update
+        if time.monotonic() - last_update < DELETE_PROGRESS_INTERVAL:
+            return
+        last_update = time.monotonic()
+        done = counts["deleted"] + counts["failed"]
+        failed = f", {counts['failed']} failed" if counts["failed"] else ""
+        try:
+            await interaction.edit_original_response(content=f"Deleting tickets... {done}/{len(tickets)}{failed}")
+        except discord.HTTPException as e:
+            print(f"Failed to update /delete_all progress: {e}")  # The deletions carry on regardless
+
+    counts = await delete_tickets(interaction.guild, tickets, report_progress)
+
+    message = f"Deleted {counts['deleted']} tickets."
+    if counts["failed"]:
+        message += f" Failed to delete {counts['failed']}."
+    await interaction.edit_original_response(content=message)
 
 @bot.tree.command(name="add", description="Add a user to the current ticket. (Admin Only)")
 async def add(interaction: discord.Interaction, user: discord.Member):
-    if interaction.user.id not in ADMIN_IDS:
+    if not await is_admin(interaction):
         await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
         return
 
@@ -539,7 +2926,7 @@ async def add(interaction: discord.Interaction, user: discord.Member):
 
 @bot.tree.command(name="delete", description="Delete the current ticket. (Admin Only)")
 async def delete(interaction: discord.Interaction):
-    if interaction.user.id not in ADMIN_IDS:
+    if not await is_admin(interaction):
         await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
         return
 
@@ -548,211 +2935,1119 @@ async def delete(interaction: discord.Interaction):
         return
 
     await interaction.response.send_message("Deleting this ticket...", ephemeral=True)
-    await interaction.channel.delete()
+    await close_ticket(interaction.channel, "Ticket deleted by an admin")
+
+@bot.tree.command(name="metrics", description="Download the bot's metrics as JSON. (Admin Only)")
+async def metrics_dump(interaction: discord.Interaction):
+    if not await is_admin(interaction):
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+
+    data = json.dumps(await metrics.to_dict(), indent=2).encode()
+    await interaction.response.send_message(file=discord.File(io.BytesIO(data), filename="metrics.json"), ephemeral=True)
+
+@bot.tree.command(name="transcripts", description="Find archived ticket transcripts. (Admin Only)")
+@app_commands.guild_only()
+@app_commands.describe(user="Only tickets opened by this user", days="Only tickets closed in the last this many days")
+@slow_command
+async def transcripts(interaction: discord.Interaction, user: discord.User = None, days: int = None):
+    if not await is_admin(interaction):
+        await interaction.followup.send("You do not have permission to use this command.", ephemeral=True)
+        return
+
+    closed_after = time.time() - days * 86400 if days else None
+    rows = await ticket_store.find_transcripts(interaction.guild.id, user.id if user else None, closed_after)
+    if not rows:
+        await interaction.followup.send("No transcripts found.", ephemeral=True)
+        return
+
+    lines = []
+    files = []
+    upload_left = interaction.guild.filesize_limit
+    for row in rows:
+        buyer = f"<@{row['buyer_id']}>" if row["buyer_id"] else "Unknown buyer"
+        lines.append(f"<t:{int(row['closed_at'])}:f> {buyer}, {row['messages']} messages (`{row['channel_id']}`)")
+        # Attach as many of the files as fit in one upload
+        size = os.path.getsize(row["path"]) if os.path.exists(row["path"]) else None
+        if size is not None and size <= upload_left:
+            files.append(discord.File(row["path"], filename=os.path.basename(row["path"])))
+            upload_left -= size
+
+    await interaction.followup.send("\n".join(lines), files=files, ephemeral=True)
+
+@bot.tree.command(name="stats", description="Show sales and review statistics. (Admin Only)")
+@app_commands.guild_only()
+async def stats(interaction: discord.Interaction):
+    if not await is_admin(interaction):
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+
+    totals = await ticket_store.sales_report(interaction.guild.id)
+    summary = totals["summary"]
+    deals, revenue_cents = summary.get("deals", (0, 0))
+    buyers = summary.get("buyers", (0, 0))[0]
+    repeat_buyers = summary.get("repeat_buyers", (0, 0))[0]
+    reviews = summary.get("reviews", (0, 0))[0]
+    stars = summary.get("stars", (0, 0))[0]
+
+    embed = discord.Embed(title="Sales Statistics", color=0x8000FF)
+    embed.add_field(name="Deals", value=str(deals), inline=True)
+    embed.add_field(name="Revenue", value=format_cents(revenue_cents), inline=True)
+    embed.add_field(
+        name="Repeat Buyers",
+        value=f"{repeat_buyers}/{buyers} ({repeat_buyers / buyers:.0%})" if buyers else "None yet",
+        inline=True
+    )
+    embed.add_field(
+        name="Revenue by Payment Method",
+        value="\n".join(f"{method}: {format_cents(cents)} ({count})" for method, (count, cents) in totals["payment_method"].items()) or "None yet",
+        inline=False
+    )
+    embed.add_field(
+        name="Top Items",
+        value="\n".join(f"{item}: {format_cents(cents)} (x{count})" for item, (count, cents) in totals["item"].items()) or "None yet",
+        inline=False
+    )
+    embed.add_field(
+        name=f"Ratings ({stars / reviews:.2f} average)" if reviews else "Ratings",
+        value="\n".join(f"{'⭐' * rating}: {totals['stars'].get(str(rating), (0, 0))[0]}" for rating in range(5, 0, -1)),
+        inline=False
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="export_stats", description="Download every sale or review as CSV. (Admin Only)")
+@app_commands.guild_only()
+@app_commands.choices(table=[app_commands.Choice(name=name, value=name) for name in ("sales", "reviews")])
+@slow_command
+async def export_stats(interaction: discord.Interaction, table: str = "sales"):
+    if not await is_admin(interaction):
+        await interaction.followup.send("You do not have permission to use this command.", ephemeral=True)
+        return
+
+    export = await ticket_store.export_csv(table, interaction.guild.id)
+    try:
+        await interaction.followup.send(file=discord.File(export, filename=f"{table}.csv"), ephemeral=True)
+    finally:
+        export.close()
+
+@bot.tree.command(name="queue", description="Show paid deals waiting for an admin. (Admin Only)")
+@app_commands.guild_only()
+async def queue(interaction: discord.Interaction):
+    if not await is_admin(interaction):
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+
+    await interaction.response.send_message(embed=await admin_queue.embed(interaction.guild.id), ephemeral=True)
+
+@bot.tree.command(name="set_queue_channel", description="Post the live admin queue in a channel. (Admin Only)")
+@app_commands.guild_only()
+async def set_queue_channel(interaction: discord.Interaction, channel: discord.TextChannel):
+    if not await is_admin(interaction):
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+
+    try:
+        message = await channel.send(embed=await admin_queue.embed(interaction.guild.id))
+    except discord.Forbidden:
+        await interaction.response.send_message(f"I can't send messages in {channel.mention}.", ephemeral=True)
+        return
+    await guild_configs.update(interaction.guild.id, queue_channel_id=channel.id, queue_message_id=message.id)
+    await interaction.response.send_message(f"The admin queue will be kept up to date in {channel.mention}.", ephemeral=True)
 
 
 
 
 # Add this at the top of your code (with other global variables)
-BOT_PREFIX = "!"
+BOT_PREFIX = DEFAULT_GUILD_CONFIG["prefix"]  # Default for guilds that haven't set their own
+
+class PrefixRouter:
+    # Prefix commands are looked up here instead of going through bot.process_commands. Checking a
+    # message is one dict lookup and one startswith, and a command is only split once.
+    def __init__(self, default_prefix):
+        self.default_prefix = default_prefix
+        self.guild_prefixes = {}
+        self.commands = {}
+
+    def command(self, name):
+        def decorator(func):
+            self.commands[name] = instrumented("prefix", name)(func)
+            return func
+        return decorator
+
+    def load(self, saved_prefixes):
+        self.guild_prefixes.update(saved_prefixes)
+
+    def set_prefix(self, guild_id, prefix):
+        self.guild_prefixes[guild_id] = prefix
+
+    def match(self, message):
+        content = message.content
+        prefix = self.guild_prefixes.get(message.guild.id, self.default_prefix) if message.guild else self.default_prefix
+        if not content.startswith(prefix):
+            return None
+        name, _, args = content[len(prefix):].partition(" ")
+        handler = self.commands.get(name)
+        if handler is None:
+            return None
+        return handler, args.strip()
+
+prefix_router = PrefixRouter(BOT_PREFIX)
+prefix_router.load(ticket_store.load_guild_prefixes())
+
+@prefix_router.command("help")
+async def prefix_help(message, args):
+    await message.channel.send("Use `/help` for a list of commands.")
 
 @bot.tree.command(name="change_prefix", description="Change the bot's command prefix. (Admin Only)")
 async def change_prefix(interaction: discord.Interaction, new_prefix: str):
-    if interaction.user.id not in ADMIN_IDS:
+    if not await is_admin(interaction):
         await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
         return
 
-    global BOT_PREFIX
-    BOT_PREFIX = new_prefix
+    if not interaction.guild:
+        await interaction.response.send_message("This command can only be used in a server.", ephemeral=True)
+        return
+
+    new_prefix = new_prefix.strip()
+    if not new_prefix:
+        await interaction.response.send_message("The prefix can't be empty.", ephemeral=True)
+        return
+
+    # Prefixes are per guild now
+    await guild_configs.update(interaction.guild.id, prefix=new_prefix)
+    prefix_router.set_prefix(interaction.guild.id, new_prefix)
+
+    await interaction.response.send_message(f"Command prefix changed to `{new_prefix}`.", ephemeral=True)
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+# Background tasks are kept referenced here so they don't get garbage collected mid-flight
+background_tasks = set()
+
+def spawn(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+ticket_categories = {}  # guild_id -> ticket category id
+ticket_category_locks = {}  # guild_id -> lock so a rush of purchases creates only one category
+ticket_pools = {}  # guild_id -> ids of pre-created channels ready to be claimed
+ticket_pool_refills = set()  # guild ids with a refill in flight
+
+def ticket_overwrites(guild, user=None):
+    overwrites = {
+        guild.default_role: discord.PermissionOverwrite(read_messages=False),
+        guild.me: discord.PermissionOverwrite(read_messages=True, send_messages=True)
+    }
+    if user:
+        overwrites[user] = discord.PermissionOverwrite(read_messages=True, send_messages=True)
+    return overwrites
+
+async def get_ticket_category(guild):
+    # Resolved once per guild, after that it's a cache lookup instead of a scan over guild.categories
+    category = guild.get_channel(ticket_categories.get(guild.id, 0))
+    if category:
+        return category
+
+    async with ticket_category_locks.setdefault(guild.id, asyncio.Lock()):
+        category = guild.get_channel(ticket_categories.get(guild.id, 0))
+        if category:
+            return category
+
+        category_name = (await guild_configs.get(guild.id))["ticket_category_name"]
+        category = discord.utils.get(guild.categories, name=category_name)
+        if not category:
+            category = await guild.create_category(category_name)
+        ticket_categories[guild.id] = category.id
+
+        # Adopt pool channels created before a restart
+        ticket_pools[guild.id] = [channel.id for channel in category.text_channels if channel.name == TICKET_POOL_CHANNEL_NAME]
+        return category
+
+async def open_ticket_channel(guild, category, user):
+    # Claim a pre-created channel if one is ready, otherwise create one with the permissions already set
+    pool = ticket_pools.setdefault(guild.id, [])
+    ticket_channel = None
+    while pool and not ticket_channel:
+        ticket_channel = guild.get_channel(pool.pop())
+
+    if ticket_channel:
+        await ticket_channel.edit(name=f"ticket-{user.name}", overwrites=ticket_overwrites(guild, user), reason="Purchase ticket")
+    else:
+        ticket_channel = await guild.create_text_channel(
+            name=f"ticket-{user.name}",
+            category=category,
+            overwrites=ticket_overwrites(guild, user),
+            reason="Purchase ticket"
+        )
+
+    if guild.id not in ticket_pool_refills:
+        ticket_pool_refills.add(guild.id)
+        spawn(refill_ticket_pool(guild, category))
+    return ticket_channel
+
+async def refill_ticket_pool(guild, category):
+    try:
+        pool = ticket_pools.setdefault(guild.id, [])
+        missing = TICKET_POOL_SIZE - len(pool)
+        if missing <= 0:
+            return
+        channels = await asyncio.gather(
+            *(
+                guild.create_text_channel(name=TICKET_POOL_CHANNEL_NAME, category=category, overwrites=ticket_overwrites(guild), reason="Ticket pool")
+                for _ in range(missing)
+            ),
+            return_exceptions=True
+        )
+        pool.extend(channel.id for channel in channels if isinstance(channel, discord.TextChannel))
+    finally:
+        ticket_pool_refills.discard(guild.id)
+
+# Ticket lifecycle. Each stage gets a reminder and an automatic close, both counted from the
+# ticket's last activity. None turns either off. Paid tickets are waiting on an admin, so they
+# are left alone.
+TICKET_DEADLINES = {
+    TICKET_OPEN: (30 * 60, 2 * 3600),
+    "item_selected": (3600, 6 * 3600),  # Open with something in the cart
+    TICKET_AWAITING_PAYMENT: (3600, 24 * 3600),
+    TICKET_PAID: (None, None),
+    TICKET_COMPLETED: (6 * 3600, 48 * 3600),
+    TICKET_REVIEWED: (None, 3600)
+}
+TICKET_REMINDERS = {
+    TICKET_OPEN: "{mention}, your ticket has been quiet for a while. Pick an item, or it will close {close}.",
+    "item_selected": "{mention}, your cart is still waiting. Click **Done** to check out, or this ticket will close {close}.",
+    TICKET_AWAITING_PAYMENT: "{mention}, we haven't seen your payment yet. Click **Mark as Paid** once it's sent, or this ticket will close {close}.",
+    TICKET_COMPLETED: "{mention}, thanks for your purchase! Please leave a review, this ticket will close {close}."
+}
+TICKET_CLOSE_RETRY = 600  # Seconds before trying again when a ticket couldn't be archived or deleted
+TRANSCRIPT_DIR = os.path.join(DATA_DIR, "transcripts")
+
+def ticket_stage(ticket):
+    if ticket["status"] == TICKET_OPEN and ticket["total_cents"] > 0:
+        return "item_selected"
+    return ticket["status"]
+
+class TicketScheduler:
+    # Every ticket's next deadline sits in one heap watched by one task, so an idle ticket costs a
+    # heap entry instead of a sleeping task. Nothing is rescheduled when a ticket sees activity.
+    # When an entry comes due the ticket is read again, and if it has been active since, it goes
+    # back on the heap with its new deadline.
+    def __init__(self):
+        self.heap = []  # (due, channel_id)
+        self.scheduled = {}  # channel_id -> due of its live heap entry, any other entry is stale
+        self.reminders = {}  # channel_id -> (reminder message id, last activity it was sent for)
+        self.wakeup = None
+        self.started = False
+
+    async def start(self):
+        if self.started:
+            return
+        self.started = True
+        self.wakeup = asyncio.Event()
+        for status in TICKET_DEADLINES:
+            if status == "item_selected":
+                continue  # Stored as open
+            for ticket in await ticket_store.tickets_with_status(status):
+                if bot.get_guild(ticket["guild_id"]):  # Other clusters schedule their own guilds
+                    self.schedule_ticket(ticket, ticket["updated_at"])
+        spawn(self.run())
+
+    def schedule(self, channel_id, due):
+        if self.scheduled.get(channel_id) == due:
+            return
+        self.scheduled[channel_id] = due
+        heapq.heappush(self.heap, (due, channel_id))
+        if self.wakeup and self.heap[0] == (due, channel_id):
+            self.wakeup.set()  # New earliest deadline
+
+    def schedule_ticket(self, ticket, activity):
+        remind_after, close_after = TICKET_DEADLINES.get(ticket_stage(ticket), (None, None))
+        deadlines = []
+        reminder = self.reminders.get(ticket["channel_id"])
+        if remind_after is not None and (reminder is None or reminder[1] != activity):
+            deadlines.append(activity + remind_after)
+        if close_after is not None:
+            deadlines.append(activity + close_after)
+        if deadlines:
+            self.schedule(ticket["channel_id"], min(deadlines))
+        else:
+            self.scheduled.pop(ticket["channel_id"], None)
+
+    def touch(self, channel_id):
+        # A ticket changed stage, look at it again straight away
+        self.schedule(channel_id, time.time())
+
+    def forget(self, channel_id):
+        self.scheduled.pop(channel_id, None)
+        self.reminders.pop(channel_id, None)
+
+    def last_activity(self, ticket, channel):
+        activity = ticket["updated_at"]
+        reminder = self.reminders.get(ticket["channel_id"])
+        if reminder and channel.last_message_id == reminder[0]:
+            return max(activity, reminder[1])  # Our own reminder doesn't count
+        if channel.last_message_id:
+            activity = max(activity, discord.utils.snowflake_time(channel.last_message_id).timestamp())
+        return activity
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            while self.heap and self.heap[0][0] <= time.time():
+                due, channel_id = heapq.heappop(self.heap)
+                if self.scheduled.get(channel_id) != due:
+                    continue  # Superseded
+                del self.scheduled[channel_id]
+                try:
+                    await self.check(channel_id)
+                except Exception as e:
+                    print(f"Failed to check ticket {channel_id}: {e}")
+                    self.schedule(channel_id, time.time() + TICKET_CLOSE_RETRY)
+
+            delay = self.heap[0][0] - time.time() if self.heap else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
 
-    # Update the bot's command prefix
-    bot.command_prefix = BOT_PREFIX
+    async def check(self, channel_id):
+        ticket = await ticket_store.get_ticket(channel_id)
+        if not ticket:
+            self.forget(channel_id)
+            return
+        channel = bot.get_channel(channel_id)
+        if channel is None:
+            if bot.get_guild(ticket["guild_id"]):
+                await ticket_store.delete_ticket(channel_id)  # The channel was deleted by hand
+            self.forget(channel_id)
+            return
 
-    await interaction.response.send_message(f"Command prefix changed to `{BOT_PREFIX}`.", ephemeral=True)
+        stage = ticket_stage(ticket)
+        remind_after, close_after = TICKET_DEADLINES.get(stage, (None, None))
+        activity = self.last_activity(ticket, channel)
+        idle = time.time() - activity
 
+        if close_after is not None and idle >= close_after:
+            await close_ticket(channel, "Closed after inactivity")
+            # Look again later. By then the ticket is gone, unless archiving or deleting it failed.
+            self.schedule(channel_id, time.time() + TICKET_CLOSE_RETRY)
+            return
 
+        reminder = self.reminders.get(channel_id)
+        if remind_after is not None and idle >= remind_after and stage in TICKET_REMINDERS and (reminder is None or reminder[1] != activity):
+            message = await channel.send(TICKET_REMINDERS[stage].format(
+                mention=f"<@{ticket['buyer_id']}>",
+                close=f"<t:{int(activity + close_after)}:R>"
+            ))
+            self.reminders[channel_id] = (message.id, activity)
+
+        self.schedule_ticket(ticket, activity)
+
+ticket_scheduler = TicketScheduler()
+
+TRANSCRIPT_PAGE_SIZE = 100  # Messages written per batch, the same as one history request returns
+
+def transcript_record(message):
+    record = {
+        "id": message.id,
+        "author_id": message.author.id,
+        "author": str(message.author),
+        "at": message.created_at.timestamp(),
+        "content": message.content
+    }
+    if message.attachments:
+        # References only, the files stay on Discord's CDN
+        record["attachments"] = [
+            {"filename": attachment.filename, "url": attachment.url, "size": attachment.size, "content_type": attachment.content_type}
+            for attachment in message.attachments
+        ]
+    if message.embeds:
+        record["embeds"] = [embed.to_dict() for embed in message.embeds]  # Payment details, admin decisions
+    return record
+
+async def archive_transcript(channel):
+    # Streams the history into gzip-compressed NDJSON one page at a time, oldest first, so memory
+    # stays flat however long the ticket ran. Compression and disk writes happen off the event loop.
+    ticket = await ticket_store.get_ticket(channel.id)
+    directory = os.path.join(TRANSCRIPT_DIR, str(channel.guild.id))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{channel.id}.ndjson.gz")
+
+    file = await asyncio.to_thread(gzip.open, path + ".tmp", "wt", encoding="utf-8")
+    messages = 0
+    page = []
+    try:
+        async for message in channel.history(limit=None, oldest_first=True):
+            page.append(json.dumps(transcript_record(message), separators=(",", ":")))
+            if len(page) == TRANSCRIPT_PAGE_SIZE:
+                await asyncio.to_thread(file.write, "\n".join(page) + "\n")
+                messages += len(page)
+                page = []
+        if page:
+            await asyncio.to_thread(file.write, "\n".join(page) + "\n")
+            messages += len(page)
+    finally:
+        await asyncio.to_thread(file.close)
+    os.replace(path + ".tmp", path)
+
+    await ticket_store.add_transcript(
+        channel.id,
+        channel.guild.id,
+        ticket["buyer_id"] if ticket else None,
+        path,
+        messages,
+        ticket["created_at"] if ticket else channel.created_at.timestamp(),
+        time.time()
+    )
+    return path
 
+async def archive_and_delete(channel, reason):
+    # The transcript is saved before the channel goes. If either step fails the ticket row stays,
+    # and the lifecycle scheduler tries again later.
+    await archive_transcript(channel)
+    await rest_buckets["channel_delete"].take()
+    try:
+        await channel.delete(reason=reason)
+    except discord.NotFound:
+        pass  # Already gone
+    await ticket_store.delete_ticket(channel.id)
+    ticket_scheduler.forget(channel.id)
+    admin_queue.forget(channel.guild.id, channel.id)
+
+closing_tickets = set()  # Channel ids being archived and deleted in the background
+
+async def close_ticket(channel, reason):
+    # Hides the channel from the buyer straight away, the archive and the delete follow in the background
+    if channel.id in closing_tickets:
+        return
+    closing_tickets.add(channel.id)
+    try:
+        await channel.edit(overwrites=ticket_overwrites(channel.guild), reason=reason)
+    except discord.HTTPException:
+        pass  # Still gets archived and deleted
+    spawn(finish_closing(channel, reason))
 
+async def finish_closing(channel, reason):
+    try:
+        await archive_and_delete(channel, reason)
+    except Exception as e:
+        print(f"Failed to close ticket {channel.id}: {e}")
+    finally:
+        closing_tickets.discard(channel.id)
+
+QUEUE_PRIORITY_WINDOW = 300  # Seconds. Deals paid within the same window go biggest first, otherwise oldest first.
+QUEUE_DASHBOARD_DELAY = 5.0  # Seconds a dashboard waits after a change, so a burst of changes makes one edit
+QUEUE_DASHBOARD_SIZE = 20  # Deals listed on the dashboard and in /queue
+
+def queue_key(entry):
+    return (int(entry["paid_at"] // QUEUE_PRIORITY_WINDOW), -entry["total_cents"], entry["paid_at"], entry["channel_id"])
+
+class AdminQueue:
+    # Paid tickets waiting for an admin, one sorted list per guild so the next deal is always at the
+    # front. A guild's queue is loaded from the store the first time it's needed, then kept in step
+    # with it. Every guild is served by a single cluster, so no other process changes its rows.
+    def __init__(self, store):
+        self.store = store
+        self.queues = {}  # guild_id -> sorted queue_key of every waiting deal
+        self.entries = {}  # guild_id -> {channel_id: work_queue row}
+        self.dashboard_updates = {}  # guild_id -> pending dashboard refresh
+
+    async def load(self, guild_id):
+        if guild_id not in self.entries:
+            rows = await self.store.work_queue(guild_id)
+            if guild_id not in self.entries:  # Another caller may have loaded it meanwhile
+                self.entries[guild_id] = {row["channel_id"]: row for row in rows}
+                self.queues[guild_id] = sorted(queue_key(row) for row in rows)
+        return self.entries[guild_id]
+
+    async def add(self, ticket, total_cents):
+        guild_id = ticket["guild_id"]
+        entries = await self.load(guild_id)
+        entry = await self.store.enqueue_work(ticket["channel_id"], guild_id, ticket["buyer_id"], total_cents)
+        if entry["channel_id"] not in entries:
+            entries[entry["channel_id"]] = entry
+            bisect.insort(self.queues[guild_id], queue_key(entry))
+        self.changed(guild_id)
+
+    async def remove(self, guild_id, channel_id):
+        await self.store.complete_work(channel_id)
+        self.forget(guild_id, channel_id)
+
+    def forget(self, guild_id, channel_id):
+        entry = self.entries.get(guild_id, {}).pop(channel_id, None)
+        if entry is None:
+            return
+        queue = self.queues[guild_id]
+        del queue[bisect.bisect_left(queue, queue_key(entry))]
+        self.changed(guild_id)
 
+    async def get(self, guild_id, channel_id):
+        return (await self.load(guild_id)).get(channel_id)
 
+    async def claim(self, guild_id, channel_id, admin_id):
+        entry = await self.get(guild_id, channel_id)
+        if entry is None or not await self.store.claim_work(channel_id, admin_id):
+            return False
+        entry["claimed_by"], entry["claimed_at"] = admin_id, time.time()
+        self.changed(guild_id)
+        return True
 
+    async def release(self, guild_id, channel_id, admin_id):
+        entry = await self.get(guild_id, channel_id)
+        if entry is None or not await self.store.release_work(channel_id, admin_id):
+            return False
+        entry["claimed_by"], entry["claimed_at"] = None, None
+        self.changed(guild_id)
+        return True
+
+    async def embed(self, guild_id):
+        entries = await self.load(guild_id)
+        lines = []
+        for position, key in enumerate(self.queues[guild_id][:QUEUE_DASHBOARD_SIZE], 1):
+            entry = entries[key[-1]]
+            claimed = f"claimed by <@{entry['claimed_by']}>" if entry["claimed_by"] else "unclaimed"
+            lines.append(
+                f"{position}. <#{entry['channel_id']}> {format_cents(entry['total_cents'])} "
+                f"paid <t:{int(entry['paid_at'])}:R> by <@{entry['buyer_id']}>, {claimed}"
+            )
+        embed = discord.Embed(
+            title="Admin Queue",
+            description="\n".join(lines) or "No deals are waiting.",
+            color=0x8000FF,
+            timestamp=discord.utils.utcnow()
+        )
+        waiting = len(entries)
+        unclaimed = sum(1 for entry in entries.values() if not entry["claimed_by"])
+        embed.set_footer(text=f"{waiting} waiting, {unclaimed} unclaimed")
+        return embed
 
+    def changed(self, guild_id):
+        if guild_id not in self.dashboard_updates:
+            self.dashboard_updates[guild_id] = spawn(self.update_dashboard(guild_id))
 
+    async def update_dashboard(self, guild_id):
+        # The dashboard message is edited in place. It's only posted again if someone deleted it.
+        try:
+            await asyncio.sleep(QUEUE_DASHBOARD_DELAY)
+        finally:
+            del self.dashboard_updates[guild_id]  # Changes from here on schedule another refresh
 
+        config = await guild_configs.get(guild_id)
+        channel = bot.get_channel(config["queue_channel_id"]) if config["queue_channel_id"] else None
+        if channel is None:
+            return
+        embed = await self.embed(guild_id)
+        try:
+            if config["queue_message_id"]:
+                try:
+                    await channel.get_partial_message(config["queue_message_id"]).edit(embed=embed)
+                    return
+                except discord.NotFound:
+                    pass
+            message = await channel.send(embed=embed)
+            await guild_configs.update(guild_id, queue_message_id=message.id)
+        except discord.HTTPException as e:
+            print(f"Failed to update the admin queue in guild {guild_id}: {e}")
+
+admin_queue = AdminQueue(ticket_store)
+
+# On-chain payments. Each crypto ticket gets its own deposit address from the chain backend, and
+# the watcher marks the ticket paid once enough has arrived there. Mark as Paid still works for
+# everything else, and as a fallback.
+PAYMENT_BACKEND = os.environ.get("PAYMENT_BACKEND")  # Unset keeps each guild's fixed addresses from /set_payment_details
+PAYMENT_POLL_INTERVAL = 30.0  # Seconds between polls
+DEPOSIT_WATCH_AFTER_CLOSE = 7 * 24 * 3600  # Seconds a closed ticket's address is still watched for late payments
+PAYMENT_CONFIRMATIONS = {"BTC": 2, "ETH": 12, "LTC": 6}  # Confirmations before a payment counts
+PAYMENT_POLL_CONCURRENCY = 4  # Backend requests in flight at once during a poll
+PAYMENT_CREDIT_CONCURRENCY = 10  # Payments being credited at once, each posts in its ticket
+
+class PaymentBackend(ABC):
+    # Interface for a chain backend. poll() takes a whole batch of addresses, so watching many
+    # tickets costs one request per batch rather than one per ticket.
+    batch_size = 100
+
+    @abstractmethod
+    def derive_address(self, coin, index):
+        ...
+
+    @abstractmethod
+    async def poll(self, coin, addresses):
+        # Returns [{"txid", "address", "value_cents", "confirmations"}] for payments to any of the addresses
+        ...
+
+class MockPaymentBackend(PaymentBackend):
+    # Offline stand-in. Addresses are made up and the only payments are the ones passed to send().
+    batch_size = 1000
+
+    def __init__(self):
+        self.transactions = {}  # address -> list of payments
+
+    def derive_address(self, coin, index):
+        return f"mock-{coin.lower()}-{index}"
+
+    def send(self, address, value_cents, confirmations=100):
+        payments = self.transactions.setdefault(address, [])
+        payments.append({
+            "txid": f"mock-tx-{address}-{len(payments)}",
+            "address": address,
+            "value_cents": value_cents,
+            "confirmations": confirmations
+        })
+
+    async def poll(self, coin, addresses):
+        return [payment for address in addresses for payment in self.transactions.get(address, ())]
+
+payment_backends = {"mock": MockPaymentBackend}
+
+class PaymentWatcher:
+    # Every cycle reads the unpaid deposits for this process's guilds (a partial index keeps that
+    # cheap), polls the backend in batches per coin and matches payments back through the address.
+    def __init__(self, store, backend):
+        self.store = store
+        self.backend = backend
+        self.started = False
+
+    def start(self):
+        if not self.started:
+            self.started = True
+            spawn(self.run())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(PAYMENT_POLL_INTERVAL)
+            try:
+                await self.poll()
+            except Exception as e:
+                print(f"Failed to poll payments: {e}")
+
+    async def poll(self):
+        guild_ids = [guild.id for guild in bot.guilds]
+        addresses = {}  # coin -> {address: channel_id}
+        for deposit in await self.store.pending_deposits(guild_ids, time.time() - DEPOSIT_WATCH_AFTER_CLOSE):
+            addresses.setdefault(deposit["coin"], {})[deposit["address"]] = deposit["channel_id"]
+
+        # Batches and payments don't depend on each other. One after another, a cycle over tens of
+        # thousands of deposits with a few hundred payments would outlast PAYMENT_POLL_INTERVAL.
+        polls = asyncio.Semaphore(PAYMENT_POLL_CONCURRENCY)
+        credits = asyncio.Semaphore(PAYMENT_CREDIT_CONCURRENCY)
+
+        async def credit(payment):
+            async with credits:
+                await self.credit(payment)
+
+        async def poll_batch(coin, index, batch):
+            async with polls:
+                payments = await self.backend.poll(coin, batch)
+            await asyncio.gather(*(
+                credit(payment) for payment in payments
+                if payment["address"] in index and payment["confirmations"] >= PAYMENT_CONFIRMATIONS.get(coin, 1)
+            ))
+
+        batches = []
+        for coin, index in addresses.items():
+            batch_list = list(index)
+            for start in range(0, len(batch_list), self.backend.batch_size):
+                batches.append(poll_batch(coin, index, batch_list[start:start + self.backend.batch_size]))
+        await asyncio.gather(*batches)
+
+    async def credit(self, payment):
+        deposit = await self.store.credit_deposit(payment["txid"], payment["address"], payment["value_cents"])
+        if not deposit:
+            return  # Already counted, or not enough yet
+
+        channel_id = deposit["channel_id"]
+        if not await self.store.transition(channel_id, TICKET_AWAITING_PAYMENT, TICKET_PAID):
+            ticket = await self.store.get_ticket(channel_id)
+            if not ticket or ticket["status"] != TICKET_PAID:
+                await self.report_unmatched(deposit)  # Closed, or already done with
+            return  # Otherwise the buyer pressed Mark as Paid first
+        ticket_scheduler.touch(channel_id)
+
+        ticket = await self.store.get_ticket(channel_id)
+        if not ticket:
+            return
+        cart = await self.store.get_cart(channel_id)
+        await admin_queue.add(ticket, cart.total_cents)
+
+        channel = bot.get_channel(channel_id)
+        if channel:
+            embed = paid_embed(
+                await guild_configs.get(ticket["guild_id"]),
+                ticket,
+                cart,
+                f"Payment of {format_cents(deposit['received_cents'])} in {deposit['coin']} was received."
+            )
+            await channel.send(embed=embed)
+            await channel.send(
+                "Payment confirmed on-chain. Waiting for admin to complete the deal.",
+                view=deal_completed_view(ticket["buyer_id"], channel_id)
+            )
 
+    async def report_unmatched(self, deposit):
+        # Money arrived for a ticket that isn't waiting for it any more. It's recorded against the
+        # deposit either way, and the admins are told so they can sort it out with the buyer.
+        message = (
+            f"A payment of {format_cents(deposit['received_cents'])} in {deposit['coin']} arrived at `{deposit['address']}` "
+            f"for ticket {deposit['channel_id']} (buyer <@{deposit['buyer_id']}>), which is no longer waiting for payment."
+        )
+        print(message)
+        config = await guild_configs.get(deposit["guild_id"])
+        channel = bot.get_channel(config["queue_channel_id"]) if config["queue_channel_id"] else None
+        if channel:
+            await channel.send(message)
+
+payment_watcher = PaymentWatcher(ticket_store, payment_backends[PAYMENT_BACKEND]()) if PAYMENT_BACKEND else None
+
+async def get_owned_ticket(interaction, channel_id=None):
+    # The ticket behind the channel this interaction came from, if it belongs to the user
+    ticket = await ticket_store.get_ticket(channel_id or interaction.channel.id)
+    if not ticket or ticket["buyer_id"] != interaction.user.id:
+        await interaction.response.send_message("This can only be used in your own ticket.", ephemeral=True)
+        return None
+    return ticket
+
+async def get_editable_ticket(interaction, channel_id=None, cart=True):
+    # The user's ticket, if its payment method and, with cart=True, its items can still change.
+    # The items are fixed once a deposit address has been issued for their total.
+    ticket = await get_owned_ticket(interaction, channel_id)
+    if ticket and ticket["status"] not in CART_EDITABLE_STATUSES:
+        await interaction.response.send_message("This order has already been paid and can't be changed.", ephemeral=True)
+        return None
+    if ticket and cart and ticket["status"] == TICKET_AWAITING_PAYMENT and await ticket_store.open_deposit(ticket["channel_id"]):
+        await interaction.response.send_message(
+            "A payment address has been issued for this order, so its items can't change. Cancel the ticket to start over.",
+            ephemeral=True
+        )
+        return None
+    return ticket
 
+async def dispatch_component(interaction):
+    try:
+        payload = decode_custom_id(interaction.data["custom_id"])
+    except ValueError:
+        return  # Not one of ours
+    handler = component_handlers.get(payload.action)
+    if handler is None:
+        return  # Handled by a View callback instead
+
+    # One click at a time per ticket, across every cluster
+    if component_lock_scopes[payload.action] == "buyer":
+        lock_name = f"buyer:{interaction.user.id}"
+    else:
+        lock_name = f"ticket:{payload.ticket_id or interaction.channel_id}"
 
+    async def run_handler():
+        async with cluster_lock(lock_name) as locked:
+            if not locked:
+                await respond(interaction, "This ticket is busy, please try again in a moment.", ephemeral=True)
+            else:
+                await handler(interaction, payload)
 
+    started = time.perf_counter()
+    failed = True
+    try:
+        if payload.action in deferred_actions:
+            precheck = component_prechecks.get(payload.action)
+            if precheck is None or not await precheck(interaction, payload):
+                # Acknowledge inside Discord's 3 seconds, the answer follows once a worker gets to it
+                await interaction.response.defer()
+                if not worker_pool.submit(interaction.guild_id, payload.action, answer_failures(interaction, run_handler)):
+                    await interaction.followup.send(WORKER_BUSY_MESSAGE, ephemeral=True)
+        else:
+            await run_handler()
+        failed = False
+    finally:
+        record_handler("component", payload.action, time.perf_counter() - started, failed)
 
+@bot.event
+async def on_app_command_completion(interaction, command):
+    started = interaction.extras.get("started")
+    if started is not None:
+        record_handler("command", command.qualified_name, time.perf_counter() - started, False)
 
 @bot.event
 async def on_interaction(interaction: discord.Interaction):
-    if interaction.type == discord.InteractionType.component:
-        if 'custom_id' in interaction.data:
-            custom_id = interaction.data['custom_id']
-            user_id = interaction.user.id
-
-            if custom_id == "purchase":
-                user = interaction.user
-                guild = interaction.guild
-
-                # Find or create the ticket category
-                category = discord.utils.get(guild.categories, name=TICKET_CATEGORY_NAME)
-                if not category:
-                    category = await guild.create_category(TICKET_CATEGORY_NAME)
-
-                # Create the ticket channel
-                ticket_channel = await guild.create_text_channel(
-                    name=f"ticket-{user.name}",
-                    category=category,
-                    reason="Purchase ticket"
-                )
+    if interaction.type == discord.InteractionType.component and "custom_id" in interaction.data:
+        if await check_interaction_rate(interaction):
+            await dispatch_component(interaction)
+
+async def point_at_existing_ticket(interaction, payload):
+    # Repeated clicks from someone who already has a ticket are most of a Purchase spam burst.
+    # Answering them here keeps them off the worker pool, where they would hold up real purchases.
+    # handle_purchase checks again under the buyer lock and cleans up tickets whose channel is gone.
+    guild = interaction.guild
+    if guild is None:
+        return False
+    ticket = await ticket_store.open_ticket_for_buyer(guild.id, interaction.user.id)
+    if not ticket or not guild.get_channel(ticket["channel_id"]):
+        return False
+    await interaction.response.send_message(f"You already have an open ticket: <#{ticket['channel_id']}>", ephemeral=True)
+    return True
+
+@component_handler("purchase", lock="buyer", defer=True, precheck=point_at_existing_ticket)
+async def handle_purchase(interaction, payload):
+    user = interaction.user
+    guild = interaction.guild
+    if guild is None:
+        await respond(interaction, "Purchases can only be made in a server.", ephemeral=True)
+        return
 
-                # Set permissions for the ticket channel
-                await ticket_channel.set_permissions(user, read_messages=True, send_messages=True)
-                await ticket_channel.set_permissions(guild.default_role, read_messages=False)
+    # One open ticket per user. Point them back at it instead of opening another.
+    ticket = await ticket_store.open_ticket_for_buyer(guild.id, user.id)
+    if ticket:
+        if guild.get_channel(ticket["channel_id"]):
+            await respond(interaction, f"You already have an open ticket: <#{ticket['channel_id']}>", ephemeral=True)
+            return
+        await ticket_store.delete_ticket(ticket["channel_id"])  # Its channel was deleted by hand
 
-                await interaction.response.send_message(
-                    f"Ticket created: <#{ticket_channel.id}>",
-                    ephemeral=True
-                )
+    if rate_limited(ticket_limits, user.id, guild.id):
+        metrics.inc("anti_spam_rejections_total", (("limit", "ticket"),))
+        await respond(interaction, "Too many tickets are being opened right now. Please try again in a minute.", ephemeral=True)
+        return
 
-                # Welcome message with cancel option
-                cancel_button = Button(label="Cancel", style=discord.ButtonStyle.red, custom_id="cancel_ticket")
-                view = View()
-                view.add_item(cancel_button)
+    # Find or create the ticket category, then claim or create the ticket channel
+    category = await get_ticket_category(guild)
+    ticket_channel = await open_ticket_channel(guild, category, user)
 
-                await ticket_channel.send(
-                    f"{user.mention}, welcome to your ticket! Let's proceed with your purchase.",
-                    view=view
-                )
+    async def send_ticket_messages():
+        # Welcome message with cancel option
+        cancel_button = Button(label="Cancel", style=discord.ButtonStyle.red, custom_id="cancel_ticket")
+        view = StatelessView()
+        view.add_item(cancel_button)
+
+        await ticket_channel.send(
+            f"{user.mention}, welcome to your ticket! Let's proceed with your purchase.",
+            view=view
+        )
 
-                # Initialize transaction status for the user
-                transaction_status[user.id] = {"paid": False, "completed": False, "buyer_id": user.id}
+        # Use ItemSelectionView to allow the buyer to select items
+        view = ItemSelectionView(await catalogs.get(guild.id), user.id, ticket_channel.id)
+        await ticket_channel.send("Please select an item to purchase:", view=view)
 
-                # Use ItemSelectionView to allow the buyer to select items
-                view = ItemSelectionView(user.id)
-                await ticket_channel.send("Please select an item to purchase:", view=view)
+    # The reply, the ticket record and the channel messages don't depend on each other
+    await asyncio.gather(
+        respond(
+            interaction,
+            f"Ticket created: <#{ticket_channel.id}>",
+            ephemeral=True
+        ),
+        ticket_store.create_ticket(ticket_channel.id, guild.id, user.id),
+        send_ticket_messages()
+    )
+    ticket_scheduler.touch(ticket_channel.id)
 
-            elif custom_id == "mark_as_paid":
-                transaction_status[user_id]["paid"] = True
+@component_handler("mark_as_paid")
+async def handle_mark_as_paid(interaction, payload):
+    ticket = await get_owned_ticket(interaction)
+    if not ticket:
+        return
 
-                # Show a public embed with purchase details
-                cart = user_carts.get(user_id, {})
-                total_price = sum(stock[item]["price"] * quantity for item, quantity in cart.items())
-                payment_method = transaction_status[user_id]["payment_method"]
+    if not await ticket_store.transition(ticket["channel_id"], TICKET_AWAITING_PAYMENT, TICKET_PAID):
+        if ticket["status"] == TICKET_OPEN:
+            await interaction.response.send_message("Please choose a payment method first.", ephemeral=True)
+        else:
+            await interaction.response.send_message("This payment has already been marked as paid.", ephemeral=True)
+        return
+    ticket_scheduler.touch(ticket["channel_id"])
 
-                embed = discord.Embed(
-                    title="Payment Marked as Paid",
-                    description=f"{interaction.user.mention} has marked their payment as paid.",
-                    color=discord.Color.green()
-                )
-                embed.add_field(name="Items Purchased", value="\n".join([f"{item} x{quantity}" for item, quantity in cart.items()]), inline=False)
-                embed.add_field(name="Total Price", value=f"${total_price:.2f}", inline=False)
-                embed.add_field(name="Payment Method", value=payment_method, inline=False)
-                embed.set_thumbnail(url=REVIEW_EMBED_IMAGE)  # Image in top-right
+    cart = await ticket_store.get_cart(ticket["channel_id"])
+    await admin_queue.add(ticket, cart.total_cents)
 
-                await interaction.channel.send(embed=embed)
+    # Show a public embed with purchase details
+    embed = paid_embed(await get_config(interaction), ticket, cart, f"{interaction.user.mention} has marked their payment as paid.")
+    await interaction.channel.send(embed=embed)
 
-                # Deal Completed button for admins
-                # Include the buyer's ID in the custom_id
-                deal_completed_button = Button(
-                    label="Deal Completed",
-                    style=discord.ButtonStyle.green,
-                    custom_id=f"deal_completed_{user_id}"  # Store the buyer's ID in the custom_id
-                )
-                view = View()
-                view.add_item(deal_completed_button)
+    await interaction.response.send_message(
+        "Payment marked as paid. Waiting for admin to complete the deal.",
+        view=deal_completed_view(interaction.user.id, ticket["channel_id"])
+    )
 
-                await interaction.response.send_message(
-                    "Payment marked as paid. Waiting for admin to complete the deal.",
-                    view=view
-                )
+def paid_embed(config, ticket, cart, description):
+    embed = render_embed(config, "marked_as_paid")
+    embed.description = description
+    embed.add_field(name="Items Purchased", value=cart.summary(), inline=False)
+    embed.add_field(name="Total Price", value=format_cents(cart.total_cents), inline=False)
+    embed.add_field(name="Payment Method", value=ticket["payment_method"], inline=False)
+    return embed
+
+def deal_completed_view(buyer_id, channel_id):
+    # Deal Completed button for admins
+    # Include the buyer's ID in the custom_id
+    deal_completed_button = Button(
+        label="Deal Completed",
+        style=discord.ButtonStyle.green,
+        custom_id=encode_custom_id("deal_completed", buyer_id, channel_id)  # Store the buyer's ID in the custom_id
+    )
+    claim_button = Button(
+        label="Claim",
+        style=discord.ButtonStyle.grey,
+        custom_id=encode_custom_id("claim_deal", buyer_id, channel_id)
+    )
+    view = StatelessView()
+    view.add_item(deal_completed_button)
+    view.add_item(claim_button)
+    return view
+
+@component_handler("claim_deal")
+async def handle_claim_deal(interaction, payload):
+    # Claiming marks a deal as taken on the admin queue. Pressing it again gives the deal back.
+    if not await is_admin(interaction):
+        await interaction.response.send_message("You do not have permission to claim deals.", ephemeral=True)
+        return
 
-            elif custom_id.startswith("deal_completed_"):
-                # Extract the buyer's ID from the custom_id
-                buyer_id = int(custom_id.split("_")[2])
+    guild_id = interaction.guild_id
+    channel_id = payload.ticket_id or interaction.channel.id
+    entry = await admin_queue.get(guild_id, channel_id)
+    if entry is None:
+        await interaction.response.send_message("This deal is not waiting in the queue.", ephemeral=True)
+    elif entry["claimed_by"] == interaction.user.id:
+        await admin_queue.release(guild_id, channel_id, interaction.user.id)
+        await interaction.response.send_message(f"{interaction.user.mention} has released this deal.")
+    elif await admin_queue.claim(guild_id, channel_id, interaction.user.id):
+        await interaction.response.send_message(f"{interaction.user.mention} is handling this deal.")
+    else:
+        await interaction.response.send_message(f"<@{entry['claimed_by']}> is already handling this deal.", ephemeral=True)
 
-                # Check if the user is an admin
-                if interaction.user.id not in ADMIN_IDS:
-                    await interaction.response.send_message("You do not have permission to complete the deal.", ephemeral=True)
-                    return
+@component_handler("deal_completed", defer=True)
+async def handle_deal_completed(interaction, payload):
+    buyer_id = payload.buyer_id
 
-                # Show Leave a Review button (only for the ticket owner)
-                leave_review_button = Button(label="Leave a Review", style=discord.ButtonStyle.green, custom_id="leave_review")
-                view = View()
-                view.add_item(leave_review_button)
+    # Check if the user is an admin
+    if not await is_admin(interaction):
+        await respond(interaction, "You do not have permission to complete the deal.", ephemeral=True)
+        return
 
-                embed = discord.Embed(
-                    title="Deal Completed",
-                    description=f"{interaction.user.mention}, give a review. If you don't, you will be blacklisted.",
-                    color=discord.Color.green()
-                )
-                embed.set_thumbnail(url=REVIEW_EMBED_IMAGE)  # Image in top-right
+    ticket = await ticket_store.get_ticket(payload.ticket_id or interaction.channel.id)
+    if not ticket or ticket["buyer_id"] != buyer_id:
+        await respond(interaction, "No open deal found for this ticket.", ephemeral=True)
+        return
 
-                await interaction.response.send_message(
-                    embed=embed,
-                    view=view
-                )
+    entry = await admin_queue.get(ticket["guild_id"], ticket["channel_id"])
+    if entry and entry["claimed_by"] not in (None, interaction.user.id):
+        await respond(interaction, f"<@{entry['claimed_by']}> has claimed this deal.", ephemeral=True)
+        return
 
-            elif custom_id == "leave_review":
-                if interaction.user.id != transaction_status[user_id]["buyer_id"]:
-                    await interaction.response.send_message("Only the ticket owner can leave a review.", ephemeral=True)
-                    return
+    if not await ticket_store.transition(ticket["channel_id"], TICKET_PAID, TICKET_COMPLETED):
+        await respond(interaction, "This deal has already been completed.", ephemeral=True)
+        return
+    ticket_scheduler.touch(ticket["channel_id"])
+    await admin_queue.remove(ticket["guild_id"], ticket["channel_id"])
+
+    # Record the deal in the ledger and the sales analytics
+    cart = await ticket_store.get_cart(ticket["channel_id"])
+    await asyncio.gather(
+        asyncio.to_thread(deal_ledger.record_deal, buyer_id, cart.total_cents),
+        ticket_store.record_sale(ticket, cart)
+    )
 
-                # Ask for review
-                review_modal = ReviewModal()
-                await interaction.response.send_modal(review_modal)
+    # Show Leave a Review button (only for the ticket owner)
+    leave_review_button = Button(label="Leave a Review", style=discord.ButtonStyle.green, custom_id="leave_review")
+    view = StatelessView()
+    view.add_item(leave_review_button)
 
-            elif custom_id == "cancel_ticket":
-                if isinstance(interaction.channel, discord.TextChannel) and interaction.channel.name.startswith("ticket-"):
-                    await interaction.response.send_message("Closing and deleting this ticket...", ephemeral=True)
-                    await interaction.channel.delete()
-                else:
-                    await interaction.response.send_message("This command can only be used in a ticket channel.", ephemeral=True)
+    embed = render_embed(await get_config(interaction), "deal_completed")
+    embed.description = f"{interaction.user.mention}, give a review. If you don't, you will be blacklisted."
+
+    await respond(
+        interaction,
+        embed=embed,
+        view=view
+    )
 
-            elif custom_id == "add_more":
-                view = ItemSelectionView(user_id)
-                await interaction.response.send_message("Please select another item to purchase:", view=view, ephemeral=True)
+@component_handler("leave_review")
+async def handle_leave_review(interaction, payload):
+    ticket = await ticket_store.get_ticket(interaction.channel.id)
+    if not ticket or interaction.user.id != ticket["buyer_id"]:
+        await interaction.response.send_message("Only the ticket owner can leave a review.", ephemeral=True)
+        return
+    if ticket["status"] == TICKET_REVIEWED:
+        await interaction.response.send_message("You have already left a review for this order.", ephemeral=True)
+        return
 
-            elif custom_id == "remove_items":
-                if user_id not in user_carts or not user_carts[user_id]:
-                    await interaction.response.send_message("Your cart is empty.", ephemeral=True)
-                    return
+    # Ask for review
+    review_modal = ReviewModal(ticket["channel_id"])
+    await interaction.response.send_modal(review_modal)
+
+@component_handler("cancel_ticket")
+async def handle_cancel_ticket(interaction, payload):
+    if isinstance(interaction.channel, discord.TextChannel) and interaction.channel.name.startswith("ticket-"):
+        await interaction.response.send_message("Closing and deleting this ticket...", ephemeral=True)
+        await close_ticket(interaction.channel, "Ticket cancelled")
+    else:
+        await interaction.response.send_message("This command can only be used in a ticket channel.", ephemeral=True)
 
-                view = RemoveItemsView(user_id)
-                await interaction.response.send_message("Select an item to remove from your cart:", view=view, ephemeral=True)
+@component_handler("add_more")
+async def handle_add_more(interaction, payload):
+    ticket = await get_editable_ticket(interaction)
+    if not ticket:
+        return
 
-            elif custom_id == "done":
-                user = interaction.user
-                cart = user_carts.get(user_id, {})
+    view = ItemSelectionView(await catalogs.get(ticket["guild_id"]), interaction.user.id, ticket["channel_id"])
+    await interaction.response.send_message("Please select another item to purchase:", view=view, ephemeral=True)
 
-                if not cart:
-                    await interaction.response.send_message("Your cart is empty.", ephemeral=True)
-                    return
+@component_handler("remove_items")
+async def handle_remove_items(interaction, payload):
+    ticket = await get_editable_ticket(interaction)
+    if not ticket:
+        return
 
-                total_price = sum(stock[item]["price"] * quantity for item, quantity in cart.items())
-                embed = discord.Embed(
-                    title="Your Cart",
-                    description="Here are the items in your cart:",
-                    color=discord.Color.blue()
-                )
+    cart = await ticket_store.get_cart(ticket["channel_id"])
+    if not cart:
+        await interaction.response.send_message("Your cart is empty.", ephemeral=True)
+        return
 
-                for item, quantity in cart.items():
-                    embed.add_field(
-                        name=item,
-                        value=f"Quantity: {quantity}\nPrice: ${stock[item]['price'] * quantity:.2f}",
-                        inline=False
-                    )
+    view = RemoveItemsView(interaction.user.id, ticket["channel_id"], cart)
+    await interaction.response.send_message("Select an item to remove from your cart:", view=view, ephemeral=True)
 
-                embed.add_field(
-                    name="Total Price",
-                    value=f"${total_price:.2f}",
-                    inline=False
-                )
+@component_handler("done")
+async def handle_done(interaction, payload):
+    ticket = await get_editable_ticket(interaction, cart=False)
+    if not ticket:
+        return
+
+    cart = await ticket_store.get_cart(ticket["channel_id"])
+
+    if not cart:
+        await interaction.response.send_message("Your cart is empty.", ephemeral=True)
+        return
+
+    config = await get_config(interaction)
+    if not any(option.value in config["payment_details"] for option in PAYMENT_OPTIONS):
+        await interaction.response.send_message("This store hasn't set up any payment methods yet. Please ask an admin.", ephemeral=True)
+        return
+
+    embed = render_embed(config, "cart")
 
-                embed.set_footer(text="Proceed to payment.")
-                embed.set_thumbnail(url=REVIEW_EMBED_IMAGE)  # Image in top-right
+    for item, line in cart.lines.items():
+        embed.add_field(
+            name=item,
+            value=f"Quantity: {line.quantity}\nPrice: {format_cents(line.subtotal_cents)}",
+            inline=False
+        )
+
+    embed.add_field(
+        name="Total Price",
+        value=format_cents(cart.total_cents),
+        inline=False
+    )
 
-                await interaction.response.send_message(embed=embed, view=PaymentMethodDropdown(user_id), ephemeral=True)
-bot.run("MTMzODY1MTgxNjMxNjg5OTQzOQ.G0LUlR.qqQfCTp1aueC2zowNAbcum-tCoYsttcM5M85uc")
\ No newline at end of file
+    await interaction.response.send_message(embed=embed, view=PaymentMethodDropdown(config, interaction.user.id, ticket["channel_id"]), ephemeral=True)
+# Importing this module sets everything up without connecting, so the bot can be driven offline
+# against a fake gateway and HTTP client
+if __name__ == "__main__":
+    bot.run("MTMzODY1MTgxNjMxNjg5OTQzOQ.G0LUlR.qqQfCTp1aueC2zowNAbcum-tCoYsttcM5M85uc")
\ No newline at end of file
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# rev.py opens its store and deal files when it's imported, so point it at a scratch directory first.
+# This replaces any DATA_DIR already set, the tests must never touch a real deployment's files.
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="rev-tests-")
+os.environ["METRICS_PORT"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
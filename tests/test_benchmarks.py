@@ -0,0 +1,99 @@
+import json
+import os
+import subprocess
+import sys
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench")
+
+def run_bench(tmp_path, script, *args):
+    # Small runs of the benchmarks, each in its own process with its own DATA_DIR. Returns the JSON report.
+    report_path = tmp_path / "report.json"
+    result = subprocess.run(
+        [sys.executable, os.path.join(BENCH_DIR, script), "--data-dir", str(tmp_path), "--json", str(report_path), *args],
+        capture_output=True, text=True, timeout=300
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    return json.loads(report_path.read_text())
+
+def test_ledger_save_cost_is_flat(tmp_path):
+    report = run_bench(tmp_path, "ledger.py", "--sizes", "1000,100000", "--deals", "1200", "--max-growth", "5")
+    assert [result["customers"] for result in report["sizes"]] == [1000, 100000]
+    assert report["sizes"][0]["compactions"] == 1
+
+def test_store_interactions_with_open_tickets(tmp_path):
+    report = run_bench(tmp_path, "store.py", "--open-tickets", "1000", "--rate", "1000", "--max-p99", "1")
+    assert report["interaction"]["count"] == 1000
+
+def test_ticket_rush_opens_every_ticket(tmp_path):
+    report = run_bench(
+        tmp_path, "tickets.py", "--guilds", "5", "--per-guild", "4", "--rest-latency", "0.01", "--create-latency", "0.02"
+    )
+    assert [run["pool_size"] for run in report["runs"]] == [0, 3]
+    assert all(run["tickets"] == 20 for run in report["runs"])
+
+def test_quantity_prompt_adds_no_message_listeners(tmp_path):
+    report = run_bench(tmp_path, "messages.py", "--shoppers", "40", "--messages", "5000", "--ramp", "1")
+    assert report["parked"] == 40
+    assert report["message_listeners"] == 0
+
+def test_templates_allocate_less(tmp_path):
+    report = run_bench(tmp_path, "templates.py", "--iterations", "2000")
+    assert set(report["cases"]) == {"setup", "cart", "marked_as_paid", "deal_completed", "review", "payment"}
+    assert report["cases"]["payment"]["after_kb"] < report["cases"]["payment"]["before_kb"]
+
+def test_views_restore_lazily_after_a_restart(tmp_path):
+    report = run_bench(tmp_path, "views.py", "--tickets", "2000", "--guilds", "10", "--clicks", "20", "--ramp", "0.5", "--rest-latency", "0.01")
+    assert report["persistent_views"] == 0
+    assert report["first_use"]["count"] == 20
+
+def test_prefix_router_turns_chat_away_cheaply(tmp_path):
+    # What's left for chat is on_message's own coroutine frame, bigger than an empty handler's
+    report = run_bench(tmp_path, "prefix.py", "--messages", "20000", "--distinct", "2000", "--max-chat-bytes", "128")
+    assert report["commands"] > 0
+    assert report["messages_per_second"] > report["process_commands_per_second"]
+
+def test_spammers_get_one_ticket_each(tmp_path):
+    report = run_bench(
+        tmp_path, "spam.py", "--users", "20", "--guilds", "4", "--spammers", "4", "--ramp", "1", "--rest-latency", "0.01"
+    )
+    assert [run["completed"] for run in report["runs"]] == [20, 20]
+    assert report["runs"][1]["spam_answers"].get("ticket opened", 0) <= 4
+
+def test_scheduler_closes_overdue_tickets(tmp_path):
+    report = run_bench(tmp_path, "scheduler.py", "--tickets", "5000", "--overdue", "5", "--guilds", "10", "--idle", "1", "--rest-latency", "0.01")
+    assert report["closed"] == report["transcripts"] == 5
+    assert report["scheduler_memory_mb"] < report["tasks_memory_mb"]
+
+def test_transcript_export_memory_is_bounded(tmp_path):
+    report = run_bench(tmp_path, "transcripts.py", "--sizes", "300,3000", "--rest-latency", "0")
+    assert report["complete_transcripts"] == 2 and report["closed"]
+    assert report["sizes"][-1]["peak_kb"] < report["sizes"][-1]["buffered_peak_kb"]
+
+def test_metrics_overhead_is_small(tmp_path):
+    report = run_bench(tmp_path, "metrics.py", "--iterations", "20000", "--users", "20", "--guilds", "4", "--ramp", "1", "--rest-latency", "0.01", "--max-overhead", "5")
+    assert report["handler_observations"] > 0 and report["rest_observations"] > 0
+
+def test_deal_stats_load_without_parsing(tmp_path):
+    report = run_bench(tmp_path, "dealstats.py", "--sizes", "1000,50000", "--lookups", "1000")
+    assert [result["missing"] for result in report["sizes"]] == [0, 0]
+    assert report["sizes"][-1]["load_ms"] < report["sizes"][-1]["legacy_load_ms"]
+
+def test_payment_watcher_marks_paid_tickets(tmp_path):
+    report = run_bench(tmp_path, "payments.py", "--pending", "3000", "--paid", "20", "--cycles", "2", "--guilds", "10", "--chain-latency", "0.01", "--rest-latency", "0.01")
+    assert report["paid"] == report["expected_paid"] == 40
+    assert all(cycle["requests"] == 3 for cycle in report["cycles"])
+
+def test_analytics_totals_match_the_deals(tmp_path):
+    report = run_bench(tmp_path, "analytics.py", "--checkpoints", "500,2000", "--guilds", "3", "--buyers", "500")
+    assert report["mismatched_totals"] == []
+    assert [result["deals"] for result in report["checkpoints"]] == [500, 2000]
+
+def test_catalog_pages_render_in_constant_time(tmp_path):
+    report = run_bench(tmp_path, "catalog.py", "--sizes", "1000,20000", "--repeat", "50", "--changes", "10")
+    assert [result["pages"] for result in report["sizes"]] == [40, 800]
+    assert all(result["stale_pages"] == 0 for result in report["sizes"])
+
+def test_rate_limiter_buckets_expire(tmp_path):
+    report = run_bench(tmp_path, "ratelimit.py", "--users", "20000", "--arrivals", "1000", "--spam-seconds", "10")
+    assert report["limits"]["interaction"]["most_buckets"] <= 12000
+    assert report["limits"]["interaction"]["spam"]["most_accepted"] <= 15
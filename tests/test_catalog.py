@@ -0,0 +1,54 @@
+import asyncio
+
+import rev
+
+def stock(categories, per_category=3):
+    return {
+        f"Item {category:03d}-{number}": {"price_cents": 100, "description": "An item", "category": f"Category {category:03d}"}
+        for category in range(categories) for number in range(per_category)
+    }
+
+def browse_categories(catalog):
+    # Follows "More categories" from the first page until it comes back around
+    seen, page, pages = [], 0, 0
+    while True:
+        options = catalog.category_options(page)
+        assert len(options) <= rev.CATALOG_PAGE_SIZE
+        assert options[0].value == rev.ALL_CATEGORIES
+        seen += [option.value for option in options[1:] if not option.value.startswith(rev.ALL_CATEGORIES)]
+        pages += 1
+        more = [option.value for option in options if option.value.startswith(rev.ALL_CATEGORIES) and option.value != rev.ALL_CATEGORIES]
+        if not more or int(more[0][1:]) == 0:
+            return seen, pages
+        page = int(more[0][1:])
+
+def test_every_category_can_be_browsed():
+    catalog = rev.Catalog(stock(60))
+    seen, pages = browse_categories(catalog)
+    assert seen == sorted(catalog.categories) and pages == catalog.category_page_count() == 3
+    assert catalog.category_page_of("Category 059") == 2
+
+def test_few_categories_fit_one_page():
+    catalog = rev.Catalog(stock(5))
+    assert [option.value for option in catalog.category_options()] == [rev.ALL_CATEGORIES] + sorted(catalog.categories)
+
+def test_category_pages_are_cached_until_a_category_changes():
+    catalog = rev.Catalog(stock(30))
+    first = catalog.category_options(0)
+    catalog.add("Item 000-9", {"price_cents": 100, "description": "An item", "category": "Category 000"})
+    assert catalog.category_options(0) is first  # Same categories, same options
+    catalog.add("Aardvark", {"price_cents": 100, "description": "An item", "category": "Aardvarks"})
+    assert catalog.category_options(0)[1].value == "Aardvarks"
+    catalog.remove("Aardvark")
+    assert "Aardvarks" not in [option.value for option in catalog.category_options(0)]
+
+def test_view_opens_the_category_page_of_the_filter():
+    catalog = rev.Catalog(stock(60))
+
+    async def scenario():
+        view = rev.ItemSelectionView(catalog, 1, 2, 0, "Category 050")
+        select = next(child for child in view.children if child.custom_id.startswith("item_category"))
+        assert "Category 050" in [option.value for option in select.options]
+        assert rev.decode_custom_id(select.custom_id).extra == "Category 050"
+
+    asyncio.run(scenario())
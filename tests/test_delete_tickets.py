@@ -0,0 +1,46 @@
+import asyncio
+import sqlite3
+
+import rev
+
+class FakeGuild:
+    # Ticket channels with even ids still exist, odd ones are already gone
+    def get_channel(self, channel_id):
+        return channel_id if channel_id % 2 == 0 else None
+
+def test_failures_are_counted_and_the_rest_still_go(monkeypatch):
+    errors = {2: sqlite3.OperationalError("database is locked"), 4: asyncio.TimeoutError(), 5: KeyError("cart")}
+
+    async def archive_and_delete(channel_id, reason):
+        if channel_id in errors:
+            raise errors[channel_id]
+
+    async def delete_ticket(channel_id):
+        if channel_id in errors:
+            raise errors[channel_id]
+
+    monkeypatch.setattr(rev, "archive_and_delete", archive_and_delete)
+    monkeypatch.setattr(rev.ticket_store, "delete_ticket", delete_ticket)
+    progress = []
+
+    async def on_progress(counts):
+        progress.append(dict(counts))
+
+    tickets = [{"channel_id": channel_id} for channel_id in range(1, 11)]
+    counts = asyncio.run(rev.delete_tickets(FakeGuild(), tickets, on_progress))
+    assert counts == {"deleted": 7, "failed": 3}
+    assert len(progress) == 10 and progress[-1] == counts
+
+def test_progress_is_reported_when_everything_fails(monkeypatch):
+    async def archive_and_delete(channel_id, reason):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(rev, "archive_and_delete", archive_and_delete)
+    progress = []
+
+    async def on_progress(counts):
+        progress.append(dict(counts))
+
+    tickets = [{"channel_id": channel_id} for channel_id in range(2, 12, 2)]
+    assert asyncio.run(rev.delete_tickets(FakeGuild(), tickets, on_progress)) == {"deleted": 0, "failed": 5}
+    assert [counts["failed"] for counts in progress] == [1, 2, 3, 4, 5]
@@ -0,0 +1,21 @@
+import rev
+
+def test_rendered_embeds_leave_the_template_alone():
+    config = rev.GuildConfig(None, {})
+    template = rev.cached_embed(config, "setup").to_dict()
+
+    first = rev.render_embed(config, "setup")
+    first.add_field(name="Extra", value="only on the first copy")
+    first.set_field_at(0, name="Changed", value="only on the first copy")
+    first.set_footer(text="Changed")
+    first.description = "Changed"
+
+    second = rev.render_embed(config, "setup")
+    assert second.to_dict() == template
+    assert rev.cached_embed(config, "setup").to_dict() == template
+    assert len(first.fields) == len(second.fields) + 1
+
+def test_rendered_embed_matches_a_fresh_build():
+    config = rev.GuildConfig(None, {"payment_details": rev.PAYMENT_DETAILS})
+    for name, build in rev.embed_builders.items():
+        assert rev.render_embed(config, name).to_dict() == build(config).to_dict(), name
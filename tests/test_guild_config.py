@@ -0,0 +1,32 @@
+import rev
+
+HOME_GUILD_ID = 1
+OTHER_GUILD_ID = 2
+
+def leaves(value):
+    # Every id, address and text in a settings value
+    if isinstance(value, dict):
+        for item in value.values():
+            yield from leaves(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from leaves(item)
+    else:
+        yield value
+
+def test_other_guilds_inherit_no_home_settings(monkeypatch):
+    monkeypatch.setattr(rev, "HOME_GUILD_ID", HOME_GUILD_ID)
+    home = rev.GuildConfig(HOME_GUILD_ID, {})
+    other = rev.GuildConfig(OTHER_GUILD_ID, {})
+    assert home["reviews_channel_id"] == rev.REVIEWS_CHANNEL_ID
+    assert other["reviews_channel_id"] is None
+
+    home_only = set(leaves(rev.HOME_GUILD_CONFIG)) - set(leaves(rev.DEFAULT_GUILD_CONFIG))
+    assert rev.REVIEWS_CHANNEL_ID in home_only and rev.PAYMENT_DETAILS["BTC"]["address"] in home_only
+    assert not home_only & set(leaves(other.settings))
+    assert home_only <= set(leaves(home.settings))
+
+def test_overrides_win_over_home_defaults(monkeypatch):
+    monkeypatch.setattr(rev, "HOME_GUILD_ID", HOME_GUILD_ID)
+    assert rev.GuildConfig(OTHER_GUILD_ID, {"reviews_channel_id": 42})["reviews_channel_id"] == 42
+    assert rev.GuildConfig(HOME_GUILD_ID, {"reviews_channel_id": 42})["reviews_channel_id"] == 42
@@ -0,0 +1,38 @@
+import json
+import os
+import subprocess
+import sys
+
+HARNESS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench", "harness.py")
+FLOWS = {"setup_embed", "purchase", "item_select", "quantity", "done", "payment_method", "mark_as_paid", "deal_completed", "review"}
+
+def test_every_flow_completes_offline(tmp_path):
+    # A small run of the CI benchmark gate. It runs in its own process, since it logs the bot in.
+    report_path = tmp_path / "report.json"
+    result = subprocess.run(
+        [
+            sys.executable, HARNESS, "--users", "30", "--ramp", "1", "--rest-latency", "0.01",
+            "--data-dir", str(tmp_path / "data"), "--json", str(report_path),
+            "--max-p99", "2", "--max-rest-per-ticket", "25"
+        ],
+        capture_output=True, text=True, timeout=300
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+
+    report = json.loads(report_path.read_text())
+    assert report["completed"] == 30
+    assert FLOWS <= set(report["steps"])
+    assert report["open_tickets"] == 30
+
+def test_clusters_share_one_store(tmp_path):
+    # Two cluster processes on one DATA_DIR: each serves its own shard's guilds, and every ticket,
+    # deal and lock goes through the shared store
+    result = subprocess.run(
+        [
+            sys.executable, os.path.join(os.path.dirname(HARNESS), "clusters.py"), "--clusters", "2", "--users", "40",
+            "--setup-time", "5", "--data-dir", str(tmp_path), "--ramp", "1", "--rest-latency", "0.01"
+        ],
+        capture_output=True, text=True, timeout=300
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "Total: 40/40 shoppers completed" in result.stdout
@@ -0,0 +1,146 @@
+import asyncio
+import time
+
+import discord
+import pytest
+
+import rev
+
+CHANNEL_ID = 1234
+GUILD_ID = 99
+
+class FakeResponse:
+    # Enough of aiohttp's response for discord.HTTPException
+    def __init__(self, status):
+        self.status = status
+        self.reason = "Fake"
+
+class FakeChannel:
+    # A reviews channel that fails its next sends with the given HTTP statuses or exceptions, then accepts
+    def __init__(self, failures=()):
+        self.id = CHANNEL_ID
+        self.failures = list(failures)
+        self.attempts = 0
+        self.sent = []  # Embeds of each message that went through
+
+    async def send(self, embeds):
+        self.attempts += 1
+        if self.failures:
+            status = self.failures.pop(0)
+            if isinstance(status, Exception):
+                raise status
+            error = discord.DiscordServerError if status >= 500 else discord.HTTPException
+            raise error(FakeResponse(status), {"message": "injected", "code": 0})
+        assert len(embeds) <= rev.REVIEW_BATCH_SIZE
+        assert sum(len(embed) for embed in embeds) <= rev.REVIEW_BATCH_CHARS
+        self.sent.append(embeds)
+
+def review(number, length=20):
+    embed = discord.Embed(title=f"Review {number}", description="x" * length)
+    embed.add_field(name="Star Rating", value="⭐" * 5)
+    return embed
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / "tickets.db")
+
+def open_outbox(store_path):
+    return rev.ReviewOutbox(rev.TicketStore(store_path))
+
+async def post(outbox, reviews):
+    for embed in reviews:
+        await outbox.post(GUILD_ID, CHANNEL_ID, embed)
+
+def test_batches_at_most_ten_embeds(store_path):
+    async def scenario():
+        outbox = open_outbox(store_path)
+        await post(outbox, [review(number) for number in range(25)])
+        channel = FakeChannel()
+        assert await outbox.publish_channel(channel) is None
+        assert [len(embeds) for embeds in channel.sent] == [10, 10, 5]
+        assert [embed.title for embeds in channel.sent for embed in embeds] == [f"Review {number}" for number in range(25)]
+        assert await outbox.store.pending_reviews(CHANNEL_ID) == []
+
+    asyncio.run(scenario())
+
+def test_batches_stay_under_the_embed_text_limit(store_path):
+    async def scenario():
+        outbox = open_outbox(store_path)
+        await post(outbox, [review(number, length=2500) for number in range(5)])
+        channel = FakeChannel()
+        await outbox.publish_channel(channel)
+        assert [len(embeds) for embeds in channel.sent] == [2, 2, 1]
+
+    asyncio.run(scenario())
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_backs_off_and_keeps_reviews_until_sent(store_path, status):
+    async def scenario():
+        outbox = open_outbox(store_path)
+        await post(outbox, [review(number) for number in range(3)])
+        channel = FakeChannel(failures=[status, status])
+
+        first = await outbox.publish_channel(channel)
+        assert rev.REVIEW_RETRY_BASE <= first <= rev.REVIEW_RETRY_BASE * 1.25
+        second = await outbox.publish_channel(channel)
+        assert 2 * rev.REVIEW_RETRY_BASE <= second <= 2 * rev.REVIEW_RETRY_BASE * 1.25  # Doubles on each failure in a row
+        assert len(await outbox.store.pending_reviews(CHANNEL_ID)) == 3
+
+        assert await outbox.publish_channel(channel) is None
+        assert [len(embeds) for embeds in channel.sent] == [3]
+        assert channel.id not in outbox.failures and channel.id not in outbox.retry_at
+        assert await outbox.store.pending_reviews(CHANNEL_ID) == []
+
+    asyncio.run(scenario())
+
+def test_waits_as_long_as_discord_asks(store_path):
+    async def scenario():
+        outbox = open_outbox(store_path)
+        await post(outbox, [review(number) for number in range(3)])
+        channel = FakeChannel(failures=[discord.RateLimited(42.5)])
+        assert await outbox.publish_channel(channel) == 42.5  # Not the 1s the backoff would start at
+        assert outbox.retry_at[channel.id] - time.monotonic() > 40
+        assert len(await outbox.store.pending_reviews(CHANNEL_ID)) == 3
+
+        assert await outbox.publish_channel(channel) is None
+        assert [len(embeds) for embeds in channel.sent] == [3]
+
+    asyncio.run(scenario())
+
+def test_backoff_is_capped(store_path):
+    outbox = open_outbox(store_path)
+    for _ in range(20):
+        delay = outbox.back_off(CHANNEL_ID)
+    assert rev.REVIEW_RETRY_MAX <= delay <= rev.REVIEW_RETRY_MAX * 1.25
+
+def test_rejected_reviews_are_dropped(store_path):
+    async def scenario():
+        outbox = open_outbox(store_path)
+        await post(outbox, [review(number) for number in range(3)])
+        channel = FakeChannel(failures=[400])
+        assert await outbox.publish_channel(channel) is None  # Sending again would fail the same way
+        assert channel.sent == [] and await outbox.store.pending_reviews(CHANNEL_ID) == []
+
+    asyncio.run(scenario())
+
+def test_replays_the_outbox_after_a_restart(store_path, monkeypatch):
+    channel = FakeChannel(failures=[429])
+    monkeypatch.setattr(rev.bot, "get_channel", lambda channel_id: channel if channel_id == CHANNEL_ID else None)
+
+    async def before_restart():
+        outbox = open_outbox(store_path)
+        await post(outbox, [review(number) for number in range(12)])
+        delay = await outbox.publish_pending()  # Rate limited, nothing is sent
+        assert delay is not None and delay > 0
+        assert await outbox.publish_pending() is not None  # Still backing off, the channel isn't tried
+        assert channel.attempts == 1
+        outbox.store.executor.shutdown()
+
+    async def after_restart():
+        outbox = open_outbox(store_path)  # Same file, nothing carried over in memory
+        assert await outbox.publish_pending() is None
+        assert [len(embeds) for embeds in channel.sent] == [10, 2]
+        assert await outbox.store.review_channels() == []
+
+    asyncio.run(before_restart())
+    asyncio.run(after_restart())
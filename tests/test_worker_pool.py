@@ -0,0 +1,73 @@
+import asyncio
+
+import rev
+
+GUILD_ID = 99
+CHANNEL_ID = 1234
+USER_ID = 42
+
+class FakeUser:
+    id = USER_ID
+
+class FakeResponse:
+    def __init__(self):
+        self.deferred = False
+
+    def is_done(self):
+        return self.deferred
+
+    async def defer(self, **kwargs):
+        self.deferred = True
+
+class FakeFollowup:
+    def __init__(self):
+        self.sent = asyncio.Queue()
+
+    async def send(self, content=None, **kwargs):
+        await self.sent.put((content, kwargs))
+
+class FakeInteraction:
+    # A component click with just what dispatch_component and the worker pool use
+    def __init__(self, custom_id):
+        self.data = {"custom_id": custom_id}
+        self.user = FakeUser()
+        self.guild_id = GUILD_ID
+        self.channel_id = CHANNEL_ID
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+def test_failed_deferred_handler_still_answers(monkeypatch):
+    monkeypatch.setattr(rev, "worker_pool", rev.WorkerPool(1, 10, 10))
+
+    @rev.component_handler("test_explode", defer=True)
+    async def explode(interaction, payload):
+        raise RuntimeError("injected")
+
+    async def scenario():
+        interaction = FakeInteraction(rev.encode_custom_id("test_explode", USER_ID, CHANNEL_ID))
+        await rev.dispatch_component(interaction)
+        assert interaction.response.deferred
+        content, kwargs = await asyncio.wait_for(interaction.followup.sent.get(), 5)
+        assert content == rev.WORKER_ERROR_MESSAGE and kwargs["ephemeral"]
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        for registry in (rev.component_handlers, rev.component_lock_scopes):
+            registry.pop("test_explode", None)
+        rev.deferred_actions.discard("test_explode")
+
+def test_failed_slow_command_still_answers(monkeypatch):
+    monkeypatch.setattr(rev, "worker_pool", rev.WorkerPool(1, 10, 10))
+
+    @rev.slow_command
+    async def explode(interaction):
+        raise RuntimeError("injected")
+
+    async def scenario():
+        interaction = FakeInteraction("unused")
+        await explode(interaction)
+        content, kwargs = await asyncio.wait_for(interaction.followup.sent.get(), 5)
+        assert content == rev.WORKER_ERROR_MESSAGE and kwargs["ephemeral"]
+
+    asyncio.run(scenario())